@@ -53,6 +53,29 @@ logs['batch_matmul'] = benchmark.run_op_benchmark(sess, batch_matmul_op)
 print('Multiplying %s by %s takes %f seconds.' % (one_matrix, matrices,
                                                  logs['batch_matmul']['wall_time']))
 
+matmul_round_op = t3f.round(t3f.matmul(one_matrix, one_vec100),
+                            max_tt_rank=10).op
+logs['matmul_round'] = benchmark.run_op_benchmark(sess, matmul_round_op)
+print('Multiplying %s by %s and rounding the result takes %f seconds.' %
+      (one_matrix, one_vec100, logs['matmul_round']['wall_time']))
+
+matmul_rounded_op = t3f.matmul(one_matrix, one_vec100, max_tt_rank=10).op
+logs['matmul_rounded'] = benchmark.run_op_benchmark(sess, matmul_rounded_op)
+print('Multiplying %s by %s with rounding on the fly takes %f seconds.' %
+      (one_matrix, one_vec100, logs['matmul_rounded']['wall_time']))
+
+multiply_round_op = t3f.round(t3f.multiply(one_vec, one_vec),
+                              max_tt_rank=10).op
+logs['multiply_round'] = benchmark.run_op_benchmark(sess, multiply_round_op)
+print('Elementwise product of %s by itself and rounding the result takes %f '
+      'seconds.' % (one_vec, logs['multiply_round']['wall_time']))
+
+multiply_rounded_op = t3f.multiply(one_vec, one_vec, max_tt_rank=10).op
+logs['multiply_rounded'] = benchmark.run_op_benchmark(sess,
+                                                      multiply_rounded_op)
+print('Elementwise product of %s by itself with rounding on the fly takes %f '
+      'seconds.' % (one_vec, logs['multiply_rounded']['wall_time']))
+
 norm_op = t3f.frobenius_norm(one_matrix, differentiable=True).op
 logs['norm'] = benchmark.run_op_benchmark(sess, norm_op)
 print('Computing the norm of %s takes %f seconds.' % (one_matrix, logs['norm']['wall_time']))
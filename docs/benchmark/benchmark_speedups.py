@@ -0,0 +1,143 @@
+import numpy as np
+import pickle
+import argparse
+import time
+import tensorflow.compat.v1 as tf
+import tmp_benchmark_config
+
+from tensorflow.python.client import device_lib
+import t3f
+
+parser = argparse.ArgumentParser(description='Compare execution time of '
+                                 't3f operations against their previous '
+                                 'implementations.')
+parser.add_argument('--file_path', help='Path to the file to save logs.')
+args = parser.parse_args()
+
+tf.disable_v2_behavior()
+tmp_benchmark_config.import_benchmark_config()
+sess = tf.Session(config=tf.test.benchmark_config())
+print(device_lib.list_local_devices())
+benchmark = tf.test.Benchmark()
+logs = {}
+
+
+# Dense matrix by TT-matrix, the forward pass of t3f.nn.KerasDense.
+def dense_tt_matmul_transposes(matrix_a, tt_matrix_b):
+  """The previous implementation of t3f.ops.dense_tt_matmul."""
+  a_t = tf.transpose(matrix_a)
+  b_t = t3f.transpose(tt_matrix_b)
+  return tf.transpose(t3f.ops.tt_dense_matmul(b_t, a_t))
+
+shape = (4, 8, 8, 4)
+tt_matrix = t3f.random_matrix((shape, shape), tt_rank=16)
+tt_matrix = t3f.get_variable('dense_tt_matmul_matrix', initializer=tt_matrix)
+sess.run(tf.global_variables_initializer())
+for batch_size in [64, 512, 4096]:
+  activations = tf.Variable(tf.random_normal((batch_size, np.prod(shape))))
+  sess.run(activations.initializer)
+  activations = activations.value()
+  old_op = dense_tt_matmul_transposes(activations, tt_matrix).op
+  new_op = t3f.matmul(activations, tt_matrix).op
+  old_logs = benchmark.run_op_benchmark(sess, old_op)
+  new_logs = benchmark.run_op_benchmark(sess, new_op)
+  logs['dense_tt_matmul_transposes_%d' % batch_size] = old_logs
+  logs['dense_tt_matmul_%d' % batch_size] = new_logs
+  print('Multiplying a batch of %d activations by %s takes %f seconds '
+        '(%f seconds with transposes).' % (batch_size, tt_matrix,
+                                           new_logs['wall_time'],
+                                           old_logs['wall_time']))
+
+
+# Gathering elements of a TT-tensor, the hot path of tensor completion.
+shape = 10 * np.ones(8, dtype=int)
+tens = t3f.get_variable('gather_nd_tens',
+                        initializer=t3f.random_tensor(shape, tt_rank=10))
+sess.run(tf.global_variables_initializer())
+num_elements = 1000000
+np.random.seed(0)
+uniform_idx = np.random.randint(0, 10, size=(num_elements, len(shape)))
+# Observed entries concentrated around few values of the leading modes
+# (e.g. few users and items with many observations each).
+prefixes = np.random.randint(0, 10, size=(100, len(shape) // 2))
+clustered_idx = np.hstack((prefixes[np.random.randint(0, 100, num_elements)],
+                           uniform_idx[:, len(shape) // 2:]))
+sorted_idx = uniform_idx[np.lexsort(uniform_idx.T[::-1])]
+for idx_name, idx in [('uniform', uniform_idx), ('clustered', clustered_idx),
+                      ('sorted', sorted_idx)]:
+  idx = tf.constant(idx)
+  old_op = t3f.gather_nd(tens, idx).op
+  new_op = t3f.gather_nd(tens, idx, share_prefixes=True).op
+  old_logs = benchmark.run_op_benchmark(sess, old_op)
+  new_logs = benchmark.run_op_benchmark(sess, new_op)
+  logs['gather_nd_%s' % idx_name] = old_logs
+  logs['gather_nd_share_prefixes_%s' % idx_name] = new_logs
+  print('Gathering %d %s elements of %s takes %f seconds with '
+        'share_prefixes=True (%f seconds without).' %
+        (num_elements, idx_name, tens, new_logs['wall_time'],
+         old_logs['wall_time']))
+
+# Compressing a dense 4096 x 4096 weight matrix into a TT-matrix.
+mat = tf.Variable(tf.random_normal((4096, 4096)))
+sess.run(mat.initializer)
+mat = mat.value()
+shape = ((8, 8, 8, 8), (8, 8, 8, 8))
+old_op = tf.group(*t3f.to_tt_matrix(mat, shape, max_tt_rank=16).tt_cores)
+new_op = tf.group(*t3f.to_tt_matrix(mat, shape, max_tt_rank=16,
+                                    method='randomized').tt_cores)
+old_logs = benchmark.run_op_benchmark(sess, old_op)
+new_logs = benchmark.run_op_benchmark(sess, new_op)
+logs['to_tt_matrix_svd'] = old_logs
+logs['to_tt_matrix_randomized'] = new_logs
+print('Converting a 4096 x 4096 matrix into a TT-matrix of TT-rank 16 takes %f '
+      'seconds with method="randomized" (%f seconds with method="svd").' %
+      (new_logs['wall_time'], old_logs['wall_time']))
+
+# Solving the Poisson equation -Laplace(u) = 1 on the unit cube with zero
+# boundary conditions discretized on a grid of n^d points.
+for d, n in [(8, 16), (5, 32)]:
+  lap_1d = (2 * np.eye(n) - np.eye(n, k=1) - np.eye(n, k=-1)) * (n + 1) ** 2
+  eye = np.eye(n)
+  middle = np.zeros((2, n, n, 2))
+  middle[0, :, :, 0] = eye
+  middle[1, :, :, 0] = lap_1d
+  middle[1, :, :, 1] = eye
+  cores = ([np.stack((lap_1d, eye), axis=-1)[np.newaxis]] + [middle] * (d - 2) +
+           [np.stack((eye, lap_1d))[..., np.newaxis]])
+  laplace = t3f.TensorTrain([tf.constant(c) for c in cores])
+  rhs = t3f.TensorTrain([tf.ones((1, n, 1, 1), dtype=tf.float64)] * d)
+  relative_residual = lambda x: (
+      t3f.frobenius_norm(t3f.matmul(laplace, x) - rhs, epsilon=0) /
+      t3f.frobenius_norm(rhs, epsilon=0))
+
+  solution = t3f.solvers.amen_solve(laplace, rhs, tol=1e-6, max_tt_rank=8)
+  amen_logs = benchmark.run_op_benchmark(sess, tf.group(*solution.tt_cores),
+                                         burn_iters=1, min_iters=1)
+  amen_residual = sess.run(relative_residual(solution))
+
+  # The baseline: Riemannian gradient descent on the energy functional
+  # 0.5 <x, A x> - <x, b> with the step 1 / lambda_max(A).
+  init = t3f.random_matrix(((n,) * d, None), tt_rank=8, dtype=tf.float64)
+  x = t3f.get_variable('poisson_x_%d_%d' % (d, n), initializer=init)
+  energy = lambda x: (0.5 * t3f.bilinear_form(laplace, x, x) -
+                      t3f.flat_inner(x, rhs))
+  optimizer = t3f.optimizers.GradientDescentOptimizer(
+      1. / (4 * d * (n + 1) ** 2))
+  step = optimizer.minimize(energy, x, runtime_check=False)
+  sess.run(tf.global_variables_initializer())
+  num_steps = 3000
+  start = time.time()
+  for _ in range(num_steps):
+    sess.run(step)
+  gd_logs = {'wall_time': time.time() - start}
+  gd_residual = sess.run(relative_residual(x))
+  logs['amen_solve_poisson_%d_%d' % (d, n)] = amen_logs
+  logs['gradient_descent_poisson_%d_%d' % (d, n)] = gd_logs
+  print('Solving the Poisson equation on the %d^%d grid with AMEn takes %f '
+        'seconds (relative residual %e), %d steps of Riemannian gradient '
+        'descent take %f seconds (relative residual %e).' %
+        (n, d, amen_logs['wall_time'], amen_residual, num_steps,
+         gd_logs['wall_time'], gd_residual))
+
+if args.file_path is not None:
+  pickle.dump(logs, open(args.file_path, 'wb'))
@@ -11,6 +11,7 @@ from t3f.ops import flat_inner
 from t3f.ops import frobenius_norm
 from t3f.ops import frobenius_norm_squared
 from t3f.ops import full
+from t3f.ops import full_blocks
 from t3f.ops import matmul
 from t3f.ops import multiply
 from t3f.ops import quadratic_form
@@ -51,8 +52,13 @@ from t3f.riemannian import pairwise_flat_inner_projected
 from t3f.riemannian import project
 from t3f.riemannian import project_matmul
 from t3f.riemannian import project_sum
+from t3f.riemannian import retract
 from t3f.riemannian import tangent_space_to_deltas
 
+from t3f.tangent_space import TangentSpace
+from t3f.tangent_space import TangentVector
+from t3f.tangent_space import TangentVectorBatch
+
 from t3f.shapes import batch_size
 from t3f.shapes import clean_raw_shape
 from t3f.shapes import expand_batch_dim
@@ -70,19 +76,24 @@ from t3f.decompositions import orthogonalize_tt_cores
 from t3f.decompositions import round
 from t3f.decompositions import to_tt_matrix
 from t3f.decompositions import to_tt_tensor
+from t3f.decompositions import to_tt_tensor_from_memmap
 
 from t3f.autodiff import gradients
 from t3f.autodiff import hessian_vector_product
+from t3f.autodiff import set_runtime_check_policy
 
 import t3f.approximate
+import t3f.cross
 import t3f.kronecker
 import t3f.nn
+import t3f.optimizers
+import t3f.solvers
 import t3f.utils
 
 _directly_imported = ['tensor_train_base', 'tensor_train', 'tensor_train_batch',
                       'variables', 'ops', 'batch_ops', 'initializers',
-                      'regularizers', 'riemannian', 'shapes', 'decompositions',
-                      'autodiff']
+                      'regularizers', 'riemannian', 'tangent_space', 'shapes',
+                      'decompositions', 'autodiff']
 
 __all__ = [s for s in dir() if
            s not in _directly_imported and not s.startswith('_')]
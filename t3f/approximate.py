@@ -2,7 +2,7 @@ import itertools
 import numpy as np
 import tensorflow.compat.v1 as tf
 from t3f.tensor_train_batch import TensorTrainBatch
-from t3f import decompositions
+from t3f import ops
 from t3f import batch_ops
 
 
@@ -35,7 +35,7 @@ def add_n(tt_objects, max_tt_rank, name='t3f_approximate_add_n'):
       for i in range(0, len(prev_level), 2):
         curr = prev_level[i]
         if i + 1 < len(prev_level):
-          curr = decompositions.round(curr + prev_level[i + 1], max_tt_rank)
+          curr = ops.add(curr, prev_level[i + 1], max_tt_rank=max_tt_rank)
         next_level.append(curr)
       prev_level = next_level
     return prev_level[0]
@@ -72,8 +72,6 @@ def reduce_sum_batch(tt_batch, max_tt_rank, coef=None,
     t3f.approximate.add_n
   """
   ndims = tt_batch.ndims()
-  left_tt_rank_dim = tt_batch.left_tt_rank_dim
-  right_tt_rank_dim = tt_batch.right_tt_rank_dim
   shape = tt_batch.get_raw_shape()
   dtype = tt_batch.dtype
 
@@ -127,7 +125,8 @@ def reduce_sum_batch(tt_batch, max_tt_rank, coef=None,
 
     prev_level = tt_batch
     while prev_level.batch_size > output_size:
-      current_level_cores = []
+      a_cores = []
+      b_cores = []
       for core_idx in range(ndims):
         curr_orig_core = prev_level.tt_cores[core_idx]
         if is_batch_output:
@@ -160,18 +159,12 @@ def reduce_sum_batch(tt_batch, max_tt_rank, coef=None,
           b_core_shape = np.delete(b_core_shape, 1)
           b_core = tf.reshape(b_core, b_core_shape)
 
-        if core_idx == 0:
-          curr_sum_core = tf.concat((a_core, b_core), axis=right_tt_rank_dim)
-        elif core_idx == ndims - 1:
-          curr_sum_core = tf.concat((a_core, b_core), axis=left_tt_rank_dim)
-        else:
-          zeros = tf.zeros(b_core.get_shape(), dtype)
-          upper = tf.concat((a_core, zeros), axis=right_tt_rank_dim)
-          lower = tf.concat((zeros, b_core), axis=right_tt_rank_dim)
-          curr_sum_core = tf.concat((upper, lower), axis=left_tt_rank_dim)
-        current_level_cores.append(curr_sum_core)
-      current_level = TensorTrainBatch(current_level_cores, shape)
-      prev_level = decompositions.round(current_level, max_tt_rank)
+        a_cores.append(a_core)
+        b_cores.append(b_core)
+      a_batch = TensorTrainBatch(a_cores, shape)
+      b_batch = TensorTrainBatch(b_cores, shape)
+      # Sum and round without assembling the block-diagonal TT-cores.
+      prev_level = ops.add(a_batch, b_batch, max_tt_rank=max_tt_rank)
     if is_batch_output:
       return prev_level
     else:
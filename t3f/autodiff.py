@@ -1,5 +1,9 @@
+import random
+import weakref
+import numpy as np
 import tensorflow.compat.v1 as tf
 
+from t3f.tensor_train_batch import TensorTrainBatch
 from t3f import shapes
 from t3f import decompositions
 from t3f import riemannian
@@ -9,14 +13,22 @@ def _enforce_gauge_conditions(deltas, left):
   """Project deltas that define tangent space vec onto the gauge conditions."""
   proj_deltas = []
   tt_ranks = shapes.lazy_tt_ranks(left)
+  # For a batch of points the matrices below have a leading batch dimension.
+  is_batch = isinstance(left, TensorTrainBatch)
+  batch_shape = (shapes.lazy_batch_size(left),) if is_batch else ()
   for i in range(left.ndims()):
     right_r = tt_ranks[i + 1]
-    q = tf.reshape(left.tt_cores[i], (-1, right_r))
+    q = tf.reshape(left.tt_cores[i], batch_shape + (-1, right_r))
     if i < left.ndims() - 1:
+      # The deltas are of size left_r x n x right_r of the right
+      # orthogonalization, which can differ from the TT-ranks of left.
+      num_rows = q.get_shape()[-2].value
+      if num_rows is None:
+        num_rows = tf.shape(q)[-2]
       proj_delta = deltas[i]
-      proj_delta = tf.reshape(proj_delta, (-1, right_r))
-      proj_delta -= tf.matmul(q, tf.matmul(tf.transpose(q), proj_delta))
-      proj_delta = tf.reshape(proj_delta, left.tt_cores[i].shape)
+      proj_delta = tf.reshape(proj_delta, batch_shape + (num_rows, -1))
+      proj_delta -= tf.matmul(q, tf.matmul(q, proj_delta, transpose_a=True))
+      proj_delta = tf.reshape(proj_delta, tf.shape(deltas[i]))
     else:
       proj_delta = deltas[i]
     proj_deltas.append(proj_delta)
@@ -49,11 +61,137 @@ def _is_invariant_to_input_transforms(f_value_1, f_value_2,
   err_msg = "The function passed to Riemannian autodiff returns different " \
             "values for two different versions of the same tensor. " \
             "The function values are"
-  assert_op = tf.Assert(rel_diff < 1e-5, [err_msg, f_value_1, f_value_2],
-                        name=name)
+  # The values are vectors for a batch of points.
+  assert_op = tf.Assert(tf.reduce_all(rel_diff < 1e-5),
+                        [err_msg, f_value_1, f_value_2], name=name)
   return assert_op
 
 
+# The policy of runtime_check='auto', see `set_runtime_check_policy`.
+_NUM_FIRST_CHECKS = 10
+_CHECK_SAMPLE_RATE = 0.01
+
+
+def set_runtime_check_policy(num_first_checks=10, sample_rate=0.01):
+  """Sets how often runtime_check='auto' of Riemannian autodiff is done.
+
+  The check that the function is invariant to the TT representation of its
+  argument evaluates the function twice. With runtime_check='auto' (see
+  t3f.gradients) the check is done on the first num_first_checks executions
+  of the op and then on a random sample_rate fraction of the executions.
+
+  The policy is read when the op is created, so it doesn't affect the ops
+  created before.
+
+  Args:
+    num_first_checks: a non-negative number, how many first executions are
+      checked.
+    sample_rate: a number from 0 to 1, the probability to check each of the
+      following executions.
+
+  Raises:
+    ValueError if num_first_checks is negative or if sample_rate is not in
+      [0, 1].
+  """
+  global _NUM_FIRST_CHECKS, _CHECK_SAMPLE_RATE
+  if num_first_checks < 0:
+    raise ValueError('num_first_checks should be non-negative, got %s.' %
+                     num_first_checks)
+  if not 0 <= sample_rate <= 1:
+    raise ValueError('sample_rate should be between 0 and 1, got %s.' %
+                     sample_rate)
+  _NUM_FIRST_CHECKS = num_first_checks
+  _CHECK_SAMPLE_RATE = sample_rate
+
+
+# The number of runtime_check='auto' executions for each function passed to
+# Riemannian autodiff in the eager mode and inside tf.function.
+_NUM_RUNS = weakref.WeakKeyDictionary()
+
+
+def _count_run(func):
+  """Increments and returns the number of runtime_check='auto' runs of func."""
+  # A bound method is a new object on each attribute access.
+  func = getattr(func, '__func__', func)
+  try:
+    num_runs = _NUM_RUNS.get(func, 0) + 1
+    _NUM_RUNS[func] = num_runs
+  except TypeError:
+    # func can't be weakly referenced, count each run as the first one.
+    num_runs = 1
+  return num_runs
+
+
+def _increment_counter():
+  """Returns an op that increments a new counter of executions.
+
+  The counter is a local variable created outside of any control flow
+  construct (so the op can be created inside a tf.while_loop body), which
+  initializes itself on the first execution (so the op can be created after
+  tf.global_variables_initializer was run).
+
+  Returns:
+    tf.Tensor of type int64, the number of executions including this one.
+  """
+  with tf.init_scope():
+    counter = tf.Variable(tf.constant(0, dtype=tf.int64), trainable=False,
+                          collections=[tf.GraphKeys.LOCAL_VARIABLES],
+                          use_resource=True, name='runtime_check_counter')
+  return tf.cond(tf.is_variable_initialized(counter),
+                 lambda: tf.assign_add(counter, 1),
+                 lambda: tf.assign(counter, 1))
+
+
+def _runtime_check(func, x, function_value, runtime_check):
+  """Returns an op that checks that func(x) equals function_value.
+
+  Args:
+    func: the function passed to Riemannian autodiff.
+    x: `TensorTrain` or `TensorTrainBatch`, the point.
+    function_value: tf.Tensor, the value of func at another representation of
+      x.
+    runtime_check: True, False or 'auto', see t3f.gradients.
+
+  Returns:
+    tf.Operation or tf.Tensor to use as a control dependency.
+
+  Raises:
+    ValueError if runtime_check is not True, False or 'auto'.
+  """
+  if isinstance(runtime_check, str):
+    if runtime_check != 'auto':
+      raise ValueError('runtime_check should be True, False or "auto", got '
+                       '"%s".' % runtime_check)
+  elif runtime_check:
+    return _is_invariant_to_input_transforms(function_value, func(x))
+  else:
+    return tf.no_op()
+
+  def check():
+    assert_op = _is_invariant_to_input_transforms(function_value, func(x))
+    with tf.control_dependencies([assert_op]):
+      return tf.constant(True)
+
+  if tf.executing_eagerly():
+    # The op is executed right away, decide in Python.
+    num_runs = _count_run(func)
+    if num_runs <= _NUM_FIRST_CHECKS or random.random() < _CHECK_SAMPLE_RATE:
+      return check()
+    return tf.no_op()
+  if tf.get_default_graph().building_function:
+    # tf.function can't create variables on each trace, count in Python on
+    # each execution instead.
+    num_runs = tf.py_func(lambda: np.int64(_count_run(func)), [], tf.int64,
+                          stateful=True)
+    num_runs.set_shape(())
+  else:
+    num_runs = _increment_counter()
+  # Decide on each execution, func(x) is only computed if the check is done.
+  is_sampled = tf.random.uniform((), dtype=tf.float64) < _CHECK_SAMPLE_RATE
+  should_check = tf.logical_or(num_runs <= _NUM_FIRST_CHECKS, is_sampled)
+  return tf.cond(should_check, check, lambda: tf.constant(True))
+
+
 def gradients(func, x, name='t3f_gradients', runtime_check=True):
   """Riemannian autodiff: returns gradient projected on tangent space of TT.
 
@@ -73,19 +211,35 @@ def gradients(func, x, name='t3f_gradients', runtime_check=True):
       f = lambda x: 0.5 * t3f.flat_inner(x, t)**2
       projected_grad = t3f.gradients(f, x) # t3f.project(t3f.flat_inner(x, t) * t, x)
 
+      # The same for a batch of points at once: f maps the batch to the
+      # vector of its values.
+      projected_grads = t3f.gradients(f, x_batch)
+
   Args:
       func: function that takes TensorTrain object as input and outputs a number.
+        For a batch x, takes a TensorTrainBatch and outputs a vector of
+        batch_size numbers, the i-th of which depends only on the i-th TT-object
+        of the batch.
       x: point at which to compute the gradient and on which tangent space to
-        project the gradient.
+        project the gradient. Either `TensorTrain` or `TensorTrainBatch` of
+        independent points, then the gradients of all the points are computed
+        in one vectorized pass using batched orthogonalization.
       name: string, name of the Op.
       runtime_check: [True] whether to do a sanity check that the passed
         function is invariant to different TT representations (otherwise
-        the Rieamnnian gradient doesn't even exist). It makes things slower,
-        but helps catching bugs, so turn it off during production deployment.
+        the Rieamnnian gradient doesn't even exist). The check evaluates the
+        function twice, which makes things slower, but helps catching bugs.
+        True checks on each execution, False never checks and 'auto' checks
+        the first few executions and then a small random fraction of them
+        (see t3f.set_runtime_check_policy). 'auto' counts the executions of
+        the op in a local tf.Variable that initializes itself on the first
+        run; in the eager mode and inside tf.function it counts the
+        executions of func in Python.
 
   Returns:
       `TensorTrain`, projection of the gradient df/dx onto the tangent space at
-      point x.
+      point x (`TensorTrainBatch` of the gradients at each point for a batch
+      x).
 
   See also:
       t3f.hessian_vector_product
@@ -93,20 +247,60 @@ def gradients(func, x, name='t3f_gradients', runtime_check=True):
   with tf.name_scope(name, values=x.tt_cores):
     left = decompositions.orthogonalize_tt_cores(x)
     right = decompositions.orthogonalize_tt_cores(left, left_to_right=False)
-    deltas = [right.tt_cores[0]]
-    deltas += [tf.zeros_like(cc) for cc in right.tt_cores[1:]]
-    x_projection = riemannian.deltas_to_tangent_space(deltas, x, left, right)
-    function_value = func(x_projection)
-    if runtime_check:
-      assert_op = _is_invariant_to_input_transforms(function_value, func(x))
-    else:
-      assert_op = tf.no_op()
-    with tf.control_dependencies([assert_op]):
-      cores_grad = tf.gradients(function_value, deltas)
-    deltas = _enforce_gauge_conditions(cores_grad, left)
+    deltas = _gradient_deltas(func, x, left, right, runtime_check)
     return riemannian.deltas_to_tangent_space(deltas, x, left, right)
 
 
+def _gradient_deltas(func, x, left, right, runtime_check):
+  """Returns the deltas of the Riemannian gradient of func at x.
+
+  Args:
+    func: function that takes TensorTrain object as input and outputs a number.
+    x: `TensorTrain`, the point at which to compute the gradient.
+    left: t3f.orthogonalize_tt_cores(x).
+    right: t3f.orthogonalize_tt_cores(left, left_to_right=False).
+    runtime_check: True, False or 'auto', see t3f.gradients.
+
+  Returns:
+    A list of deltas obeying the gauge conditions (see
+    t3f.riemannian.deltas_to_tangent_space).
+  """
+  deltas = _point_deltas(left, right)
+  x_projection = riemannian.deltas_to_tangent_space(deltas, x, left, right)
+  function_value = func(x_projection)
+  assert_op = _runtime_check(func, x, function_value, runtime_check)
+  if isinstance(x, TensorTrainBatch):
+    # The i-th value depends only on the i-th deltas, so the gradient of the
+    # sum gives the gradients of all the values at once.
+    function_value = tf.reduce_sum(function_value)
+  with tf.control_dependencies([assert_op]):
+    cores_grad = tf.gradients(function_value, deltas)
+  return _enforce_gauge_conditions(cores_grad, left)
+
+
+def _point_deltas(left, right):
+  """Deltas which represent the point x itself as an element of its tangent space.
+
+  x = V_1 V_2 ... V_d, so the deltas are [V_1, 0, ..., 0] where the k-th
+  delta is of size left_r_k x n_k x right_r_{k+1} (left_r and right_r are
+  the TT-ranks of the left and right orthogonalizations of x).
+  """
+  left_ranks = shapes.lazy_tt_ranks(left)
+  right_ranks = shapes.lazy_tt_ranks(right)
+  raw_shape = shapes.lazy_raw_shape(left)
+  deltas = [right.tt_cores[0]]
+  for i in range(1, left.ndims()):
+    if left.is_tt_matrix():
+      shape = (left_ranks[i], raw_shape[0][i], raw_shape[1][i],
+               right_ranks[i + 1])
+    else:
+      shape = (left_ranks[i], raw_shape[0][i], right_ranks[i + 1])
+    if isinstance(left, TensorTrainBatch):
+      shape = (shapes.lazy_batch_size(left),) + shape
+    deltas.append(tf.zeros(shape, dtype=right.dtype.base_dtype))
+  return deltas
+
+
 def hessian_vector_product(func, x, vector, name='t3f_hessian_vector_product',
                            runtime_check=True):
   """P_x [d^2f/dx^2] P_x vector, i.e. Riemannian hessian by vector product.
@@ -138,37 +332,70 @@ def hessian_vector_product(func, x, vector, name='t3f_hessian_vector_product',
         func: function that takes TensorTrain object as input and outputs a number.
         x: point at which to compute the Hessian and on which tangent space to
           project the gradient.
-      vector: `TensorTrain` object which to multiply be the Hessian.
+      vector: `TensorTrain` object which to multiply be the Hessian, or
+        `TensorTrainBatch` of vectors. For a batch, the orthogonalization of x,
+        the function and its gradient are computed once and only the second
+        order backpropagation is done for each vector (vectorized along the
+        batch with tf.vectorized_map, or with tf.map_fn in the TensorFlow
+        versions which don't have it). This builds a much smaller graph than
+        calling this function for each vector, but doesn't make it run
+        faster: the second order backpropagation dominates the running
+        time, which is about the same or a few percent slower.
       name: string, name of the Op.
       runtime_check: [True] whether to do a sanity check that the passed
         function is invariant to different TT representations (otherwise
-        the Rieamnnian gradient doesn't even exist). It makes things slower,
-        but helps catching bugs, so turn it off during production deployment.
+        the Rieamnnian gradient doesn't even exist). The check evaluates the
+        function twice, which makes things slower, but helps catching bugs.
+        True checks on each execution, False never checks and 'auto' checks
+        the first few executions and then a small random fraction of them
+        (see t3f.set_runtime_check_policy). 'auto' counts the executions of
+        the op in a local tf.Variable that initializes itself on the first
+        run; in the eager mode and inside tf.function it counts the
+        executions of func in Python.
 
     Returns:
-        `TensorTrain`, result of the Riemannian hessian by vector product.
+        `TensorTrain`, result of the Riemannian hessian by vector product
+        (`TensorTrainBatch` of the products with each vector for a batch
+        vector).
+
+    Raises:
+        ValueError if x is a `TensorTrainBatch`.
 
     See also:
         t3f.gradients
     """
+  if isinstance(x, TensorTrainBatch):
+    raise ValueError('hessian_vector_product supports a single point x, for a '
+                     'batch of vectors pass them as a TensorTrainBatch.')
   all_cores = list(x.tt_cores) + list(vector.tt_cores)
   with tf.name_scope(name, values=all_cores):
     left = decompositions.orthogonalize_tt_cores(x)
     right = decompositions.orthogonalize_tt_cores(left, left_to_right=False)
-    deltas = [right.tt_cores[0]]
-    deltas += [tf.zeros_like(cc) for cc in right.tt_cores[1:]]
+    deltas = _point_deltas(left, right)
     x_projection = riemannian.deltas_to_tangent_space(deltas, x, left, right)
     function_value = func(x_projection)
-    if runtime_check:
-      assert_op = _is_invariant_to_input_transforms(function_value, func(x))
-    else:
-      assert_op = tf.no_op()
+    assert_op = _runtime_check(func, x, function_value, runtime_check)
     with tf.control_dependencies([assert_op]):
-      vector_projected = riemannian.project(vector, x)
+      vec_deltas = riemannian._project_deltas(vector, left, right)
     cores_grad = tf.gradients(function_value, deltas)
-    vec_deltas = riemannian.tangent_space_to_deltas(vector_projected)
-    products = [tf.reduce_sum(a * b) for a, b in zip(cores_grad, vec_deltas)]
-    grad_times_vec = tf.add_n(products)
-    second_cores_grad = tf.gradients(grad_times_vec, deltas)
-    final_deltas = _enforce_gauge_conditions(second_cores_grad, left)
+
+    def hessian_by_deltas(vec_deltas):
+      # The gradient of <grad f(deltas), vec_deltas> with respect to deltas,
+      # i.e. the backpropagation of vec_deltas through the gradient.
+      second_cores_grad = tf.gradients(cores_grad, deltas, grad_ys=vec_deltas)
+      second_cores_grad = [tf.zeros_like(d) if g is None else g
+                           for g, d in zip(second_cores_grad, deltas)]
+      return _enforce_gauge_conditions(second_cores_grad, left)
+
+    if isinstance(vector, TensorTrainBatch):
+      # The first order pass is shared by all the vectors and the second
+      # order backpropagations are vectorized along the batch.
+      vectorized_map = getattr(tf, 'vectorized_map', None)
+      if vectorized_map is None:
+        # TensorFlow < 1.14.
+        final_deltas = tf.map_fn(hessian_by_deltas, vec_deltas)
+      else:
+        final_deltas = vectorized_map(hessian_by_deltas, vec_deltas)
+    else:
+      final_deltas = hessian_by_deltas(vec_deltas)
     return riemannian.deltas_to_tangent_space(final_deltas, x, left, right)
\ No newline at end of file
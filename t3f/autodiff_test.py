@@ -1,6 +1,8 @@
 import numpy as np
 import tensorflow.compat.v1 as tf
+from tensorflow.python.eager import context
 
+from t3f.tensor_train_batch import TensorTrainBatch
 from t3f import ops
 from t3f import initializers
 from t3f import riemannian
@@ -43,6 +45,68 @@ class _AutodiffTest():
       with self.test_session() as sess:
         sess.run(actual3)
 
+  def testGradientsReducedRanks(self):
+    # The orthogonalization of x reduces its TT-ranks (1, 4, 4, 1) to
+    # (1, 2, 4, 1) from the left and to (1, 2, 3, 1) from the right.
+    w = initializers.random_tensor((2, 3, 3), tt_rank=2, dtype=self.dtype)
+    x = initializers.random_tensor((2, 3, 3), tt_rank=4, dtype=self.dtype)
+
+    def func(x):
+      return 0.5 * ops.flat_inner(x, w) ** 2
+    desired = ops.full(ops.flat_inner(x, w) * riemannian.project(w, x))
+    self._TestSingleGradient(func, x, desired)
+
+  def testGradientsBatch(self):
+    w = initializers.random_matrix(([3, 4, 3], None), tt_rank=2,
+                                   dtype=self.dtype)
+    x = initializers.random_matrix_batch(([3, 4, 3], None), tt_rank=3,
+                                         batch_size=4, dtype=self.dtype)
+
+    def func(x):
+      return 0.5 * ops.flat_inner(x, w) ** 2
+    graph = tf.get_default_graph()
+    num_qr = lambda: len([op for op in graph.get_operations()
+                          if op.type == 'Qr'])
+    num_qr_before = num_qr()
+    actual = autodiff.gradients(func, x, runtime_check=False)
+    # One batched QR per TT-core for each of the two orthogonalizations.
+    self.assertEqual(2 * (x.ndims() - 1), num_qr() - num_qr_before)
+    self.assertIsInstance(actual, TensorTrainBatch)
+    checked = autodiff.gradients(func, x, runtime_check=True)
+    desired = [ops.full(autodiff.gradients(func, x[i], runtime_check=False))
+               for i in range(4)]
+    with self.test_session() as sess:
+      actual_v, checked_v, desired_v = sess.run(
+          (ops.full(actual), ops.full(checked), desired))
+      self.assertAllClose(np.stack(desired_v), actual_v, rtol=1e-4)
+      self.assertAllClose(np.stack(desired_v), checked_v, rtol=1e-4)
+
+  def testGradientsDynamicBatch(self):
+    w = initializers.random_matrix(([3, 4, 3], None), tt_rank=2,
+                                   dtype=self.dtype)
+    x = initializers.random_matrix_batch(([3, 4, 3], None), tt_rank=3,
+                                         batch_size=4, dtype=self.dtype)
+    with self.test_session() as sess:
+      x_cores = sess.run(x.tt_cores)
+    # The batch size is only known when the placeholders are fed.
+    cores_ph = [tf.placeholder(self.dtype, (None,) + c.shape[1:])
+                for c in x_cores]
+    x_ph = TensorTrainBatch(cores_ph, x.get_raw_shape())
+    feed_dict = dict(zip(cores_ph, x_cores))
+
+    def func(x):
+      return 0.5 * ops.flat_inner(x, w) ** 2
+    actual = autodiff.gradients(func, x_ph, runtime_check=False)
+    self.assertIsInstance(actual, TensorTrainBatch)
+    self.assertIsNone(actual.batch_size)
+    x = TensorTrainBatch(x_cores, x.get_raw_shape())
+    desired = [ops.full(autodiff.gradients(func, x[i], runtime_check=False))
+               for i in range(4)]
+    with self.test_session() as sess:
+      actual_v, desired_v = sess.run((ops.full(actual), desired),
+                                     feed_dict=feed_dict)
+      self.assertAllClose(np.stack(desired_v), actual_v, rtol=1e-4)
+
   def _TestSingleHessianByVector(self, func, x, z, desired):
     actual1 = ops.full(autodiff.hessian_vector_product(
         func, x, z, runtime_check=False))
@@ -54,6 +118,102 @@ class _AutodiffTest():
       self.assertAllClose(desired_v, actual1_v, rtol=1e-4)
       self.assertAllClose(desired_v, actual2_v, rtol=1e-4)
 
+  def testRuntimeCheckPolicy(self):
+    x = initializers.random_tensor((2, 3, 4), tt_rank=2, dtype=self.dtype)
+
+    def func(x):
+      # Not invariant to different representations of the same tensor.
+      return tf.add_n([tf.reduce_sum(c) for c in x.tt_cores]) ** 2
+    try:
+      autodiff.set_runtime_check_policy(num_first_checks=2, sample_rate=0.0)
+      grad = ops.full(autodiff.gradients(func, x, runtime_check='auto'))
+      # The policy is read when the op is created.
+      autodiff.set_runtime_check_policy(num_first_checks=0, sample_rate=1.0)
+      always = ops.full(autodiff.gradients(func, x, runtime_check='auto'))
+      # The default checks every time.
+      checked = ops.full(autodiff.gradients(func, x))
+      with self.test_session() as sess:
+        # The counters initialize themselves on the first run.
+        for _ in range(2):
+          with self.assertRaises(tf.errors.InvalidArgumentError):
+            sess.run(grad)
+        # Only the first two runs are checked.
+        sess.run(grad)
+        sess.run(grad)
+        for _ in range(3):
+          with self.assertRaises(tf.errors.InvalidArgumentError):
+            sess.run(always)
+          with self.assertRaises(tf.errors.InvalidArgumentError):
+            sess.run(checked)
+      # The graph of the default check has no state and the counters are
+      # local variables.
+      self.assertEqual(0, len(tf.global_variables()))
+      self.assertEqual(2, len(tf.local_variables()))
+
+      with self.assertRaises(ValueError):
+        autodiff.set_runtime_check_policy(num_first_checks=-1)
+      with self.assertRaises(ValueError):
+        autodiff.set_runtime_check_policy(sample_rate=2.0)
+      with self.assertRaises(ValueError):
+        autodiff.gradients(func, x, runtime_check='sometimes')
+    finally:
+      autodiff.set_runtime_check_policy()
+
+  def testRuntimeCheckPolicyInWhileLoop(self):
+    x = initializers.random_tensor((2, 3, 4), tt_rank=2, dtype=self.dtype)
+
+    def func(x):
+      # Not invariant to different representations of the same tensor.
+      return tf.add_n([tf.reduce_sum(c) for c in x.tt_cores]) ** 2
+
+    def body(i, norm):
+      grad = autodiff.gradients(func, x, runtime_check='auto')
+      return i + 1, norm + ops.frobenius_norm_squared(grad)
+
+    try:
+      autodiff.set_runtime_check_policy(num_first_checks=3, sample_rate=0.0)
+      with self.test_session() as sess:
+        sess.run(tf.global_variables_initializer())
+        # The op is created after the variables are initialized.
+        loop = tf.while_loop(lambda i, norm: i < 2, body,
+                             (tf.constant(0), tf.constant(0, self.dtype)))
+        # The first run checks both iterations, the second run checks one.
+        for _ in range(2):
+          with self.assertRaises(tf.errors.InvalidArgumentError):
+            sess.run(loop)
+        sess.run(loop)
+    finally:
+      autodiff.set_runtime_check_policy()
+
+  def testRuntimeCheckPolicyFunction(self):
+    def func(x):
+      # Not invariant to different representations of the same tensor.
+      return tf.add_n([tf.reduce_sum(c) for c in x.tt_cores]) ** 2
+
+    def other_func(x):
+      return func(x)
+
+    try:
+      autodiff.set_runtime_check_policy(num_first_checks=2, sample_rate=0.0)
+      with context.eager_mode():
+        x = initializers.random_tensor((2, 3, 4), tt_rank=2, dtype=self.dtype)
+        grad = tf.function(
+            lambda: ops.full(autodiff.gradients(func, x, runtime_check='auto')))
+        for _ in range(2):
+          with self.assertRaises(tf.errors.InvalidArgumentError):
+            grad()
+        grad()
+        # The executions are counted for each function passed to autodiff.
+        grad = tf.function(lambda: ops.full(
+            autodiff.gradients(func, x, runtime_check='auto')))
+        grad()
+        grad = tf.function(lambda: ops.full(
+            autodiff.gradients(other_func, x, runtime_check='auto')))
+        with self.assertRaises(tf.errors.InvalidArgumentError):
+          grad()
+    finally:
+      autodiff.set_runtime_check_policy()
+
   def testHessianVectorProduct(self):
     w = initializers.random_matrix(([5] * 3, None), dtype=self.dtype)
     A = initializers.random_matrix(([5] * 3, [5] * 3), dtype=self.dtype)
@@ -88,6 +248,56 @@ class _AutodiffTest():
         sess.run(actual3)
 
 
+  def testHessianVectorProductBatch(self):
+    shape = ((2, 3, 2), (3, 2, 2))
+    A = initializers.random_matrix((shape[0], shape[0]), tt_rank=2,
+                                   dtype=self.dtype)
+    x = initializers.random_matrix(shape, tt_rank=3, dtype=self.dtype)
+    z = initializers.random_matrix_batch(shape, tt_rank=2, batch_size=3,
+                                         dtype=self.dtype)
+    w = initializers.random_matrix(shape, tt_rank=2, dtype=self.dtype)
+
+    def func(x):
+      return ops.flat_inner(x, ops.matmul(A, x))
+    actual = autodiff.hessian_vector_product(func, x, z, runtime_check=False)
+    self.assertIsInstance(actual, TensorTrainBatch)
+    desired = [ops.full(autodiff.hessian_vector_product(
+        func, x, z[i], runtime_check=False)) for i in range(3)]
+    # The Hessian of a linear function is zero.
+    linear = autodiff.hessian_vector_product(
+        lambda x: ops.flat_inner(x, w), x, z, runtime_check=False)
+    with self.test_session() as sess:
+      actual_v, desired_v, linear_v = sess.run(
+          (ops.full(actual), desired, ops.full(linear)))
+      self.assertAllClose(np.stack(desired_v), actual_v, rtol=1e-4)
+      self.assertAllClose(np.zeros_like(linear_v), linear_v)
+    with self.assertRaises(ValueError):
+      autodiff.hessian_vector_product(func, z, x)
+
+  def testHessianVectorProductBatchMapFn(self):
+    # TensorFlow < 1.14 doesn't have tf.vectorized_map.
+    shape = ((2, 3, 2), (3, 2, 2))
+    A = initializers.random_matrix((shape[0], shape[0]), tt_rank=2,
+                                   dtype=self.dtype)
+    x = initializers.random_matrix(shape, tt_rank=3, dtype=self.dtype)
+    z = initializers.random_matrix_batch(shape, tt_rank=2, batch_size=3,
+                                         dtype=self.dtype)
+
+    def func(x):
+      return ops.flat_inner(x, ops.matmul(A, x))
+    desired = autodiff.hessian_vector_product(func, x, z, runtime_check=False)
+    vectorized_map = tf.vectorized_map
+    try:
+      del tf.vectorized_map
+      actual = autodiff.hessian_vector_product(func, x, z,
+                                               runtime_check=False)
+    finally:
+      tf.vectorized_map = vectorized_map
+    with self.test_session() as sess:
+      desired_v, actual_v = sess.run((ops.full(desired), ops.full(actual)))
+      self.assertAllClose(desired_v, actual_v, rtol=1e-4)
+
+
 class AutodiffTestFloat32(tf.test.TestCase, _AutodiffTest):
   dtype = tf.float32
 
@@ -0,0 +1,323 @@
+import numpy as np
+import tensorflow.compat.v1 as tf
+
+from t3f.tensor_train import TensorTrain
+
+
+def from_function(func, shape, max_tt_rank=10, epsilon=1e-6, max_sweeps=10,
+                  max_evals=None, init_tt_rank=1, rank_step=2,
+                  dtype=tf.float32, seed=None):
+  """Approximates a black-box tensor by a TT-tensor with TT-cross.
+
+  Builds a TT-tensor interpolating func on a few fibers chosen by the
+  maxvol algorithm, so only O(d n r^2) elements of the tensor
+  are evaluated instead of all the n^d of them (as e.g. in
+  t3f.to_tt_tensor). The fibers are chosen by alternating left-to-right and
+  right-to-left sweeps. On each sweep, each TT-rank is set to the epsilon-rank
+  of the evaluated fibers plus rank_step (random fibers to explore), but not
+  more than max_tt_rank. The sweeps stop when the relative difference between
+  the approximations after two consecutive sweeps is at most epsilon, or when
+  the budget max_sweeps or max_evals is exhausted. If the fibers of the
+  pivots chosen on the previous sweep turn out to be linearly dependent,
+  the TT-rank is not decreased (random fibers are added instead) and the
+  sweep doesn't count as converged.
+
+  All the computations are done in NumPy on the graph construction stage.
+
+  Example:
+    # The 20-dimensional tensor A[i_1, ..., i_20] = sin(i_1 + ... + i_20),
+    # which has TT-rank 2.
+    func = lambda idx: np.sin(np.sum(idx, axis=1))
+    tt = t3f.cross.from_function(func, 10 * np.ones(20, dtype=int))
+
+  Args:
+    func: a vectorized function which takes a 2-D integer numpy array of size
+      num_points x d with multi-indices and returns a numpy array (or anything
+      convertible to it) of num_points values of the tensor at these indices.
+    shape: array-like of d integers, the shape of the tensor.
+    max_tt_rank: a number, the largest TT-rank of the result.
+    epsilon: a floating point number, the desired relative difference between
+      the approximations after two consecutive sweeps.
+    max_sweeps: a number, the maximal number of sweeps (a sweep is a pass
+      either from left to right or from right to left).
+    max_evals: None or a number, the budget of the number of (unique)
+      evaluations of func. Is checked after each sweep, so can be exceeded by
+      at most the number of evaluations of one sweep.
+    init_tt_rank: a number, TT-rank of the initial approximation (the initial
+      fibers are distinct random ones).
+    rank_step: a number, by how much each TT-rank can exceed the
+      epsilon-rank of the fibers.
+    dtype: [tf.float32] dtype of the resulting TT-cores.
+    seed: None or a number, the seed of the random initial fibers.
+
+  Returns:
+    `TensorTrain` containing a TT-tensor of the given shape.
+
+  Raises:
+    ValueError if the shape or the ranks are not positive.
+  """
+  shape = np.array(shape, dtype=np.int64)
+  if shape.ndim != 1 or np.any(shape < 1):
+    raise ValueError('The shape should be a vector of positive numbers, got '
+                     '%s.' % shape)
+  if max_tt_rank < 1 or init_tt_rank < 1:
+    raise ValueError('TT-ranks should be positive, got max_tt_rank = %s and '
+                     'init_tt_rank = %s.' % (max_tt_rank, init_tt_rank))
+  if rank_step < 0:
+    raise ValueError('rank_step should be non-negative, got %s.' % rank_step)
+  func = _CachedFunction(func)
+  ndims = len(shape)
+  if ndims == 1:
+    values = func(np.arange(shape[0])[:, np.newaxis])
+    return TensorTrain([tf.constant(values.reshape(1, -1, 1), dtype=dtype)])
+
+  # left_idx[k] is an array of size r_k x k with the multi-indices (i_1, ...,
+  # i_k) of the chosen fibers, right_idx[k] is of size r_k x (d - k) with the
+  # multi-indices (i_{k+1}, ..., i_d).
+  # The largest sensible TT-ranks are min(n_1 ... n_k, n_{k+1} ... n_d).
+  # (computed in floating point to avoid integer overflow for large d).
+  float_shape = shape.astype(np.float64)
+  rank_caps = np.minimum(np.cumprod(np.concatenate(([1], float_shape))),
+                         np.cumprod(np.concatenate(([1], float_shape[::-1])))
+                         [::-1])
+  rank_caps = np.minimum(rank_caps, max_tt_rank).astype(np.int64)
+  rng = np.random.RandomState(seed)
+  left_idx = [np.zeros((1, 0), dtype=np.int64)] + [None] * ndims
+  right_idx = [None] * ndims + [np.zeros((1, 0), dtype=np.int64)]
+  # How many of the multi-indices in left_idx[k] and right_idx[k] are the
+  # maxvol pivots (the rest are random).
+  left_pivots = [1] + [0] * ndims
+  right_pivots = [0] * ndims + [1]
+  for core_idx in range(1, ndims):
+    rank = min(init_tt_rank, rank_caps[core_idx])
+    right_idx[core_idx] = _distinct_multi_indices(shape[core_idx:], rank, rng)
+
+  # Relative accuracy of the truncation of each fiber, distributed equally
+  # between the d - 1 TT-ranks as in t3f.round.
+  delta = epsilon / np.sqrt(ndims - 1)
+  tt_cores = None
+  for sweep in range(max_sweeps):
+    prev_tt_cores = tt_cores
+    tt_cores = [None] * ndims
+    # Whether the fibers of the pivots chosen on the previous sweep turned out
+    # to be linearly dependent, i.e. the TT-ranks were underestimated.
+    is_degenerate = False
+    if sweep % 2 == 0:
+      # Left to right sweep.
+      for core_idx in range(ndims - 1):
+        fiber = _fiber(func, left_idx[core_idx], shape[core_idx],
+                       right_idx[core_idx + 1])
+        left_rank, n, right_rank = fiber.shape
+        basis = _column_basis(fiber.reshape(left_rank * n, right_rank),
+                              rank_caps[core_idx + 1], delta)
+        rank = basis.shape[1]
+        if rank < min(right_pivots[core_idx + 1], rank_caps[core_idx + 1]):
+          # Don't decrease the TT-rank, explore random fibers instead.
+          is_degenerate = True
+          num_rows = right_pivots[core_idx + 1] + rank_step
+        else:
+          num_rows = rank + rank_step
+        num_rows = min(num_rows, rank_caps[core_idx + 1])
+        rows, interp = _select_rows(basis, num_rows, rng)
+        left_pivots[core_idx + 1] = rank
+        tt_cores[core_idx] = interp.reshape(left_rank, n, -1)
+        left_idx[core_idx + 1] = np.hstack(
+            (left_idx[core_idx][rows // n], (rows % n)[:, np.newaxis]))
+      tt_cores[-1] = _fiber(func, left_idx[-2], shape[-1], right_idx[-1])
+    else:
+      # Right to left sweep.
+      for core_idx in range(ndims - 1, 0, -1):
+        fiber = _fiber(func, left_idx[core_idx], shape[core_idx],
+                       right_idx[core_idx + 1])
+        left_rank, n, right_rank = fiber.shape
+        basis = _column_basis(fiber.reshape(left_rank, n * right_rank).T,
+                              rank_caps[core_idx], delta)
+        rank = basis.shape[1]
+        if rank < min(left_pivots[core_idx], rank_caps[core_idx]):
+          is_degenerate = True
+          num_cols = left_pivots[core_idx] + rank_step
+        else:
+          num_cols = rank + rank_step
+        num_cols = min(num_cols, rank_caps[core_idx])
+        cols, interp = _select_rows(basis, num_cols, rng)
+        right_pivots[core_idx] = rank
+        tt_cores[core_idx] = interp.T.reshape(-1, n, right_rank)
+        right_idx[core_idx] = np.hstack(
+            ((cols // right_rank)[:, np.newaxis],
+             right_idx[core_idx + 1][cols % right_rank]))
+      tt_cores[0] = _fiber(func, left_idx[0], shape[0], right_idx[1])
+
+    if prev_tt_cores is not None and not is_degenerate:
+      norm = np.sqrt(_flat_inner(tt_cores, tt_cores))
+      diff = (norm ** 2 - 2 * _flat_inner(tt_cores, prev_tt_cores) +
+              _flat_inner(prev_tt_cores, prev_tt_cores))
+      if np.sqrt(max(diff, 0)) <= epsilon * norm:
+        break
+    if max_evals is not None and func.num_evals >= max_evals:
+      break
+
+  return TensorTrain([tf.constant(core, dtype=dtype) for core in tt_cores])
+
+
+class _CachedFunction(object):
+  """Wraps a function of multi-indices to never evaluate it twice at a point."""
+
+  def __init__(self, func):
+    self.func = func
+    self.cache = {}
+
+  @property
+  def num_evals(self):
+    return len(self.cache)
+
+  def __call__(self, indices):
+    indices = np.ascontiguousarray(indices, dtype=np.int64)
+    keys = [row.tobytes() for row in indices]
+    missing = {}
+    for row_idx, key in enumerate(keys):
+      if key not in self.cache and key not in missing:
+        missing[key] = row_idx
+    if missing:
+      values = self.func(indices[list(missing.values())])
+      values = np.asarray(values, dtype=np.float64).reshape(-1)
+      self.cache.update(zip(missing.keys(), values))
+    return np.array([self.cache[key] for key in keys])
+
+
+def _distinct_multi_indices(shape, num_points, rng):
+  """Samples distinct random multi-indices of a tensor of the given shape.
+
+  Args:
+    shape: integer array of size k.
+    num_points: a number, at most the number of elements of the tensor.
+    rng: np.random.RandomState.
+
+  Returns:
+    integer array of size num_points x k.
+  """
+  num_elements = np.prod(shape.astype(np.float64))
+  if num_elements <= 2 ** 20:
+    flat_idx = rng.choice(int(num_elements), num_points, replace=False)
+    return np.stack(np.unravel_index(flat_idx, shape), axis=1).astype(np.int64)
+  # Too many elements to sample from the flat range, but then repetitions are
+  # rare: sample with replacement until there are enough distinct points.
+  points = np.zeros((0, len(shape)), dtype=np.int64)
+  while len(points) < num_points:
+    new_points = np.stack([rng.randint(0, n, size=num_points)
+                           for n in shape], axis=1)
+    points = np.vstack((points, new_points))
+    _, first = np.unique(points, axis=0, return_index=True)
+    points = points[np.sort(first)]
+  return points[:num_points]
+
+
+def _fiber(func, left_idx, mode_size, right_idx):
+  """Evaluates func at all the points (left_idx, i, right_idx).
+
+  Args:
+    func: _CachedFunction.
+    left_idx: integer array of size r_1 x k.
+    mode_size: a number n.
+    right_idx: integer array of size r_2 x (d - k - 1).
+
+  Returns:
+    numpy array of size r_1 x n x r_2.
+  """
+  left_rank = left_idx.shape[0]
+  right_rank = right_idx.shape[0]
+  left = np.repeat(left_idx, mode_size * right_rank, axis=0)
+  mode = np.tile(np.repeat(np.arange(mode_size), right_rank), left_rank)
+  right = np.tile(right_idx, (left_rank * mode_size, 1))
+  indices = np.hstack((left, mode[:, np.newaxis], right))
+  return func(indices).reshape(left_rank, mode_size, right_rank)
+
+
+def _maxvol(a, tol=1.05, max_iters=100):
+  """Finds a quasi-maximal volume r x r submatrix of an n x r matrix.
+
+  Args:
+    a: numpy array of size n x r, n >= r.
+    tol: a number >= 1, stop when all the coefficients are at most tol.
+    max_iters: a number, the maximal number of row swaps.
+
+  Returns:
+    rows: integer array of size r with the indices of the submatrix rows.
+    coef: numpy array of size n x r such that a = coef a[rows].
+  """
+  n, r = a.shape
+  # Initialize with Gaussian elimination with row pivoting: after eliminating
+  # the chosen rows become zero and can't be chosen again.
+  b = a.copy()
+  rows = np.zeros(r, dtype=np.int64)
+  for j in range(r):
+    scores = np.abs(b[:, j])
+    scores[rows[:j]] = -1
+    i = np.argmax(scores)
+    rows[j] = i
+    if b[i, j] != 0:
+      b -= np.outer(b[:, j] / b[i, j], b[i])
+    b[i] = 0
+  coef = np.linalg.lstsq(a[rows].T, a.T, rcond=None)[0].T
+  for _ in range(max_iters):
+    i, j = np.unravel_index(np.argmax(np.abs(coef)), coef.shape)
+    if np.abs(coef[i, j]) <= tol:
+      break
+    # Replace the j-th row of the submatrix by the i-th row of a.
+    rows[j] = i
+    col = coef[:, j].copy()
+    row = coef[i].copy()
+    row[j] -= 1
+    coef -= np.outer(col, row / coef[i, j])
+  return rows, coef
+
+
+def _column_basis(a, max_rank, delta):
+  """Orthonormal basis of the dominant columns space of a.
+
+  Args:
+    a: numpy array of size n x m.
+    max_rank: a number, the maximal size of the basis.
+    delta: a number, the relative (in the Frobenius norm) accuracy of the
+      approximation of a by its projection onto the basis.
+
+  Returns:
+    numpy array of size n x r, r <= max_rank with orthonormal columns.
+  """
+  u, s, _ = np.linalg.svd(a, full_matrices=False)
+  # tail_norms[k] is the norm of the error of the rank k approximation.
+  tail_norms = np.sqrt(np.cumsum(s[::-1] ** 2)[::-1])
+  rank = np.sum(tail_norms > delta * tail_norms[0])
+  rank = int(min(max(rank, 1), max_rank))
+  return u[:, :rank]
+
+
+def _select_rows(a, num_rows, rng):
+  """Chooses num_rows rows of a to interpolate it from.
+
+  Takes the rows of the maxvol submatrix and adds random rows to explore the
+  fibers which are not (yet) represented by the columns of a ("rank kick").
+
+  Args:
+    a: numpy array of size n x r, n >= r.
+    num_rows: a number, r <= num_rows <= n.
+    rng: np.random.RandomState.
+
+  Returns:
+    rows: integer array of size num_rows with the indices of the rows.
+    coef: numpy array of size n x num_rows such that a = coef a[rows].
+  """
+  n = a.shape[0]
+  rows, _ = _maxvol(a)
+  free_rows = np.setdiff1d(np.arange(n), rows)
+  extra_rows = rng.choice(free_rows, num_rows - len(rows), replace=False)
+  rows = np.concatenate((rows, extra_rows))
+  coef = a.dot(np.linalg.pinv(a[rows]))
+  return rows, coef
+
+
+def _flat_inner(tt_cores_a, tt_cores_b):
+  """Inner product of two TT-tensors given by lists of numpy TT-cores."""
+  res = np.ones((1, 1))
+  for a_core, b_core in zip(tt_cores_a, tt_cores_b):
+    res = np.einsum('ac,aib,cid->bd', res, a_core, b_core)
+  return res[0, 0]
@@ -0,0 +1,118 @@
+import numpy as np
+import tensorflow.compat.v1 as tf
+
+from t3f import cross
+from t3f import ops
+
+
+class _CrossTest():
+
+  def testFromFunctionExact(self):
+    # Functions of the sum of the indices have small TT-ranks.
+    shape = (4, 5, 3, 6)
+    all_idx = np.indices(shape).reshape(len(shape), -1).T
+
+    def func(idx):
+      return np.sin(0.3 * np.sum(idx, axis=1))
+
+    with self.test_session() as sess:
+      tt = cross.from_function(func, shape, max_tt_rank=4, dtype=self.dtype,
+                               seed=0)
+      self.assertEqual(self.dtype, tt.dtype)
+      self.assertEqual(shape, tuple(tt.get_shape().as_list()))
+      actual = sess.run(ops.full(tt))
+      desired = func(all_idx).reshape(shape)
+      self.assertAllClose(desired, actual, atol=1e-5, rtol=1e-5)
+
+  def testFromFunctionRankOne(self):
+    shape = (3, 4, 5)
+    all_idx = np.indices(shape).reshape(len(shape), -1).T
+
+    def func(idx):
+      return np.prod(1.0 + idx, axis=1)
+
+    with self.test_session() as sess:
+      tt = cross.from_function(func, shape, max_tt_rank=1, dtype=self.dtype)
+      self.assertEqual([1, 1, 1, 1], tt.get_tt_ranks().as_list())
+      actual = sess.run(ops.full(tt))
+      desired = func(all_idx).reshape(shape)
+      self.assertAllClose(desired, actual)
+
+  def testFromFunctionFullRank(self):
+    # Without random fibers to explore, the TT-ranks can only be found from
+    # the initial fibers.
+    shape = (3, 3, 3)
+    np.random.seed(1)
+    desired = np.random.rand(*shape)
+
+    def func(idx):
+      return desired[tuple(idx.T)]
+
+    with self.test_session() as sess:
+      for seed in range(5):
+        tt = cross.from_function(func, shape, init_tt_rank=5, rank_step=0,
+                                 dtype=self.dtype, seed=seed)
+        self.assertEqual([1, 3, 3, 1], tt.get_tt_ranks().as_list())
+        self.assertAllClose(desired, sess.run(ops.full(tt)), atol=1e-5,
+                            rtol=1e-5)
+
+  def testFromFunctionNumEvals(self):
+    # A 20-dimensional tensor with 10^20 elements.
+    shape = 10 * np.ones(20, dtype=int)
+    evaluated = []
+
+    def func(idx):
+      evaluated.append(idx)
+      return np.cos(0.1 * np.sum(idx, axis=1))
+
+    with self.test_session() as sess:
+      tt = cross.from_function(func, shape, max_tt_rank=4, dtype=self.dtype,
+                               seed=0)
+      all_evaluated = np.vstack(evaluated)
+      # Each element is evaluated at most once.
+      self.assertEqual(len(all_evaluated),
+                       len(np.unique(all_evaluated, axis=0)))
+      # Just a few sweeps of d n r^2 evaluations.
+      self.assertLess(len(all_evaluated), 10 * 20 * 10 * 4 ** 2)
+      np.random.seed(0)
+      idx = np.random.randint(0, 10, size=(100, 20))
+      actual = sess.run(ops.gather_nd(tt, idx))
+      self.assertAllClose(func(idx), actual, atol=1e-5, rtol=1e-5)
+
+  def testFromFunctionMaxEvals(self):
+    shape = 10 * np.ones(10, dtype=int)
+    num_evals = [0]
+
+    def func(idx):
+      num_evals[0] += len(idx)
+      return 1.0 / (1.0 + np.sum(idx, axis=1))
+
+    cross.from_function(func, shape, max_tt_rank=8, epsilon=0, max_sweeps=10,
+                        dtype=self.dtype, seed=0)
+    unlimited_evals = num_evals[0]
+    num_evals[0] = 0
+    cross.from_function(func, shape, max_tt_rank=8, epsilon=0, max_sweeps=10,
+                        max_evals=1, dtype=self.dtype, seed=0)
+    # Stops after the first sweep.
+    self.assertLess(num_evals[0], unlimited_evals)
+
+  def testFromFunctionErrors(self):
+    func = lambda idx: np.ones(len(idx))
+    with self.assertRaises(ValueError):
+      cross.from_function(func, (3, 0, 2))
+    with self.assertRaises(ValueError):
+      cross.from_function(func, (3, 2), max_tt_rank=0)
+    with self.assertRaises(ValueError):
+      cross.from_function(func, (3, 2), rank_step=-1)
+
+
+class CrossTestFloat32(tf.test.TestCase, _CrossTest):
+  dtype = tf.float32
+
+
+class CrossTestFloat64(tf.test.TestCase, _CrossTest):
+  dtype = tf.float64
+
+
+if __name__ == "__main__":
+  tf.test.main()
@@ -4,9 +4,11 @@ import tensorflow.compat.v1 as tf
 from t3f.tensor_train import TensorTrain
 from t3f.tensor_train_batch import TensorTrainBatch
 from t3f import shapes
+from t3f import utils
 
 
-def to_tt_matrix(mat, shape, max_tt_rank=10, epsilon=None,
+def to_tt_matrix(mat, shape, max_tt_rank=10, epsilon=None, method='svd',
+                 oversampling=10, n_power_iterations=1,
                  name='t3f_to_tt_matrix'):
   """Converts a given matrix or vector to a TT-matrix.
 
@@ -34,8 +36,8 @@ def to_tt_matrix(mat, shape, max_tt_rank=10, epsilon=None,
       and
         `max_tt_rank = r * np.ones(d-1)`
     epsilon: a floating point number or None
-      If the TT-ranks are not restricted (`max_tt_rank=np.inf`), then
-      the result would be guarantied to be `epsilon` close to `mat`
+      If the TT-ranks are not restricted (`max_tt_rank=np.inf` or None),
+      then the result would be guarantied to be `epsilon` close to `mat`
       in terms of relative Frobenius error:
         ||res - mat||_F / ||mat||_F <= epsilon
       If the TT-ranks are restricted, providing a loose `epsilon` may reduce
@@ -47,6 +49,10 @@ def to_tt_matrix(mat, shape, max_tt_rank=10, epsilon=None,
       the TT-ranks of the result undefined on the compilation stage
       (e.g. res.get_tt_ranks() will return None, but t3f.tt_ranks(res).eval()
       will work).
+    method: string, 'svd' or 'randomized', how to compute the truncated SVDs
+      of the unfoldings, see to_tt_tensor.
+    oversampling: a number, see to_tt_tensor. Ignored for 'svd'.
+    n_power_iterations: a number, see to_tt_tensor. Ignored for 'svd'.
     name: string, name of the Op.
 
   Returns:
@@ -55,7 +61,7 @@ def to_tt_matrix(mat, shape, max_tt_rank=10, epsilon=None,
   Raises:
     ValueError if max_tt_rank is less than 0, if max_tt_rank is not a number and
       not a vector of length d + 1 where d is the number of dimensions (rank) of
-      the input tensor, if epsilon is less than 0.
+      the input tensor, if epsilon is less than 0, if the method is unknown.
   """
   with tf.name_scope(name, values=(mat,)):
     mat = tf.convert_to_tensor(mat)
@@ -77,7 +83,9 @@ def to_tt_matrix(mat, shape, max_tt_rank=10, epsilon=None,
     tens = tf.transpose(tens, transpose_idx)
     new_shape = np.prod(shape, axis=0)
     tens = tf.reshape(tens, new_shape)
-    tt_tens = to_tt_tensor(tens, max_tt_rank, epsilon)
+    tt_tens = to_tt_tensor(tens, max_tt_rank, epsilon, method=method,
+                           oversampling=oversampling,
+                           n_power_iterations=n_power_iterations)
     tt_cores = []
     static_tt_ranks = tt_tens.get_tt_ranks()
     dynamic_tt_ranks = shapes.tt_ranks(tt_tens)
@@ -96,8 +104,8 @@ def to_tt_matrix(mat, shape, max_tt_rank=10, epsilon=None,
     return TensorTrain(tt_cores, shape, tt_tens.get_tt_ranks())
 
 
-# TODO: implement epsilon.
-def to_tt_tensor(tens, max_tt_rank=10, epsilon=None,
+def to_tt_tensor(tens, max_tt_rank=10, epsilon=None, method='svd',
+                 oversampling=10, n_power_iterations=1,
                  name='t3f_to_tt_tensor'):
   """Converts a given tf.Tensor to a TT-tensor of the same shape.
 
@@ -113,8 +121,8 @@ def to_tt_tensor(tens, max_tt_rank=10, epsilon=None,
       and
         `max_tt_rank = r * np.ones(d-1)`
     epsilon: a floating point number or None
-      If the TT-ranks are not restricted (`max_tt_rank=np.inf`), then
-      the result would be guarantied to be `epsilon` close to `tens`
+      If the TT-ranks are not restricted (`max_tt_rank=np.inf` or None),
+      then the result would be guarantied to be `epsilon` close to `tens`
       in terms of relative Frobenius error:
         ||res - tens||_F / ||tens||_F <= epsilon
       If the TT-ranks are restricted, providing a loose `epsilon` may
@@ -126,6 +134,21 @@ def to_tt_tensor(tens, max_tt_rank=10, epsilon=None,
       the TT-ranks of the result undefined on the compilation stage
       (e.g. res.get_tt_ranks() will return None, but t3f.tt_ranks(res).eval()
       will work).
+      With method='randomized' the bound is only approximate, since the
+      truncation only sees the singular values of the sketched unfoldings.
+    method: string, 'svd' or 'randomized'.
+      'svd' computes the full SVD of each unfolding of `tens`.
+      'randomized' finds the range of each unfolding by multiplying it by
+      a random Gaussian matrix with max_tt_rank + oversampling columns
+      (followed by n_power_iterations power iterations) and only computes the
+      SVD of the unfolding projected onto this range. Its cost is linear in
+      max_tt_rank instead of the smaller dimension of the unfolding, but the
+      result is only quasi-optimal and is random.
+    oversampling: a number, how many more columns than the target TT-rank
+      the random matrix should have. Ignored for 'svd'.
+    n_power_iterations: a number, how many times to multiply the sketch by
+      the unfolding and its transpose to improve the accuracy for slowly
+      decaying singular values. Ignored for 'svd'.
     name: string, name of the Op.
 
   Returns:
@@ -135,25 +158,42 @@ def to_tt_tensor(tens, max_tt_rank=10, epsilon=None,
     ValueError if the rank (number of dimensions) of the input tensor is
       not defined, if max_tt_rank is less than 0, if max_tt_rank is not a number
       and not a vector of length d + 1 where d is the number of dimensions (rank)
-      of the input tensor, if epsilon is less than 0.
+      of the input tensor, if epsilon is less than 0, if the method is unknown.
+
+  Complexity:
+    method='svd':
+      O(n^(d+1))
+    method='randomized':
+      O(n^d (R + p) (q + 1))
+    where
+      d is the number of dimensions of tens;
+      n is the largest size of the axis dimension;
+      R is the largest max_tt_rank, p is oversampling and q is
+        n_power_iterations.
   """
   with tf.name_scope(name, values=(tens,)):
     tens = tf.convert_to_tensor(tens)
+    dtype = tens.dtype
+    # 16-bit tensors are decomposed in float32, see utils.accumulation_dtype.
+    tens = utils.upcast(tens)
     static_shape = tens.get_shape()
     dynamic_shape = tf.shape(tens)
     # Raises ValueError if ndims is not defined.
     d = static_shape.__len__()
-    max_tt_rank = np.array(max_tt_rank).astype(np.int32)
-    if np.any(max_tt_rank < 1):
-      raise ValueError('Maximum TT-rank should be greater or equal to 1.')
+    max_tt_rank = _normalize_max_tt_rank(max_tt_rank, d)
     if epsilon is not None and epsilon < 0:
       raise ValueError('Epsilon should be non-negative.')
-    if max_tt_rank.size == 1:
-      max_tt_rank = (max_tt_rank * np.ones(d+1)).astype(np.int32)
-    elif max_tt_rank.size != d + 1:
-      raise ValueError('max_tt_rank should be a number or a vector of size '
-                       '(d+1) where d is the number of dimensions (rank) of '
-                       'the tensor.')
+    if method not in ('svd', 'randomized'):
+      raise ValueError('Unknown method "%s", only "svd" and "randomized" are '
+                       'supported.' % method)
+    if max_tt_rank is None:
+      if method == 'randomized':
+        raise ValueError('The randomized TT-SVD requires max_tt_rank.')
+      max_tt_rank = [None] * (d + 1)
+    delta = None
+    if epsilon is not None and d > 1:
+      # Distribute the allowed error equally between the d - 1 truncations.
+      delta = epsilon / np.sqrt(d - 1) * tf.norm(tens)
     ranks = [1] * (d + 1)
     tt_cores = []
     are_tt_ranks_defined = True
@@ -166,17 +206,29 @@ def to_tt_tensor(tens, max_tt_rank=10, epsilon=None,
       columns = tens.get_shape()[1].value
       if columns is None:
         columns = tf.shape(tens)[1]
-      s, u, v = tf.svd(tens, full_matrices=False)
+      if method == 'svd':
+        s, u, v = tf.svd(tens, full_matrices=False)
+      else:
+        sketch_size = int(max_tt_rank[core_idx + 1]) + oversampling
+        s, u, v = _randomized_svd(tens, sketch_size, n_power_iterations)
       if max_tt_rank[core_idx + 1] == 1:
         ranks[core_idx + 1] = 1
       else:
         try:
-          ranks[core_idx + 1] = min(max_tt_rank[core_idx + 1], rows, columns)
+          if max_tt_rank[core_idx + 1] is None:
+            ranks[core_idx + 1] = min(rows, columns)
+          else:
+            ranks[core_idx + 1] = min(max_tt_rank[core_idx + 1], rows, columns)
         except TypeError:
           # Some of the values are undefined on the compilation stage and thus
           # they are tf.tensors instead of values.
-          min_dim = tf.minimum(rows, columns)
-          ranks[core_idx + 1] = tf.minimum(max_tt_rank[core_idx + 1], min_dim)
+          ranks[core_idx + 1] = tf.minimum(rows, columns)
+          if max_tt_rank[core_idx + 1] is not None:
+            ranks[core_idx + 1] = tf.minimum(max_tt_rank[core_idx + 1],
+                                             ranks[core_idx + 1])
+          are_tt_ranks_defined = False
+        if delta is not None:
+          ranks[core_idx + 1] = _truncation_rank(s, ranks[core_idx + 1], delta)
           are_tt_ranks_defined = False
       u = u[:, 0:ranks[core_idx + 1]]
       s = s[0:ranks[core_idx + 1]]
@@ -189,13 +241,197 @@ def to_tt_tensor(tens, max_tt_rank=10, epsilon=None,
       last_mode = dynamic_shape[-1]
     core_shape = (ranks[d - 1], last_mode, ranks[d])
     tt_cores.append(tf.reshape(tens, core_shape))
+    tt_cores = [tf.cast(core, dtype) for core in tt_cores]
     if not are_tt_ranks_defined:
       ranks = None
     return TensorTrain(tt_cores, static_shape, ranks)
 
 
+def _randomized_svd(mat, sketch_size, n_power_iterations):
+  """Approximate truncated SVD of a matrix via a randomized range finder.
+
+  See Halko, Martinsson, Tropp "Finding structure with randomness:
+  probabilistic algorithms for constructing approximate matrix
+  decompositions", Algorithm 4.4.
+
+  Args:
+    mat: tf.Tensor of size M x N.
+    sketch_size: a number, the number of columns of the random matrix (is
+      decreased to min(M, N) if it is larger).
+    n_power_iterations: a number of power iterations.
+
+  Returns:
+    (s, u, v) as in tf.svd, with at most sketch_size singular values.
+  """
+  rows = mat.get_shape()[0].value
+  if rows is None:
+    rows = tf.shape(mat)[0]
+  columns = mat.get_shape()[1].value
+  if columns is None:
+    columns = tf.shape(mat)[1]
+  try:
+    sketch_size = min(sketch_size, rows, columns)
+  except TypeError:
+    # Some of the values are undefined on the compilation stage and thus
+    # they are tf.tensors instead of values.
+    sketch_size = tf.minimum(sketch_size, tf.minimum(rows, columns))
+  omega = tf.random_normal((columns, sketch_size), dtype=mat.dtype)
+  q, _ = tf.qr(tf.matmul(mat, omega))
+  for _ in range(n_power_iterations):
+    # Orthogonalize after each multiplication to avoid losing the small
+    # singular directions to round-off errors.
+    q, _ = tf.qr(tf.matmul(mat, q, transpose_a=True))
+    q, _ = tf.qr(tf.matmul(mat, q))
+  s, u_small, v = tf.svd(tf.matmul(q, mat, transpose_a=True),
+                         full_matrices=False)
+  return s, tf.matmul(q, u_small), v
+
+
+def to_tt_tensor_from_memmap(path, max_tt_rank=10, block_size=2**24,
+                             dtype=None):
+  """Converts a (possibly larger than RAM) .npy array into a TT-tensor.
+
+  Unlike to_tt_tensor, never loads the whole array into memory. Instead goes
+  over the array (memory-mapped with np.load(path, mmap_mode='r')) in blocks
+  of consecutive elements and finds the TT-cores from right to left: on each
+  pass the blocks are contracted with the TT-cores found so far and the Gram
+  matrix of the current unfolding is accumulated, its leading eigenvectors
+  give the next TT-core. When the remaining (left) part of the tensor
+  contracted with the found TT-cores fits into block_size elements, it is
+  loaded into memory and decomposed with the usual TT-SVD.
+
+  All the computations are done in NumPy (in float64) on the graph
+  construction stage.
+
+  Note that the Gram matrices square the condition number, so the singular
+  values smaller than about 1e-8 of the largest one are not resolved.
+
+  Each of the passes reads the whole array from disk: one pass per TT-core
+  found from the Gram matrices and one more for the remaining part, i.e.
+  up to d passes. Fewer passes are made when block_size is large (a single
+  one when the whole array fits into block_size elements). The passes can't
+  be merged into one without keeping a projection of size N r / n_d of the
+  array in memory.
+
+  Args:
+    path: path to a .npy file (a string or e.g. pathlib.Path), or a numpy
+      array (e.g. np.memmap).
+    max_tt_rank: a number or a list of numbers, see to_tt_tensor.
+    block_size: a number, how many elements of the array to read at once.
+    dtype: [None] dtype of the resulting TT-cores, by default the dtype of
+      the array.
+
+  Returns:
+    `TensorTrain` object containing a TT-tensor.
+
+  Raises:
+    ValueError if max_tt_rank is less than 1 or is not a number and not
+      a vector of length d + 1, if block_size is less than 1.
+
+  Complexity:
+    O(N d r^2) operations where N is the number of elements, d is the number
+      of dimensions and r is the largest TT-rank,
+    O(d N) elements read from disk, and
+    O(block_size + (r n)^2 + N r / block_size + d r^2 n) memory; the
+      remaining part is at most block_size and the rows of the unfoldings
+      (of size N r / block_size) are read one by one, so memory is bounded by
+      O(block_size) when block_size >= sqrt(N r).
+  """
+  if isinstance(path, np.ndarray):
+    array = path
+  else:
+    array = np.load(path, mmap_mode='r')
+  if dtype is None:
+    dtype = array.dtype
+  shape = array.shape
+  d = len(shape)
+  max_tt_rank = _normalize_max_tt_rank(max_tt_rank, d)
+  if block_size < 1:
+    raise ValueError('block_size should be positive, got %d.' % block_size)
+  flat_array = array.reshape(-1)
+
+  # The TT-cores found so far, from right to left.
+  right_cores = []
+  rank = 1
+  num_left = d
+  while num_left > 1 and np.prod(shape[:num_left]) * rank > block_size:
+    mode = shape[num_left - 1]
+    columns = mode * rank
+    gram = np.zeros((columns, columns))
+    for block in _memmap_row_blocks(flat_array, shape, num_left - 1,
+                                    right_cores, block_size):
+      block = block.reshape(-1, columns)
+      gram += block.T.dot(block)
+    eigvals, eigvecs = np.linalg.eigh(gram)
+    rows = np.prod(shape[:num_left - 1])
+    new_rank = int(min(max_tt_rank[num_left - 1], columns, rows))
+    # Eigenvalues are in the ascending order.
+    eigvecs = eigvecs[:, ::-1][:, :new_rank]
+    right_cores.insert(0, eigvecs.T.reshape(new_rank, mode, rank))
+    rank = new_rank
+    num_left -= 1
+
+  # The remaining part contracted with the right TT-cores fits in memory.
+  remainder = np.concatenate(list(_memmap_row_blocks(
+      flat_array, shape, num_left, right_cores, block_size)), axis=0)
+  left_cores = []
+  left_rank = 1
+  for core_idx in range(num_left):
+    remainder = remainder.reshape(left_rank * shape[core_idx], -1)
+    u, s, v = np.linalg.svd(remainder, full_matrices=False)
+    new_rank = int(min(max_tt_rank[core_idx + 1], len(s)))
+    left_cores.append(u[:, :new_rank].reshape(left_rank, shape[core_idx],
+                                              new_rank))
+    remainder = s[:new_rank, np.newaxis] * v[:new_rank]
+    left_rank = new_rank
+  # Now remainder is of size left_rank x rank, merge it into the next TT-core.
+  if right_cores:
+    right_cores[0] = np.einsum('ab,bic->aic', remainder, right_cores[0])
+  else:
+    left_cores[-1] = left_cores[-1] * remainder[0, 0]
+  tt_cores = [tf.constant(core, dtype=dtype)
+              for core in left_cores + right_cores]
+  return TensorTrain(tt_cores)
+
+
+def _memmap_row_blocks(flat_array, shape, split, right_cores, block_size):
+  """Yields row blocks of an unfolding contracted with the right TT-cores.
+
+  Args:
+    flat_array: 1-D numpy array (or memmap) with the elements of the tensor.
+    shape: the shape of the tensor.
+    split: a number k, the rows of the unfolding are indexed by the first k
+      modes.
+    right_cores: list of numpy arrays, the TT-cores of the last modes (the
+      number of them is d - k - 1 or d - k).
+    block_size: a number, roughly how many elements to read at once.
+
+  Yields:
+    float64 numpy arrays of size b x n_{k+1} ... x r (the modes which are not
+    covered by right_cores are kept), where r is the first TT-rank of
+    right_cores.
+  """
+  num_rows = int(np.prod(shape[:split]))
+  row_size = int(np.prod(shape[split:]))
+  rows_per_block = max(block_size // row_size, 1)
+  first_right_mode = len(shape) - len(right_cores)
+  for begin in range(0, num_rows, rows_per_block):
+    end = min(begin + rows_per_block, num_rows)
+    block = np.asarray(flat_array[begin * row_size:end * row_size],
+                       dtype=np.float64)
+    block = block.reshape(-1, 1)
+    # Contract with the TT-cores from right to left.
+    for core_idx in range(len(right_cores) - 1, -1, -1):
+      core = right_cores[core_idx]
+      mode = shape[first_right_mode + core_idx]
+      block = block.reshape(-1, mode * core.shape[2])
+      block = block.dot(core.reshape(core.shape[0], -1).T)
+    yield block.reshape(end - begin, -1)
+
+
 # TODO: rename round so not to shadow python.round?
-def round(tt, max_tt_rank=None, epsilon=None, name='t3f_round'):
+def round(tt, max_tt_rank=None, epsilon=None, method='svd', oversampling=10,
+          return_error=False, name='t3f_round'):
   """TT-rounding procedure, returns a TT object with smaller TT-ranks.
 
   Args:
@@ -210,8 +446,8 @@ def round(tt, max_tt_rank=None, epsilon=None, name='t3f_round'):
       and
         `max_tt_rank = r * np.ones(d-1)`
     epsilon: a floating point number or None
-      If the TT-ranks are not restricted (`max_tt_rank=np.inf`), then
-      the result would be guarantied to be `epsilon` close to `tt`
+      If the TT-ranks are not restricted (`max_tt_rank=np.inf` or None),
+      then the result would be guarantied to be `epsilon` close to `tt`
       in terms of relative Frobenius error:
         ||res - tt||_F / ||tt||_F <= epsilon
       If the TT-ranks are restricted, providing a loose `epsilon` may
@@ -223,22 +459,90 @@ def round(tt, max_tt_rank=None, epsilon=None, name='t3f_round'):
       the TT-ranks of the result undefined on the compilation stage
       (e.g. res.get_tt_ranks() will return None, but t3f.tt_ranks(res).eval()
       will work).
+    method: string, 'svd' or 'randomized'.
+      'svd' is the classic TT-rounding: QR orthogonalization followed by
+      the SVD-based truncation, its cost is cubic in the TT-rank of `tt`.
+      'randomized' first compresses `tt` onto the subspaces found by
+      contracting it with a random TT-tensor of TT-rank
+      max_tt_rank + oversampling and then applies the 'svd' rounding to the
+      (small) result. Its cost is quadratic (instead of cubic) in the TT-rank
+      of `tt` for a fixed `max_tt_rank`, but the result is only
+      quasi-optimal and is random.
+      The 'randomized' method requires `max_tt_rank` to be provided.
+    oversampling: a number, how much larger than `max_tt_rank` the TT-rank of
+      the random sketch should be. Bigger values improve accuracy of the
+      'randomized' method at the expense of speed. Ignored for 'svd'.
+    return_error: bool, whether to also return the relative Frobenius error
+      of the rounding ||res - tt||_F / ||tt||_F (a vector of errors for
+      `TensorTrainBatch`).
     name: string, name of the Op.
 
   Returns:
     `TensorTrain` object containing a TT-tensor.
+    OR a tuple (`TensorTrain`, tf.Tensor) with the relative error if
+      return_error is True.
 
   Raises:
     ValueError if max_tt_rank is less than 0, if max_tt_rank is not a number and
       not a vector of length d + 1 where d is the number of dimensions (rank) of
-      the input tensor, if epsilon is less than 0.
+      the input tensor, if epsilon is less than 0, if the method is unknown or
+      if max_tt_rank is not provided for the 'randomized' method.
+
+  Complexity:
+    method='svd':
+      O(d r^3 n)
+    method='randomized':
+      O(d r^2 n (R + p)) + O(d n (R + p)^3)
+    where
+      d is the number of TT-cores (tt.ndims());
+      r is the largest TT-rank of tt max(tt.get_tt_rank());
+      R is the largest max_tt_rank and p is oversampling;
+      n is the size of the axis dimension, e.g.
+        for a tensor of size 4 x 4 x 4, n is 4;
+        for a 9 x 64 matrix of raw shape (3, 3, 3) x (4, 4, 4) n is 12
+    return_error=True adds O(d r^3 n) to compute the norm of tt (and the
+    inner product of tt and the result for the 'randomized' method).
   """
   # TODO: add epsilon to the name_scope dependencies.
   with tf.name_scope(name, values=tt.tt_cores):
-    if isinstance(tt, TensorTrainBatch):
-      return _round_batch_tt(tt, max_tt_rank, epsilon)
+    # TODO: ugly.
+    # We can't import ops in the beginning since it creates cyclic dependencies.
+    from t3f import ops
+    dtype = tt.dtype
+    # 16-bit TT-cores are rounded in float32, see utils.accumulation_dtype.
+    upcasted_tt = ops.cast(tt, utils.accumulation_dtype(dtype))
+    is_batch = isinstance(tt, TensorTrainBatch)
+    if method == 'svd':
+      if is_batch:
+        res = _round_batch_tt(upcasted_tt, max_tt_rank, epsilon)
+      else:
+        res = _round_tt(upcasted_tt, max_tt_rank, epsilon)
+    elif method == 'randomized':
+      if max_tt_rank is None:
+        raise ValueError('The randomized rounding requires max_tt_rank.')
+      if is_batch:
+        res = _round_batch_tt_randomized(upcasted_tt, max_tt_rank, epsilon,
+                                         oversampling)
+      else:
+        res = _round_tt_randomized(upcasted_tt, max_tt_rank, epsilon,
+                                   oversampling)
+    else:
+      raise ValueError('Unknown rounding method "%s", only "svd" and '
+                       '"randomized" are supported.' % method)
+    if not return_error:
+      return ops.cast(res, dtype)
+    tt_norm_sq = ops.frobenius_norm_squared(upcasted_tt, differentiable=True)
+    res_norm_sq = ops.frobenius_norm_squared(res, differentiable=True)
+    if method == 'svd':
+      # The TT-SVD result is an orthogonal projection of tt, so
+      #   ||res - tt||^2 = ||tt||^2 - ||res||^2.
+      error_sq = tt_norm_sq - res_norm_sq
     else:
-      return _round_tt(tt, max_tt_rank, epsilon)
+      # The randomized result is not an orthogonal projection of tt.
+      error_sq = (tt_norm_sq - 2 * ops.flat_inner(upcasted_tt, res) +
+                  res_norm_sq)
+    error = tf.sqrt(tf.maximum(error_sq, 0) / tt_norm_sq)
+    return ops.cast(res, dtype), tf.cast(error, dtype)
 
 
 def _round_tt(tt, max_tt_rank, epsilon):
@@ -246,22 +550,40 @@ def _round_tt(tt, max_tt_rank, epsilon):
 
   See t3f.round for details.
   """
-  ndims = tt.ndims()
-  max_tt_rank = np.array(max_tt_rank).astype(np.int32)
-  if np.any(max_tt_rank < 1):
-    raise ValueError('Maximum TT-rank should be greater or equal to 1.')
+  max_tt_rank = _normalize_max_tt_rank(max_tt_rank, tt.ndims())
   if epsilon is not None and epsilon < 0:
     raise ValueError('Epsilon should be non-negative.')
-  if max_tt_rank.size == 1:
-    max_tt_rank = (max_tt_rank * np.ones(ndims + 1)).astype(np.int32)
-  elif max_tt_rank.size != ndims + 1:
-    raise ValueError('max_tt_rank should be a number or a vector of size (d+1) '
-                     'where d is the number of dimensions (rank) of the tensor.')
-  raw_shape = shapes.lazy_raw_shape(tt)
+  return _round_left_orthogonal_tt(orthogonalize_tt_cores(tt), max_tt_rank,
+                                   epsilon)
+
+
+def _round_left_orthogonal_tt(tt, max_tt_rank, epsilon):
+  """Internal function that rounds a left-orthogonal TensorTrain (not batch).
 
-  tt_cores = orthogonalize_tt_cores(tt).tt_cores
+  Does the right to left SVD sweep of the TT-rounding, i.e. assumes that all
+  the TT-cores except for the last one are already orthogonalized from left to
+  right (e.g. by orthogonalize_tt_cores).
+
+  Args:
+    tt: `TensorTrain` object with left-orthogonal TT-cores.
+    max_tt_rank: None or a vector of d+1 numbers, the largest allowed TT-ranks.
+    epsilon: None or a floating point number, the desired relative accuracy.
+
+  Returns:
+    `TensorTrain` object.
+  """
+  ndims = tt.ndims()
+  if max_tt_rank is None:
+    max_tt_rank = [None] * (ndims + 1)
+  raw_shape = shapes.lazy_raw_shape(tt)
   # Copy cores references so we can change the cores.
-  tt_cores = list(tt_cores)
+  tt_cores = list(tt.tt_cores)
+
+  delta = None
+  if epsilon is not None and ndims > 1:
+    # The norm of a left-orthogonal TT is the norm of its last TT-core.
+    # Distribute the allowed error equally between the d - 1 truncations.
+    delta = epsilon / np.sqrt(ndims - 1) * tf.norm(tt_cores[-1])
 
   ranks = [1] * (ndims + 1)
   are_tt_ranks_defined = True
@@ -280,18 +602,13 @@ def _round_tt(tt, max_tt_rank, epsilon):
     rows = curr_core.get_shape()[0].value
     if rows is None:
       rows = tf.shape(curr_core)[0]
+    s, u, v = tf.svd(curr_core, full_matrices=False)
     if max_tt_rank[core_idx] == 1:
       ranks[core_idx] = 1
     else:
-      try:
-        ranks[core_idx] = min(max_tt_rank[core_idx], rows, columns)
-      except TypeError:
-        # Some of the values are undefined on the compilation stage and thus
-        # they are tf.tensors instead of values.
-        min_dim = tf.minimum(rows, columns)
-        ranks[core_idx] = tf.minimum(max_tt_rank[core_idx], min_dim)
+      ranks[core_idx] = _truncation_rank(s, max_tt_rank[core_idx], delta)
+      if isinstance(ranks[core_idx], tf.Tensor):
         are_tt_ranks_defined = False
-    s, u, v = tf.svd(curr_core, full_matrices=False)
     u = u[:, 0:ranks[core_idx]]
     s = s[0:ranks[core_idx]]
     v = v[:, 0:ranks[core_idx]]
@@ -321,23 +638,34 @@ def _round_batch_tt(tt, max_tt_rank, epsilon):
 
   See t3f.round for details.
   """
-  ndims = tt.ndims()
-  max_tt_rank = np.array(max_tt_rank).astype(np.int32)
-  if max_tt_rank < 1:
-    raise ValueError('Maximum TT-rank should be greater or equal to 1.')
+  max_tt_rank = _normalize_max_tt_rank(max_tt_rank, tt.ndims())
   if epsilon is not None and epsilon < 0:
     raise ValueError('Epsilon should be non-negative.')
-  if max_tt_rank.size == 1:
-    max_tt_rank = (max_tt_rank * np.ones(ndims + 1)).astype(np.int32)
-  elif max_tt_rank.size != ndims + 1:
-    raise ValueError('max_tt_rank should be a number or a vector of size (d+1) '
-                     'where d is the number of dimensions (rank) of the tensor.')
+  return _round_left_orthogonal_batch_tt(orthogonalize_tt_cores(tt),
+                                         max_tt_rank, epsilon)
+
+
+def _round_left_orthogonal_batch_tt(tt, max_tt_rank, epsilon):
+  """Internal function that rounds a left-orthogonal TensorTrainBatch.
+
+  The batch version of _round_left_orthogonal_tt. The TT-ranks are the same for
+  all the objects in the batch, so with epsilon the largest TT-rank required
+  over the batch is used.
+  """
+  ndims = tt.ndims()
+  if max_tt_rank is None:
+    max_tt_rank = [None] * (ndims + 1)
   raw_shape = shapes.lazy_raw_shape(tt)
   batch_size = shapes.lazy_batch_size(tt)
-
-  tt_cores = orthogonalize_tt_cores(tt).tt_cores
   # Copy cores references so we can change the cores.
-  tt_cores = list(tt_cores)
+  tt_cores = list(tt.tt_cores)
+
+  delta = None
+  if epsilon is not None and ndims > 1:
+    # The norm of a left-orthogonal TT is the norm of its last TT-core.
+    # Distribute the allowed error equally between the d - 1 truncations.
+    last_core = tf.reshape(tt_cores[-1], (batch_size, -1))
+    delta = epsilon / np.sqrt(ndims - 1) * tf.norm(last_core, axis=1)
 
   ranks = [1] * (ndims + 1)
   are_tt_ranks_defined = True
@@ -356,18 +684,13 @@ def _round_batch_tt(tt, max_tt_rank, epsilon):
     rows = curr_core.get_shape()[1].value
     if rows is None:
       rows = tf.shape(curr_core)[1]
+    s, u, v = tf.svd(curr_core, full_matrices=False)
     if max_tt_rank[core_idx] == 1:
       ranks[core_idx] = 1
     else:
-      try:
-        ranks[core_idx] = min(max_tt_rank[core_idx], rows, columns)
-      except TypeError:
-        # Some of the values are undefined on the compilation stage and thus
-        # they are tf.tensors instead of values.
-        min_dim = tf.minimum(rows, columns)
-        ranks[core_idx] = tf.minimum(max_tt_rank[core_idx], min_dim)
+      ranks[core_idx] = _truncation_rank(s, max_tt_rank[core_idx], delta)
+      if isinstance(ranks[core_idx], tf.Tensor):
         are_tt_ranks_defined = False
-    s, u, v = tf.svd(curr_core, full_matrices=False)
     u = u[:, :, 0:ranks[core_idx]]
     s = s[:, 0:ranks[core_idx]]
     v = v[:, :, 0:ranks[core_idx]]
@@ -392,6 +715,236 @@ def _round_batch_tt(tt, max_tt_rank, epsilon):
   return TensorTrainBatch(tt_cores, tt.get_raw_shape(), ranks, batch_size=tt.batch_size)
 
 
+def _round_tt_randomized(tt, max_tt_rank, epsilon, oversampling):
+  """Internal function that rounds a TensorTrain by a random sketch.
+
+  Implements the "randomize-then-orthogonalize" TT-rounding from [1]:
+  contracts `tt` with a random TT-tensor of TT-rank max_tt_rank + oversampling
+  to find the subspaces to project on, orthogonally projects `tt` onto them in
+  a left to right sweep and then does the usual SVD rounding of the result.
+
+  [1] H. Al Daas, G. Ballard, P. Cazeaux, E. Hallman, A. Miedlar, M. Pasha,
+    T. W. Reid, A. K. Saibaba, Randomized algorithms for rounding in the
+    Tensor-Train format.
+
+  See t3f.round for details.
+  """
+  ndims = tt.ndims()
+  max_tt_rank = _normalize_max_tt_rank(max_tt_rank, ndims)
+  if oversampling < 0:
+    raise ValueError('Oversampling should be non-negative.')
+  raw_shape = shapes.lazy_raw_shape(tt)
+  tt_ranks = shapes.lazy_tt_ranks(tt)
+  dtype = tt.dtype
+  modes = []
+  for core_idx in range(ndims):
+    if tt.is_tt_matrix():
+      modes.append(raw_shape[0][core_idx] * raw_shape[1][core_idx])
+    else:
+      modes.append(raw_shape[0][core_idx])
+  sketch_ranks = [1] + [max_tt_rank[i] + oversampling
+                        for i in range(1, ndims)] + [1]
+
+  # Right to left contraction of tt with the random sketch.
+  # sketch_prods[core_idx] is of size tt_ranks[core_idx] x sketch_ranks[core_idx]
+  sketch_prods = [None] * (ndims + 1)
+  sketch_prods[ndims] = tf.ones((1, 1), dtype=dtype)
+  for core_idx in range(ndims - 1, 0, -1):
+    curr_core = tf.reshape(tt.tt_cores[core_idx],
+                           (tt_ranks[core_idx], modes[core_idx], -1))
+    sketch_shape = (sketch_ranks[core_idx], modes[core_idx],
+                    sketch_ranks[core_idx + 1])
+    # Normalize the sketch so that the products neither explode nor vanish.
+    stddev = 1.0 / np.sqrt(sketch_ranks[core_idx + 1])
+    sketch_core = tf.random_normal(sketch_shape, stddev=stddev, dtype=dtype)
+    sketch_prods[core_idx] = tf.einsum('aib,bd,cid->ac', curr_core,
+                                       sketch_prods[core_idx + 1], sketch_core)
+
+  # Left to right sweep projecting tt on the range of the sketched unfoldings.
+  tt_cores = list(tt.tt_cores)
+  curr_rank = 1
+  ranks = [1] * (ndims + 1)
+  for core_idx in range(ndims - 1):
+    curr_core = tf.reshape(tt_cores[core_idx], (-1, tt_ranks[core_idx + 1]))
+    sketched = tf.matmul(curr_core, sketch_prods[core_idx + 1])
+    q, _ = tf.qr(sketched)
+    next_rank = q.get_shape()[1].value
+    if next_rank is None:
+      next_rank = tf.shape(q)[1]
+    ranks[core_idx + 1] = next_rank
+    if tt.is_tt_matrix():
+      new_core_shape = (curr_rank, raw_shape[0][core_idx],
+                        raw_shape[1][core_idx], next_rank)
+    else:
+      new_core_shape = (curr_rank, raw_shape[0][core_idx], next_rank)
+    tt_cores[core_idx] = tf.reshape(q, new_core_shape)
+    coef = tf.matmul(q, curr_core, transpose_a=True)
+    next_core = tf.reshape(tt_cores[core_idx + 1],
+                           (tt_ranks[core_idx + 1], -1))
+    tt_cores[core_idx + 1] = tf.matmul(coef, next_core)
+    curr_rank = next_rank
+  if tt.is_tt_matrix():
+    last_core_shape = (curr_rank, raw_shape[0][-1], raw_shape[1][-1], 1)
+  else:
+    last_core_shape = (curr_rank, raw_shape[0][-1], 1)
+  tt_cores[-1] = tf.reshape(tt_cores[-1], last_core_shape)
+  try:
+    sketched_tt = TensorTrain(tt_cores, tt.get_raw_shape(), ranks)
+  except TypeError:
+    # Some of the ranks are undefined on the compilation stage.
+    sketched_tt = TensorTrain(tt_cores, tt.get_raw_shape())
+  return _round_tt(sketched_tt, max_tt_rank, epsilon)
+
+
+def _round_batch_tt_randomized(tt, max_tt_rank, epsilon, oversampling):
+  """Internal function that rounds a TensorTrainBatch by a random sketch.
+
+  The same random sketch is used for all the objects in the batch.
+
+  See t3f.round and _round_tt_randomized for details.
+  """
+  ndims = tt.ndims()
+  max_tt_rank = _normalize_max_tt_rank(max_tt_rank, ndims)
+  if oversampling < 0:
+    raise ValueError('Oversampling should be non-negative.')
+  raw_shape = shapes.lazy_raw_shape(tt)
+  tt_ranks = shapes.lazy_tt_ranks(tt)
+  batch_size = shapes.lazy_batch_size(tt)
+  dtype = tt.dtype
+  modes = []
+  for core_idx in range(ndims):
+    if tt.is_tt_matrix():
+      modes.append(raw_shape[0][core_idx] * raw_shape[1][core_idx])
+    else:
+      modes.append(raw_shape[0][core_idx])
+  sketch_ranks = [1] + [max_tt_rank[i] + oversampling
+                        for i in range(1, ndims)] + [1]
+
+  # Right to left contraction of tt with the random sketch.
+  # sketch_prods[core_idx] is of size
+  #   batch_size x tt_ranks[core_idx] x sketch_ranks[core_idx]
+  sketch_prods = [None] * (ndims + 1)
+  sketch_prods[ndims] = tf.ones((batch_size, 1, 1), dtype=dtype)
+  for core_idx in range(ndims - 1, 0, -1):
+    curr_core = tf.reshape(tt.tt_cores[core_idx],
+                           (batch_size, tt_ranks[core_idx], modes[core_idx],
+                            -1))
+    sketch_shape = (sketch_ranks[core_idx], modes[core_idx],
+                    sketch_ranks[core_idx + 1])
+    # Normalize the sketch so that the products neither explode nor vanish.
+    stddev = 1.0 / np.sqrt(sketch_ranks[core_idx + 1])
+    sketch_core = tf.random_normal(sketch_shape, stddev=stddev, dtype=dtype)
+    sketch_prods[core_idx] = tf.einsum('oaib,obd,cid->oac', curr_core,
+                                       sketch_prods[core_idx + 1], sketch_core)
+
+  # Left to right sweep projecting tt on the range of the sketched unfoldings.
+  tt_cores = list(tt.tt_cores)
+  curr_rank = 1
+  ranks = [1] * (ndims + 1)
+  for core_idx in range(ndims - 1):
+    curr_core = tf.reshape(tt_cores[core_idx],
+                           (batch_size, -1, tt_ranks[core_idx + 1]))
+    sketched = tf.matmul(curr_core, sketch_prods[core_idx + 1])
+    q, _ = tf.qr(sketched)
+    next_rank = q.get_shape()[2].value
+    if next_rank is None:
+      next_rank = tf.shape(q)[2]
+    ranks[core_idx + 1] = next_rank
+    if tt.is_tt_matrix():
+      new_core_shape = (batch_size, curr_rank, raw_shape[0][core_idx],
+                        raw_shape[1][core_idx], next_rank)
+    else:
+      new_core_shape = (batch_size, curr_rank, raw_shape[0][core_idx],
+                        next_rank)
+    tt_cores[core_idx] = tf.reshape(q, new_core_shape)
+    coef = tf.matmul(q, curr_core, transpose_a=True)
+    next_core = tf.reshape(tt_cores[core_idx + 1],
+                           (batch_size, tt_ranks[core_idx + 1], -1))
+    tt_cores[core_idx + 1] = tf.matmul(coef, next_core)
+    curr_rank = next_rank
+  if tt.is_tt_matrix():
+    last_core_shape = (batch_size, curr_rank, raw_shape[0][-1],
+                       raw_shape[1][-1], 1)
+  else:
+    last_core_shape = (batch_size, curr_rank, raw_shape[0][-1], 1)
+  tt_cores[-1] = tf.reshape(tt_cores[-1], last_core_shape)
+  try:
+    sketched_tt = TensorTrainBatch(tt_cores, tt.get_raw_shape(), ranks,
+                                   batch_size=tt.batch_size)
+  except TypeError:
+    # Some of the ranks are undefined on the compilation stage.
+    sketched_tt = TensorTrainBatch(tt_cores, tt.get_raw_shape(),
+                                   batch_size=tt.batch_size)
+  return _round_batch_tt(sketched_tt, max_tt_rank, epsilon)
+
+
+def _normalize_max_tt_rank(max_tt_rank, ndims):
+  """Internal function that converts max_tt_rank into a vector of size d+1.
+
+  Args:
+    max_tt_rank: None, a number or a list of d+1 numbers, np.inf stands for
+      an unrestricted TT-rank.
+    ndims: int, the number of TT-cores d.
+
+  Returns:
+    None if max_tt_rank is None and a numpy int32 vector of size d+1 otherwise
+    (np.inf is replaced by the largest int32).
+
+  Raises:
+    ValueError if max_tt_rank is less than 1 or if it is not a number and not
+      a vector of length d + 1.
+  """
+  if max_tt_rank is None:
+    return None
+  max_tt_rank = np.array(max_tt_rank, dtype=np.float64)
+  if np.any(max_tt_rank < 1):
+    raise ValueError('Maximum TT-rank should be greater or equal to 1.')
+  max_tt_rank = np.minimum(max_tt_rank, np.iinfo(np.int32).max)
+  max_tt_rank = max_tt_rank.astype(np.int32)
+  if max_tt_rank.size == 1:
+    max_tt_rank = (max_tt_rank * np.ones(ndims + 1)).astype(np.int32)
+  elif max_tt_rank.size != ndims + 1:
+    raise ValueError('max_tt_rank should be a number or a vector of size (d+1) '
+                     'where d is the number of dimensions (rank) of the tensor.')
+  return max_tt_rank
+
+
+def _truncation_rank(s, max_rank=None, delta=None):
+  """Internal function that chooses the rank of a truncated SVD.
+
+  Args:
+    s: tf.Tensor of singular values sorted in the descending order, of size
+      n or batch_size x n.
+    max_rank: None or a number, the largest allowed rank.
+    delta: None or tf.Tensor of size 1 (batch_size), the largest allowed
+      Frobenius norm of the discarded singular values.
+      For a batch the largest rank over the batch is returned.
+
+  Returns:
+    A number if the rank is known on the compilation stage (delta is None and
+    the size of s is defined) and 0-D int32 tf.Tensor otherwise.
+  """
+  num_values = s.get_shape()[-1].value
+  if num_values is None:
+    num_values = tf.shape(s)[-1]
+  if max_rank is None:
+    rank = num_values
+  else:
+    try:
+      rank = min(max_rank, num_values)
+    except TypeError:
+      # The number of singular values is undefined on the compilation stage.
+      rank = tf.minimum(max_rank, num_values)
+  if delta is None:
+    return rank
+  # tail_norms[..., i] is the norm of s[..., i:].
+  tail_norms = tf.sqrt(tf.cumsum(s ** 2, axis=-1, reverse=True))
+  delta = tf.expand_dims(delta, -1)
+  delta_rank = tf.reduce_sum(tf.cast(tail_norms > delta, tf.int32), axis=-1)
+  delta_rank = tf.maximum(tf.reduce_max(delta_rank), 1)
+  return tf.minimum(delta_rank, rank)
+
+
 def orthogonalize_tt_cores(tt, left_to_right=True,
                            name='t3f_orthogonalize_tt_cores'):
   """Orthogonalize TT-cores of a TT-object.
@@ -405,17 +958,24 @@ def orthogonalize_tt_cores(tt, left_to_right=True,
     The same type as the input `tt` (TenosorTrain or a TensorTrainBatch).
   """
   with tf.name_scope(name, values=tt.tt_cores):
+    # TODO: ugly.
+    # We can't import ops in the beginning since it creates cyclic dependencies.
+    from t3f import ops
+    dtype = tt.dtype
+    # 16-bit TT-cores are orthogonalized in float32, see
+    # utils.accumulation_dtype.
+    upcasted_tt = ops.cast(tt, utils.accumulation_dtype(dtype))
     if isinstance(tt, TensorTrainBatch):
       if left_to_right:
-        return _orthogonalize_batch_tt_cores_left_to_right(tt)
+        res = _orthogonalize_batch_tt_cores_left_to_right(upcasted_tt)
       else:
-        raise NotImplementedError('Batch right to left orthogonalization is '
-                                  'not supported yet.')
+        res = _orthogonalize_batch_tt_cores_right_to_left(upcasted_tt)
     else:
       if left_to_right:
-        return _orthogonalize_tt_cores_left_to_right(tt)
+        res = _orthogonalize_tt_cores_left_to_right(upcasted_tt)
       else:
-        return _orthogonalize_tt_cores_right_to_left(tt)
+        res = _orthogonalize_tt_cores_right_to_left(upcasted_tt)
+    return ops.cast(res, dtype)
 
 
 def _orthogonalize_tt_cores_left_to_right(tt):
@@ -548,7 +1108,7 @@ def _orthogonalize_batch_tt_cores_left_to_right(tt):
     last_core_shape = (batch_size, next_rank, raw_shape[0][-1], 1)
   tt_cores[-1] = tf.reshape(tt_cores[-1], last_core_shape)
   # TODO: infer the tt_ranks.
-  return TensorTrainBatch(tt_cores, tt.get_raw_shape(), batch_size=batch_size)
+  return TensorTrainBatch(tt_cores, tt.get_raw_shape(), batch_size=tt.batch_size)
 
 
 def _orthogonalize_tt_cores_right_to_left(tt):
@@ -610,3 +1170,73 @@ def _orthogonalize_tt_cores_right_to_left(tt):
   tt_cores[0] = tf.reshape(tt_cores[0], first_core_shape)
   # TODO: infer the tt_ranks.
   return TensorTrain(tt_cores, tt.get_raw_shape())
+
+
+def _orthogonalize_batch_tt_cores_right_to_left(tt):
+  """Orthogonalize TT-cores of a batch TT-object in the right to left order.
+
+  Args:
+    tt: TensorTrainBatch.
+
+  Returns:
+    TensorTrainBatch
+
+  Complexity:
+    O(batch_size d r^3 n), the QR decompositions of all the objects in the
+      batch are computed by one batched op per TT-core.
+  """
+  # Right to left orthogonalization.
+  ndims = tt.ndims()
+  raw_shape = shapes.lazy_raw_shape(tt)
+  tt_ranks = shapes.lazy_tt_ranks(tt)
+  prev_rank = tt_ranks[ndims]
+  batch_size = shapes.lazy_batch_size(tt)
+
+  # Copy cores references so we can change the cores.
+  tt_cores = list(tt.tt_cores)
+  for core_idx in range(ndims - 1, 0, -1):
+    curr_core = tt_cores[core_idx]
+    # TT-ranks could have changed on the previous iteration, so `tt_ranks` can
+    # be outdated for the current TT-rank, but should be valid for the next
+    # TT-rank.
+    curr_rank = prev_rank
+    prev_rank = tt_ranks[core_idx]
+    if tt.is_tt_matrix():
+      curr_mode_left = raw_shape[0][core_idx]
+      curr_mode_right = raw_shape[1][core_idx]
+      curr_mode = curr_mode_left * curr_mode_right
+    else:
+      curr_mode = raw_shape[0][core_idx]
+
+    qr_shape = (batch_size, prev_rank, curr_mode * curr_rank)
+    curr_core = tf.reshape(curr_core, qr_shape)
+    curr_core, triang = tf.qr(tf.matrix_transpose(curr_core))
+    curr_core = tf.matrix_transpose(curr_core)
+    triang = tf.matrix_transpose(triang)
+    if triang.get_shape().is_fully_defined():
+      triang_shape = triang.get_shape().as_list()
+    else:
+      triang_shape = tf.shape(triang)
+    # The TT-rank could have changed: if qr_shape is e.g. 4 x 10, than q would
+    # be of size 4 x 4 and r would be 4 x 10, which means that the next rank
+    # should be changed to 4.
+    prev_rank = triang_shape[2]
+    if tt.is_tt_matrix():
+      new_core_shape = (batch_size, prev_rank, curr_mode_left, curr_mode_right,
+                        curr_rank)
+    else:
+      new_core_shape = (batch_size, prev_rank, curr_mode, curr_rank)
+    tt_cores[core_idx] = tf.reshape(curr_core, new_core_shape)
+
+    prev_core = tf.reshape(tt_cores[core_idx - 1],
+                           (batch_size, -1, triang_shape[1]))
+    tt_cores[core_idx - 1] = tf.matmul(prev_core, triang)
+
+  if tt.is_tt_matrix():
+    first_core_shape = (batch_size, 1, raw_shape[0][0], raw_shape[1][0],
+                        prev_rank)
+  else:
+    first_core_shape = (batch_size, 1, raw_shape[0][0], prev_rank)
+  tt_cores[0] = tf.reshape(tt_cores[0], first_core_shape)
+  # TODO: infer the tt_ranks.
+  return TensorTrainBatch(tt_cores, tt.get_raw_shape(), batch_size=tt.batch_size)
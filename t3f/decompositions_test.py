@@ -1,4 +1,10 @@
+import os
 import numpy as np
+try:
+  import pathlib
+except ImportError:
+  # Python 2.
+  pathlib = None
 import tensorflow.compat.v1 as tf
 
 from t3f import ops
@@ -104,6 +110,159 @@ class _DecompositionsTest():
       # TODO: why so bad accuracy?
       self.assertAllClose(mat, ops.full(tt_mat).eval(), atol=1e-5, rtol=1e-5)
 
+  def testTTTensorEpsilon(self):
+    shape = (2, 3, 4, 3)
+    np.random.seed(1)
+    # A TT-rank 2 tensor plus a small perturbation.
+    tt = initializers.tensor_with_random_cores(shape, tt_rank=2,
+                                               dtype=self.dtype)
+    with self.test_session() as sess:
+      tens = sess.run(ops.full(tt))
+      tens = tens + 1e-4 * np.linalg.norm(tens) * np.random.randn(*shape)
+      tens = tens.astype(self.dtype.as_numpy_dtype)
+      for epsilon in [1e-2, 0.3]:
+        tt_tens = decompositions.to_tt_tensor(tens, max_tt_rank=None,
+                                              epsilon=epsilon)
+        actual, ranks = sess.run([ops.full(tt_tens), shapes.tt_ranks(tt_tens)])
+        rel_error = np.linalg.norm(actual - tens) / np.linalg.norm(tens)
+        self.assertLessEqual(rel_error, epsilon)
+        self.assertTrue(np.all(ranks <= 2))
+      # Epsilon can only decrease the TT-ranks bounded by max_tt_rank.
+      tt_tens = decompositions.to_tt_tensor(tens, max_tt_rank=[1, 1, 3, 2, 1],
+                                            epsilon=1e-6)
+      ranks = sess.run(shapes.tt_ranks(tt_tens))
+      self.assertAllEqual([1, 1, 3, 2, 1], ranks)
+      # Unrestricted TT-ranks without epsilon give the exact decomposition.
+      tt_tens = decompositions.to_tt_tensor(tens, max_tt_rank=np.inf)
+      self.assertAllEqual([1, 2, 6, 3, 1], tt_tens.get_tt_ranks().as_list())
+      self.assertAllClose(tens, sess.run(ops.full(tt_tens)), atol=1e-5,
+                          rtol=1e-5)
+      with self.assertRaises(ValueError):
+        decompositions.to_tt_tensor(tens, max_tt_rank=None,
+                                    method='randomized')
+
+  def testTTMatrixEpsilon(self):
+    shape = ((2, 3), (3, 2))
+    np.random.seed(1)
+    mat = np.random.rand(6, 6).astype(self.dtype.as_numpy_dtype)
+    tt_mat = decompositions.to_tt_matrix(mat, shape, max_tt_rank=None,
+                                         epsilon=1e-5)
+    with self.test_session() as sess:
+      self.assertAllClose(mat, sess.run(ops.full(tt_mat)), atol=1e-5)
+
+  def testTTTensorRandomized(self):
+    # Randomized TT-SVD recovers an exactly low-rank tensor.
+    shape = (4, 5, 6, 3)
+    np.random.seed(1)
+    tt = initializers.random_tensor(shape, tt_rank=3, dtype=self.dtype)
+    with self.test_session() as sess:
+      tens = sess.run(ops.full(tt))
+      tt_tens = decompositions.to_tt_tensor(tf.constant(tens), max_tt_rank=3,
+                                            method='randomized')
+      self.assertEqual([1, 3, 3, 3, 1], tt_tens.get_tt_ranks().as_list())
+      self.assertAllClose(tens, ops.full(tt_tens).eval(), atol=1e-4,
+                          rtol=1e-4)
+
+      # Try to decompose the same tensor with unknown shape.
+      tf_tens_pl = tf.placeholder(self.dtype, (None, None, 6, None))
+      tt_tens = decompositions.to_tt_tensor(tf_tens_pl, max_tt_rank=3,
+                                            method='randomized',
+                                            oversampling=2,
+                                            n_power_iterations=0)
+      tt_val = ops.full(tt_tens).eval({tf_tens_pl: tens})
+      self.assertAllClose(tens, tt_val, atol=1e-4, rtol=1e-4)
+
+      # A full-rank tensor: the result is close to the optimal truncation.
+      tens = np.random.rand(*shape).astype(self.dtype.as_numpy_dtype)
+      tt_svd = decompositions.to_tt_tensor(tf.constant(tens), max_tt_rank=4)
+      tt_rand = decompositions.to_tt_tensor(tf.constant(tens), max_tt_rank=4,
+                                            method='randomized',
+                                            n_power_iterations=2)
+      svd_val, rand_val = sess.run([ops.full(tt_svd), ops.full(tt_rand)])
+      svd_err = np.linalg.norm(svd_val - tens)
+      rand_err = np.linalg.norm(rand_val - tens)
+      self.assertLess(rand_err, 1.1 * svd_err)
+
+    with self.assertRaises(ValueError):
+      decompositions.to_tt_tensor(tf.constant(tens), method='qr')
+
+  def testTTMatrixRandomized(self):
+    inp_shape = (2, 5, 2, 3)
+    out_shape = (3, 3, 2, 3)
+    tt = initializers.random_matrix((out_shape, inp_shape), tt_rank=4,
+                                    dtype=self.dtype)
+    with self.test_session() as sess:
+      mat = sess.run(ops.full(tt))
+      tt_mat = decompositions.to_tt_matrix(tf.constant(mat),
+                                           (out_shape, inp_shape),
+                                           max_tt_rank=4, method='randomized')
+      self.assertAllClose(mat, ops.full(tt_mat).eval(), atol=1e-4, rtol=1e-4)
+
+  def testTTTensorFromMemmap(self):
+    shape = (4, 5, 3, 6, 2)
+    tt = initializers.random_tensor(shape, tt_rank=3, dtype=self.dtype)
+    path = os.path.join(self.get_temp_dir(), 'tens.npy')
+    with self.test_session() as sess:
+      tens = sess.run(ops.full(tt))
+      np.save(path, tens)
+      # Small blocks to go through the out-of-core passes.
+      for block_size in [1, 50, 10 ** 6]:
+        tt_tens = decompositions.to_tt_tensor_from_memmap(
+            path, max_tt_rank=3, block_size=block_size)
+        self.assertEqual(self.dtype, tt_tens.dtype)
+        self.assertEqual([1, 3, 3, 3, 2, 1], tt_tens.get_tt_ranks().as_list())
+        self.assertAllClose(tens, ops.full(tt_tens).eval(), atol=1e-4,
+                            rtol=1e-4)
+
+      # A full-rank tensor: the same result as the in memory TT-SVD.
+      np.random.seed(1)
+      tens = np.random.rand(*shape).astype(self.dtype.as_numpy_dtype)
+      np.save(path, tens)
+      tt_desired = decompositions.to_tt_tensor(tf.constant(tens),
+                                               max_tt_rank=4)
+      tt_actual = decompositions.to_tt_tensor_from_memmap(path, max_tt_rank=4,
+                                                          block_size=50)
+      desired_val, actual_val = sess.run([ops.full(tt_desired),
+                                          ops.full(tt_actual)])
+      desired_err = np.linalg.norm(desired_val - tens)
+      actual_err = np.linalg.norm(actual_val - tens)
+      self.assertLess(actual_err, 1.1 * desired_err)
+
+      if pathlib is not None:
+        # Path objects are loaded from the file too.
+        tt_actual = decompositions.to_tt_tensor_from_memmap(
+            pathlib.Path(path), max_tt_rank=4, block_size=50)
+        self.assertAllClose(actual_val, ops.full(tt_actual).eval())
+
+      # Lossless with large enough TT-ranks, also for in memory arrays.
+      tt_actual = decompositions.to_tt_tensor_from_memmap(tens, max_tt_rank=100,
+                                                          block_size=50)
+      self.assertAllClose(tens, ops.full(tt_actual).eval(), atol=1e-5,
+                          rtol=1e-5)
+
+  def testTTTensorFromMemmapReads(self):
+    # Count how many elements of the array are read.
+    class CountingArray(np.ndarray):
+      num_read = 0
+
+      def __getitem__(self, key):
+        result = super(CountingArray, self).__getitem__(key)
+        CountingArray.num_read += np.size(result)
+        return result
+
+    shape = (4, 5, 3, 6, 2)
+    np.random.seed(1)
+    tens = np.random.rand(*shape).astype(self.dtype.as_numpy_dtype)
+    tens = tens.view(CountingArray)
+    # With tiny blocks the array is read once per TT-core.
+    decompositions.to_tt_tensor_from_memmap(tens, max_tt_rank=3, block_size=1)
+    self.assertEqual(len(shape) * tens.size, CountingArray.num_read)
+    # If everything fits into a block, the array is read once.
+    CountingArray.num_read = 0
+    decompositions.to_tt_tensor_from_memmap(tens, max_tt_rank=3,
+                                            block_size=10 ** 6)
+    self.assertEqual(tens.size, CountingArray.num_read)
+
   def testRoundTensor(self):
     shape = (2, 1, 4, 3, 3)
     np.random.seed(1)
@@ -118,6 +277,79 @@ class _DecompositionsTest():
       dynamic_tt_ranks = shapes.tt_ranks(rounded_tens).eval()
       self.assertAllEqual([1, 2, 2, 8, 3, 1], dynamic_tt_ranks)
 
+  def testRoundTensorEpsilon(self):
+    shape = (2, 1, 4, 3, 3)
+    np.random.seed(1)
+    tens = initializers.random_tensor(shape, tt_rank=3, dtype=self.dtype)
+    # A TT-tensor with redundant TT-ranks 6.
+    tens = ops.add(tens, tens)
+    rounded_tens = decompositions.round(tens, epsilon=1e-5)
+    with self.test_session() as sess:
+      vars = [ops.full(tens), ops.full(rounded_tens),
+              shapes.tt_ranks(rounded_tens)]
+      tens_value, rounded_tens_value, ranks = sess.run(vars)
+      self.assertAllClose(tens_value, rounded_tens_value, atol=1e-4, rtol=1e-4)
+      self.assertAllEqual([1, 2, 2, 3, 3, 1], ranks)
+      with self.assertRaises(ValueError):
+        decompositions.round(tens, epsilon=-1)
+
+  def testRoundTensorRandomized(self):
+    shape = (2, 1, 4, 3, 3)
+    np.random.seed(1)
+    tens = initializers.random_tensor(shape, tt_rank=15,
+                                      dtype=self.dtype)
+    rounded_tens = decompositions.round(tens, max_tt_rank=9,
+                                        method='randomized')
+    with self.test_session() as sess:
+      vars = [ops.full(tens), ops.full(rounded_tens)]
+      tens_value, rounded_tens_value = sess.run(vars)
+      self.assertAllClose(tens_value, rounded_tens_value, atol=1e-4, rtol=1e-4)
+      dynamic_tt_ranks = shapes.tt_ranks(rounded_tens).eval()
+      self.assertAllEqual([1, 2, 2, 8, 3, 1], dynamic_tt_ranks)
+
+  def testRoundError(self):
+    # Compare the reported error of both rounding methods with the actual one.
+    # The randomized result is far from the optimal one for a small
+    # oversampling, so it is not an orthogonal projection of tens.
+    shape = (4, 4, 4, 4, 4)
+    np.random.seed(1)
+    tens = initializers.random_tensor(shape, tt_rank=20, dtype=self.dtype)
+    svd_tens, svd_err = decompositions.round(tens, max_tt_rank=2,
+                                             return_error=True)
+    rand_tens, rand_err = decompositions.round(tens, max_tt_rank=2,
+                                               method='randomized',
+                                               oversampling=2,
+                                               return_error=True)
+    with self.test_session() as sess:
+      vars = [ops.full(tens), ops.full(svd_tens), ops.full(rand_tens),
+              svd_err, rand_err]
+      tens_val, svd_val, rand_val, svd_err_val, rand_err_val = sess.run(vars)
+      tens_norm = np.linalg.norm(tens_val)
+      desired_svd_err = np.linalg.norm(tens_val - svd_val) / tens_norm
+      desired_rand_err = np.linalg.norm(tens_val - rand_val) / tens_norm
+      self.assertAllClose(desired_svd_err, svd_err_val, atol=1e-4)
+      self.assertAllClose(desired_rand_err, rand_err_val, atol=1e-4)
+      self.assertAllEqual([1, 2, 2, 2, 2, 1],
+                          shapes.tt_ranks(rand_tens).eval())
+
+  def testRoundMatrixRandomized(self):
+    shape = ((2, 3, 2), (2, 2, 3))
+    np.random.seed(1)
+    mat = initializers.random_matrix(shape, tt_rank=4, dtype=self.dtype)
+    rounded_mat = decompositions.round(mat, max_tt_rank=4,
+                                       method='randomized', oversampling=2)
+    with self.test_session() as sess:
+      mat_value, rounded_mat_value = sess.run([ops.full(mat),
+                                               ops.full(rounded_mat)])
+      self.assertAllClose(mat_value, rounded_mat_value, atol=1e-4, rtol=1e-4)
+
+  def testRoundRandomizedErrors(self):
+    tens = initializers.random_tensor((2, 3, 4), tt_rank=3, dtype=self.dtype)
+    with self.assertRaises(ValueError):
+      decompositions.round(tens, method='randomized')
+    with self.assertRaises(ValueError):
+      decompositions.round(tens, max_tt_rank=2, method='unknown')
+
   def testOrthogonalizeLeftToRight(self):
     shape = (2, 4, 3, 3)
     tt_ranks = (1, 5, 2, 17, 1)
@@ -188,6 +420,41 @@ class _DecompositionsBatchTest():
           self.assertAllClose(np.eye(updated_tt_ranks[core_idx + 1]),
                               should_be_eye_val)
 
+  def testOrthogonalizeRightToLeft(self):
+    shape = (2, 4, 3, 3)
+    tt_ranks = (1, 5, 2, 17, 1)
+    updated_tt_ranks = (1, 5, 2, 3, 1)
+    tens = initializers.random_tensor_batch(shape, tt_rank=tt_ranks,
+                                            batch_size=2, dtype=self.dtype)
+    orthogonal = decompositions.orthogonalize_tt_cores(tens,
+                                                       left_to_right=False)
+    with self.test_session() as sess:
+      tens_val, orthogonal_val = sess.run([ops.full(tens), ops.full(orthogonal)])
+      self.assertAllClose(tens_val, orthogonal_val, atol=1e-5, rtol=1e-5)
+      dynamic_tt_ranks = shapes.tt_ranks(orthogonal).eval()
+      self.assertAllEqual(updated_tt_ranks, dynamic_tt_ranks)
+      # Check that the TT-cores are orthogonal.
+      for core_idx in range(1, 4):
+        core_shape = (updated_tt_ranks[core_idx],
+                      shape[core_idx] * updated_tt_ranks[core_idx + 1])
+        for i in range(2):
+          core = tf.reshape(orthogonal.tt_cores[core_idx][i], core_shape)
+          should_be_eye = tf.matmul(core, tf.transpose(core))
+          should_be_eye_val = sess.run(should_be_eye)
+          self.assertAllClose(np.eye(updated_tt_ranks[core_idx]),
+                              should_be_eye_val)
+
+  def testOrthogonalizeRightToLeftMatrix(self):
+    shape = ((2, 3, 2), (3, 2, 2))
+    mat = initializers.random_matrix_batch(shape, tt_rank=4, batch_size=3,
+                                           dtype=self.dtype)
+    orthogonal = decompositions.orthogonalize_tt_cores(mat,
+                                                       left_to_right=False)
+    with self.test_session() as sess:
+      mat_val, orthogonal_val = sess.run([ops.full(mat), ops.full(orthogonal)])
+      self.assertAllClose(mat_val, orthogonal_val, atol=1e-5, rtol=1e-5)
+      self.assertAllEqual([1, 4, 4, 1], shapes.tt_ranks(orthogonal).eval())
+
   def testRoundTensor(self):
     shape = (2, 1, 4, 3, 3)
     tens = initializers.random_tensor_batch(shape, tt_rank=15, batch_size=3,
@@ -202,6 +469,76 @@ class _DecompositionsBatchTest():
       dynamic_tt_ranks = shapes.tt_ranks(rounded_tens).eval()
       self.assertAllEqual([1, 2, 2, 8, 3, 1], dynamic_tt_ranks)
 
+  def testRoundTensorEpsilon(self):
+    shape = (2, 1, 4, 3, 3)
+    tens = initializers.random_tensor_batch(shape, tt_rank=3, batch_size=3,
+                                            dtype=self.dtype)
+    # TT-tensors with redundant TT-ranks 6.
+    tens = ops.add(tens, tens)
+    rounded_tens = decompositions.round(tens, epsilon=1e-5)
+    with self.test_session() as sess:
+      vars = [ops.full(tens), ops.full(rounded_tens),
+              shapes.tt_ranks(rounded_tens)]
+      tens_value, rounded_tens_value, ranks = sess.run(vars)
+      self.assertAllClose(tens_value, rounded_tens_value, atol=1e-4, rtol=1e-4)
+      self.assertAllEqual([1, 2, 2, 3, 3, 1], ranks)
+
+  def testRoundTensorRandomized(self):
+    shape = (2, 1, 4, 3, 3)
+    tens = initializers.random_tensor_batch(shape, tt_rank=15, batch_size=3,
+                                            dtype=self.dtype)
+    rounded_tens, err = decompositions.round(tens, max_tt_rank=9,
+                                             method='randomized',
+                                             return_error=True)
+    with self.test_session() as sess:
+      vars = [ops.full(tens), ops.full(rounded_tens), err]
+      tens_value, rounded_tens_value, err_value = sess.run(vars)
+      self.assertAllClose(tens_value, rounded_tens_value, atol=1e-4,
+                          rtol=1e-4)
+      self.assertAllClose(np.zeros(3), err_value, atol=1e-2)
+      dynamic_tt_ranks = shapes.tt_ranks(rounded_tens).eval()
+      self.assertAllEqual([1, 2, 2, 8, 3, 1], dynamic_tt_ranks)
+
+
+class _DecompositionsMixedPrecisionTest():
+  # QR and SVD are computed in float32 for TT-cores stored in self.dtype.
+
+  def testToTTTensor(self):
+    np.random.seed(1)
+    tens = np.random.rand(2, 3, 4, 3)
+    tt_tens = decompositions.to_tt_tensor(tf.cast(tens, self.dtype),
+                                          max_tt_rank=20)
+    self.assertEqual(self.dtype, tt_tens.dtype)
+    with self.test_session() as sess:
+      actual = sess.run(tf.cast(ops.full(tt_tens), tf.float64))
+      self.assertAllClose(tens, actual, atol=5e-2, rtol=5e-2)
+
+  def testRoundAndOrthogonalize(self):
+    shape = (2, 1, 4, 3, 3)
+    tens_16 = initializers.random_tensor(shape, tt_rank=3, dtype=self.dtype)
+    tens = ops.cast(tens_16, tf.float64)
+    rounded = decompositions.round(ops.add(tens_16, tens_16), max_tt_rank=3)
+    orthogonal = decompositions.orthogonalize_tt_cores(tens_16,
+                                                       left_to_right=False)
+    self.assertEqual(self.dtype, rounded.dtype)
+    self.assertEqual(self.dtype, orthogonal.dtype)
+    to_run = [ops.full(tens), ops.full(ops.cast(rounded, tf.float64)),
+              ops.full(ops.cast(orthogonal, tf.float64))]
+    with self.test_session() as sess:
+      tens_val, rounded_val, orthogonal_val = sess.run(to_run)
+      self.assertAllClose(2 * tens_val, rounded_val, atol=5e-2, rtol=5e-2)
+      self.assertAllClose(tens_val, orthogonal_val, atol=5e-2, rtol=5e-2)
+
+
+class DecompositionsMixedPrecisionTestFloat16(
+    tf.test.TestCase, _DecompositionsMixedPrecisionTest):
+  dtype = tf.float16
+
+
+class DecompositionsMixedPrecisionTestBfloat16(
+    tf.test.TestCase, _DecompositionsMixedPrecisionTest):
+  dtype = tf.bfloat16
+
 
 class DecompositionsTestFloat32(tf.test.TestCase, _DecompositionsTest):
   dtype = tf.float32
@@ -44,11 +44,13 @@ def _full_tt(tt):
   shape = shapes.lazy_shape(tt)
   raw_shape = shapes.lazy_raw_shape(tt)
 
-  res = tt.tt_cores[0]
+  # 16-bit TT-cores are accumulated in float32, see utils.accumulation_dtype.
+  res = utils.upcast(tt.tt_cores[0])
   for i in range(1, num_dims):
     res = tf.reshape(res, (-1, ranks[i]))
-    curr_core = tf.reshape(tt.tt_cores[i], (ranks[i], -1))
+    curr_core = tf.reshape(utils.upcast(tt.tt_cores[i]), (ranks[i], -1))
     res = tf.matmul(res, curr_core)
+  res = tf.cast(res, tt.dtype)
   if tt.is_tt_matrix():
     intermediate_shape = []
     for i in range(num_dims):
@@ -80,12 +82,15 @@ def _full_tt_batch(tt):
   shape = shapes.lazy_shape(tt)
   raw_shape = shapes.lazy_raw_shape(tt)
 
-  res = tt.tt_cores[0]
+  # 16-bit TT-cores are accumulated in float32, see utils.accumulation_dtype.
+  res = utils.upcast(tt.tt_cores[0])
   batch_size = shapes.lazy_batch_size(tt)
   for i in range(1, num_dims):
     res = tf.reshape(res, (batch_size, -1, ranks[i]))
-    curr_core = tf.reshape(tt.tt_cores[i], (batch_size, ranks[i], -1))
+    curr_core = tf.reshape(utils.upcast(tt.tt_cores[i]),
+                           (batch_size, ranks[i], -1))
     res = tf.einsum('oqb,obw->oqw', res, curr_core)
+  res = tf.cast(res, tt.dtype)
   if tt.is_tt_matrix():
     intermediate_shape = [batch_size]
     for i in range(num_dims):
@@ -103,7 +108,129 @@ def _full_tt_batch(tt):
     return tf.reshape(res, shape)
 
 
-def tt_tt_matmul(tt_matrix_a, tt_matrix_b):
+def full_blocks(tt, block_shape, name='t3f_full_blocks'):
+  """Dense blocks of a TensorTrain as a tf.data.Dataset, for large TTs.
+
+  Splits the leading len(block_shape) modes of tt into blocks and yields the
+  dense slabs of full(tt) which correspond to these blocks one by one, so the
+  whole dense tensor is never stored in memory (useful e.g. to write a large
+  TT to disk). The contraction of the trailing TT-cores (the ones that are not
+  split) is computed once and reused for all the blocks.
+
+  For a TT-tensor of shape (n_1, ..., n_d) and block_shape (b_1, ..., b_k)
+  the slabs are
+    full(tt)[i_1:i_1 + b_1, ..., i_k:i_k + b_k]
+  of shape (b_1, ..., b_k, n_{k+1}, ..., n_d) (the last blocks along each
+  mode are smaller if b_j does not divide n_j).
+  For a TT-matrix of raw shape (n_1, ..., n_d) x (m_1, ..., m_d) the blocks
+  are taken along the row modes: a slab is the submatrix of full(tt)
+  consisting of (all the columns of) the rows whose first k row indices
+  (i_1, ..., i_k) are in the block, i.e. a matrix of size
+  b_1 ... b_k n_{k+1} ... n_d x M.
+
+  Example:
+    dataset = t3f.full_blocks(tt, (1, 10))
+    begin, slab = tf.data.make_initializable_iterator(dataset).get_next()
+
+  Args:
+    tt: `TensorTrain` object.
+    block_shape: a list of k <= d positive ints, the block sizes along the
+      leading k (row) modes.
+    name: string, name of the Op.
+
+  Returns:
+    tf.data.Dataset of tuples (begin, slab), where begin is an int64 vector of
+    length k with the (row) multi-index of the first element of the block
+    and slab is the dense tf.Tensor described above.
+
+  Raises:
+    ValueError if tt is not a `TensorTrain` or if block_shape is longer
+      than tt.ndims() or contains non-positive numbers.
+
+  Complexity:
+    O(d r^2 n^d) in total and O(r n^(d-k) (b^k + r)) memory, where
+      d is the number of TT-cores;
+      r is the largest TT-rank;
+      n is the size of the axis dimension (n m for TT-matrices);
+      b is the largest block size.
+  """
+  if not isinstance(tt, TensorTrain):
+    raise ValueError('full_blocks expects a TensorTrain, got %s. To convert a '
+                     'TensorTrainBatch, call full_blocks on each of its '
+                     'elements.' % tt)
+  ndims = tt.ndims()
+  block_shape = np.array(block_shape, dtype=np.int64)
+  num_split = len(block_shape)
+  if num_split > ndims:
+    raise ValueError('block_shape should have at most %d elements, got %d.' %
+                     (ndims, num_split))
+  if np.any(block_shape < 1):
+    raise ValueError('Block sizes should be positive, got %s.' % block_shape)
+  with tf.name_scope(name, values=tt.tt_cores):
+    ranks = shapes.lazy_tt_ranks(tt)
+    raw_shape = shapes.lazy_raw_shape(tt)
+    is_matrix = tt.is_tt_matrix()
+
+    # The right part of the contraction is the same for all the blocks, of size
+    # r_k x (n_{k+1} [m_{k+1}] ... n_d [m_d]).
+    # 16-bit TT-cores are accumulated in float32, see utils.accumulation_dtype.
+    dtype = utils.accumulation_dtype(tt.dtype)
+    right = tf.ones((1, 1), dtype=dtype)
+    for core_idx in range(ndims - 1, num_split - 1, -1):
+      curr_core = tf.reshape(utils.upcast(tt.tt_cores[core_idx]),
+                             (-1, ranks[core_idx + 1]))
+      right = tf.matmul(curr_core, right)
+      right = tf.reshape(right, (ranks[core_idx], -1))
+
+    mode_sizes = tf.cast(raw_shape[0][:num_split], tf.int64)
+    num_blocks_per_mode = (mode_sizes + block_shape - 1) // block_shape
+    num_blocks = tf.reduce_prod(num_blocks_per_mode)
+
+    def block(block_idx):
+      """Computes the dense slab number block_idx."""
+      block_multi_idx = utils.unravel_index(block_idx, num_blocks_per_mode)[0]
+      begin = block_multi_idx * block_shape
+      sizes = tf.minimum(block_shape, mode_sizes - begin)
+      left = tf.ones((1, 1), dtype=dtype)
+      for core_idx in range(num_split):
+        curr_core = utils.upcast(tt.tt_cores[core_idx])
+        slice_begin = [0] * len(curr_core.get_shape())
+        slice_begin[1] = begin[core_idx]
+        slice_size = [-1] * len(curr_core.get_shape())
+        slice_size[1] = sizes[core_idx]
+        curr_core = tf.slice(curr_core, slice_begin, slice_size)
+        curr_core = tf.reshape(curr_core, (ranks[core_idx], -1))
+        left = tf.reshape(left, (-1, ranks[core_idx]))
+        left = tf.matmul(left, curr_core)
+      left = tf.reshape(left, (-1, ranks[num_split]))
+      slab = tf.cast(tf.matmul(left, right), tt.dtype)
+      if is_matrix:
+        # Reshape into b_1 x m_1 x ... x b_k x m_k x n_{k+1} x m_{k+1} x ...
+        # and move all the row modes in front of the column modes.
+        intermediate_shape = []
+        for i in range(ndims):
+          if i < num_split:
+            intermediate_shape.append(sizes[i])
+          else:
+            intermediate_shape.append(raw_shape[0][i])
+          intermediate_shape.append(raw_shape[1][i])
+        intermediate_shape = [tf.cast(size, tf.int32)
+                              for size in intermediate_shape]
+        slab = tf.reshape(slab, intermediate_shape)
+        transpose = list(range(0, 2 * ndims, 2)) + list(range(1, 2 * ndims, 2))
+        slab = tf.transpose(slab, transpose)
+        slab = tf.reshape(slab, (-1, tf.reduce_prod(raw_shape[1])))
+      else:
+        slab_shape = tf.concat((tf.cast(sizes, tf.int32),
+                                tf.cast(raw_shape[0][num_split:], tf.int32)),
+                               axis=0)
+        slab = tf.reshape(slab, slab_shape)
+      return begin, slab
+
+    return tf.data.Dataset.range(num_blocks).map(block)
+
+
+def tt_tt_matmul(tt_matrix_a, tt_matrix_b, max_tt_rank=None, epsilon=None):
   """Multiplies two TT-matrices and returns the TT-matrix of the result.
 
   Args:
@@ -111,6 +238,12 @@ def tt_tt_matmul(tt_matrix_a, tt_matrix_b):
       a TT-matrix (a batch of TT-matrices) of size M x N
     tt_matrix_b: `TensorTrain` or `TensorTrainBatch` object containing
       a TT-matrix (a batch of TT-matrices) of size N x P
+    max_tt_rank: None, a number or a list of numbers, see t3f.round.
+      If not None, the product is rounded to this TT-rank on the fly (see
+      _tt_tt_matmul_rounded) and the result with TT-ranks equal to the
+      products of the TT-ranks of the arguments is never materialized.
+    epsilon: None or a floating point number, the desired relative accuracy
+      of the on the fly rounding, see t3f.round.
 
   Returns
     `TensorTrain` object containing a TT-matrix of size M x P if both arguments
@@ -140,6 +273,9 @@ def tt_tt_matmul(tt_matrix_a, tt_matrix_b):
   # Convert BatchSize 1 batch into TT object to simplify broadcasting.
   tt_matrix_a = shapes.squeeze_batch_dim(tt_matrix_a)
   tt_matrix_b = shapes.squeeze_batch_dim(tt_matrix_b)
+  if max_tt_rank is not None or epsilon is not None:
+    return _tt_tt_matmul_rounded(tt_matrix_a, tt_matrix_b, max_tt_rank,
+                                 epsilon)
   is_a_batch = isinstance(tt_matrix_a, TensorTrainBatch)
   is_b_batch = isinstance(tt_matrix_b, TensorTrainBatch)
   is_res_batch = is_a_batch or is_b_batch
@@ -159,9 +295,12 @@ def tt_tt_matmul(tt_matrix_a, tt_matrix_b):
     if is_b_batch:
       batch_size = shapes.lazy_batch_size(tt_matrix_b)
   for core_idx in range(ndims):
-    a_core = tt_matrix_a.tt_cores[core_idx]
-    b_core = tt_matrix_b.tt_cores[core_idx]
+    # 16-bit TT-cores are accumulated in float32, see
+    # utils.accumulation_dtype.
+    a_core = utils.upcast(tt_matrix_a.tt_cores[core_idx])
+    b_core = utils.upcast(tt_matrix_b.tt_cores[core_idx])
     curr_res_core = tf.einsum(einsum_str, a_core, b_core)
+    curr_res_core = tf.cast(curr_res_core, tt_matrix_a.dtype)
 
     res_left_rank = a_ranks[core_idx] * b_ranks[core_idx]
     res_right_rank = a_ranks[core_idx + 1] * b_ranks[core_idx + 1]
@@ -185,6 +324,160 @@ def tt_tt_matmul(tt_matrix_a, tt_matrix_b):
     return TensorTrain(result_cores, res_shape, out_ranks)
 
 
+def _zip_up_product(tt_a, tt_b, contract, mode_shapes, max_tt_rank, epsilon):
+  """Computes a product of two TT-objects and rounds it in one sweep ("zip-up").
+
+  The TT-cores of the product (e.g. of the matrix or the element-wise product)
+  are contractions of the TT-cores of the arguments of the TT-rank r_a * r_b.
+  Instead of assembling them, orthogonalizes both arguments from left to right
+  and then goes from right to left: contracts the current TT-cores of the
+  arguments with the already compressed right part of the product and
+  truncates the SVD of the result. This way the peak memory is
+  (r_a * r_b) x n x R, where R is the TT-rank of the result.
+
+  The truncation is quasi-optimal: the error may be slightly larger than the
+  one of t3f.round of the assembled product, since the left part of the
+  product is not orthogonal.
+
+  Args:
+    tt_a: `TensorTrain` or `TensorTrainBatch`, the first argument.
+    tt_b: `TensorTrain` or `TensorTrainBatch`, the second argument.
+    contract: function (a_core, b_core, right_part, prefixes) -> tf.Tensor
+      that contracts the TT-cores of the arguments with the right part of the
+      size [batch_size x] r_a x r_b x R and returns the tensor of the size
+      [batch_size x] r_a x r_b x (the mode sizes of the TT-core of the
+      product) x R. prefixes is a tuple of the einsum batch prefixes ('o' or
+      '') of a_core, b_core, right_part and of the result.
+    mode_shapes: a list of d tuples, the mode sizes of the TT-cores of the
+      product.
+    max_tt_rank: None, a number or a list of numbers, see t3f.round.
+    epsilon: None or a floating point number, see t3f.round.
+
+  Returns:
+    result_cores: the list of the TT-cores of the product.
+    ranks: the list of the TT-ranks of the product or None if they are not
+      known on the graph construction stage.
+    batch_size: the batch size of the product or None if both arguments are
+      `TensorTrain`s.
+
+  Raises:
+    ValueError if max_tt_rank is less than 1 or is not a number and not
+      a vector of length d + 1, if epsilon is less than 0.
+  """
+  ndims = tt_a.ndims()
+  max_tt_rank = decompositions._normalize_max_tt_rank(max_tt_rank, ndims)
+  if max_tt_rank is None:
+    max_tt_rank = [None] * (ndims + 1)
+  if epsilon is not None and epsilon < 0:
+    raise ValueError('Epsilon should be non-negative.')
+  tt_a = decompositions.orthogonalize_tt_cores(tt_a)
+  tt_b = decompositions.orthogonalize_tt_cores(tt_b)
+  is_a_batch = isinstance(tt_a, TensorTrainBatch)
+  is_b_batch = isinstance(tt_b, TensorTrainBatch)
+  is_res_batch = is_a_batch or is_b_batch
+  a_batch_str = 'o' if is_a_batch else ''
+  b_batch_str = 'o' if is_b_batch else ''
+  res_batch_str = 'o' if is_res_batch else ''
+  a_ranks = shapes.lazy_tt_ranks(tt_a)
+  b_ranks = shapes.lazy_tt_ranks(tt_b)
+  batch_size = None
+  if is_res_batch:
+    if is_a_batch:
+      batch_size = shapes.lazy_batch_size(tt_a)
+    else:
+      batch_size = shapes.lazy_batch_size(tt_b)
+    batch_shape = (batch_size,)
+  else:
+    batch_shape = ()
+
+  result_cores = [None] * ndims
+  ranks = [1] * (ndims + 1)
+  are_tt_ranks_defined = True
+  # The right part of the product contracted with the already computed
+  # TT-cores of the result, of size r_a x r_b x R.
+  # 16-bit TT-cores are accumulated (and the SVDs are computed) in float32,
+  # see utils.accumulation_dtype.
+  right_part = tf.ones((1, 1, 1), dtype=utils.accumulation_dtype(tt_a.dtype))
+  right_batch_str = ''
+  for core_idx in range(ndims - 1, -1, -1):
+    prefixes = (a_batch_str, b_batch_str, right_batch_str, res_batch_str)
+    curr_core = contract(utils.upcast(tt_a.tt_cores[core_idx]),
+                         utils.upcast(tt_b.tt_cores[core_idx]), right_part,
+                         prefixes)
+    mode_shape = tuple(mode_shapes[core_idx])
+    if core_idx == 0:
+      core_shape = batch_shape + (1,) + mode_shape + (ranks[1],)
+      result_cores[0] = tf.reshape(curr_core, core_shape)
+      break
+    left_rank = a_ranks[core_idx] * b_ranks[core_idx]
+    curr_core = tf.reshape(curr_core, batch_shape + (left_rank, -1))
+    s, u, v = tf.svd(curr_core, full_matrices=False)
+    delta = None
+    if epsilon is not None:
+      # Distribute the allowed error equally between the d - 1 truncations.
+      delta = epsilon / np.sqrt(ndims - 1) * tf.norm(s, axis=-1)
+    rank = decompositions._truncation_rank(s, max_tt_rank[core_idx], delta)
+    if isinstance(rank, tf.Tensor):
+      are_tt_ranks_defined = False
+    ranks[core_idx] = rank
+    u = u[..., :rank]
+    s = s[..., :rank]
+    v = v[..., :rank]
+    core_shape = batch_shape + (rank,) + mode_shape + (ranks[core_idx + 1],)
+    result_cores[core_idx] = tf.reshape(tf.matrix_transpose(v), core_shape)
+    right_part = u * tf.expand_dims(s, -2)
+    right_shape = batch_shape + (a_ranks[core_idx], b_ranks[core_idx], rank)
+    right_part = tf.reshape(right_part, right_shape)
+    right_batch_str = res_batch_str
+
+  if not are_tt_ranks_defined:
+    ranks = None
+  result_cores = [tf.cast(core, tt_a.dtype) for core in result_cores]
+  return result_cores, ranks, batch_size
+
+
+def _tt_tt_matmul_rounded(tt_matrix_a, tt_matrix_b, max_tt_rank, epsilon):
+  """Multiplies two TT-matrices and rounds the result in one sweep ("zip-up").
+
+  See _zip_up_product. The TT-cores of the product of the size
+  (r_a * r_b) x n x m x (r_a * r_b) are never materialized, the peak memory
+  is (r_a * r_b) x n x m x R, where R is the TT-rank of the result.
+
+  Args:
+    tt_matrix_a: `TensorTrain` or `TensorTrainBatch` object containing
+      a TT-matrix (a batch of TT-matrices) of size M x N
+    tt_matrix_b: `TensorTrain` or `TensorTrainBatch` object containing
+      a TT-matrix (a batch of TT-matrices) of size N x P
+    max_tt_rank: None, a number or a list of numbers, see t3f.round.
+    epsilon: None or a floating point number, see t3f.round.
+
+  Returns
+    `TensorTrain` object containing a TT-matrix of size M x P if both arguments
+      are `TensorTrain`s
+    `TensorTrainBatch` if any of the arguments is a `TensorTrainBatch`
+
+  Raises:
+    ValueError if max_tt_rank is less than 1 or is not a number and not
+      a vector of length d + 1, if epsilon is less than 0.
+  """
+  a_shape = shapes.lazy_raw_shape(tt_matrix_a)
+  b_shape = shapes.lazy_raw_shape(tt_matrix_b)
+  mode_shapes = [(a_shape[0][i], b_shape[1][i])
+                 for i in range(tt_matrix_a.ndims())]
+
+  def contract(a_core, b_core, right_part, prefixes):
+    einsum_str = '{}aijb,{}cjkd,{}bde->{}acike'.format(*prefixes)
+    return tf.einsum(einsum_str, a_core, b_core, right_part)
+
+  result_cores, ranks, batch_size = _zip_up_product(
+      tt_matrix_a, tt_matrix_b, contract, mode_shapes, max_tt_rank, epsilon)
+  res_shape = (tt_matrix_a.get_raw_shape()[0], tt_matrix_b.get_raw_shape()[1])
+  if batch_size is not None:
+    return TensorTrainBatch(result_cores, res_shape, ranks, batch_size)
+  else:
+    return TensorTrain(result_cores, res_shape, ranks)
+
+
 def tt_dense_matmul(tt_matrix_a, matrix_b):
   """Multiplies a TT-matrix by a regular matrix, returns a regular matrix.
 
@@ -215,10 +508,11 @@ def tt_dense_matmul(tt_matrix_a, matrix_b):
   a_ranks = shapes.lazy_tt_ranks(tt_matrix_a)
   # If A is (i0, ..., id-1) x (j0, ..., jd-1) and B is (j0, ..., jd-1) x K,
   # data is (K, j0, ..., jd-2) x jd-1 x 1
-  data = tf.transpose(matrix_b)
+  # 16-bit TT-cores are accumulated in float32, see utils.accumulation_dtype.
+  data = utils.upcast(tf.transpose(matrix_b))
   data = tf.reshape(data, (-1, a_raw_shape[1][-1], 1))
   for core_idx in reversed(range(ndims)):
-    curr_core = tt_matrix_a.tt_cores[core_idx]
+    curr_core = utils.upcast(tt_matrix_a.tt_cores[core_idx])
     # On the k = core_idx iteration, after applying einsum the shape of data
     # becomes ik x (ik-1..., id-1, K, j0, ..., jk-1) x rank_k
     data = tf.einsum('aijb,rjb->ira', curr_core, data)
@@ -228,7 +522,7 @@ def tt_dense_matmul(tt_matrix_a, matrix_b):
       new_data_shape = (-1, a_raw_shape[1][core_idx - 1], a_ranks[core_idx])
       data = tf.reshape(data, new_data_shape)
   # At the end the shape of the data is (i0, ..., id-1) x K
-  return tf.reshape(data, (a_shape[0], b_shape[1]))
+  return tf.cast(tf.reshape(data, (a_shape[0], b_shape[1])), tt_matrix_a.dtype)
 
 
 def dense_tt_matmul(matrix_a, tt_matrix_b):
@@ -241,10 +535,117 @@ def dense_tt_matmul(matrix_a, tt_matrix_b):
   Returns
     tf.Tensor of size M x P
   """
-#   TODO: make a more efficient implementation.
-  a_t = tf.transpose(matrix_a)
-  b_t = transpose(tt_matrix_b)
-  return tf.transpose(tt_dense_matmul(b_t, a_t))
+  if not isinstance(tt_matrix_b, TensorTrain) or not tt_matrix_b.is_tt_matrix():
+    raise ValueError('The second argument should be a TT-matrix')
+
+  ndims = tt_matrix_b.ndims()
+  a_columns = matrix_a.get_shape()[1].value
+  b_rows = tt_matrix_b.get_shape()[0].value
+  if a_columns is not None and b_rows is not None:
+    if a_columns != b_rows:
+      raise ValueError('Arguments shapes should align got %s and %s instead.' %
+                       (matrix_a.get_shape(), tt_matrix_b.get_shape()))
+
+  b_shape = shapes.lazy_shape(tt_matrix_b)
+  b_raw_shape = shapes.lazy_raw_shape(tt_matrix_b)
+  if matrix_a.get_shape().is_fully_defined():
+    a_shape = matrix_a.get_shape().as_list()
+  else:
+    a_shape = tf.shape(matrix_a)
+  b_ranks = shapes.lazy_tt_ranks(tt_matrix_b)
+  prod = np.prod if isinstance(b_raw_shape, np.ndarray) else tf.reduce_prod
+  # If A is K x (j0, ..., jd-1) and B is (j0, ..., jd-1) x (i0, ..., id-1),
+  # data is (K, j0, ..., jd-1) x 1, i.e. A is used in its own layout.
+  # 16-bit TT-cores are accumulated in float32, see utils.accumulation_dtype.
+  data = utils.upcast(matrix_a)
+  for core_idx in reversed(range(ndims)):
+    curr_core = utils.upcast(tt_matrix_b.tt_cores[core_idx])
+    # The core is rank_k x jk x ik x rank_k+1, make it
+    # (jk, rank_k+1) x (rank_k, ik).
+    curr_core = tf.transpose(curr_core, (1, 3, 0, 2))
+    curr_core = tf.reshape(curr_core, (-1, b_ranks[core_idx] *
+                                       b_raw_shape[1][core_idx]))
+    # Before the matmul the data is
+    # ((ik+1, ..., id-1), K, j0, ..., jk-1) x (jk, rank_k+1)
+    data = tf.reshape(data, (-1, b_raw_shape[0][core_idx] *
+                             b_ranks[core_idx + 1]))
+    data = tf.matmul(data, curr_core)
+    # Move ik to the front, the data becomes
+    # (ik, ..., id-1) x (K, j0, ..., jk-1) x rank_k
+    # This transpose moves all the data on each step. Keeping K in front
+    # instead (so that the result is already K x (i0, ..., id-1)) needs either
+    # an einsum, which does the same transposes internally, or batched
+    # matmuls over the small (jk, rank_k+1) blocks, and both were slower.
+    data = tf.reshape(data, (prod(b_raw_shape[1][core_idx + 1:]), -1,
+                             b_ranks[core_idx], b_raw_shape[1][core_idx]))
+    data = tf.transpose(data, (3, 0, 1, 2))
+  # At the end the shape of the data is (i0, ..., id-1) x K
+  data = tf.reshape(data, (b_shape[1], a_shape[0]))
+  return tf.cast(tf.transpose(data), tt_matrix_b.dtype)
+
+
+def _sparse_tt_matmul_rows(tt_matrix, sum_axis, sum_idx, out_idx, values,
+                           num_out):
+  """Internal function that contracts a TT-matrix with a sparse matrix.
+
+  Computes the dense matrix
+    res[out_idx[e], :] += values[e] * tt_matrix[sum_idx[e], :]  (sum_axis == 0)
+    res[out_idx[e], :] += values[e] * tt_matrix[:, sum_idx[e]]  (sum_axis == 1)
+  for all the nonzero elements e of the sparse matrix. The TT-cores are
+  processed from right to left: on the k-th step the slices of the k-th TT-core
+  corresponding to the k-th mode of sum_idx are gathered and contracted with
+  the partial results, which are then merged for the elements that share the
+  output index and the remaining (leading) modes of sum_idx. So the shared
+  prefixes of the indices are processed only once and the dense version of the
+  sparse matrix is never formed.
+
+  Args:
+    tt_matrix: `TensorTrain` object containing a TT-matrix.
+    sum_axis: 0 or 1, the axis of tt_matrix to contract with the sparse matrix.
+    sum_idx: int64 tf.Tensor of size nnz, the (linear) indices along sum_axis.
+    out_idx: int64 tf.Tensor of size nnz, the row indices of the result.
+    values: tf.Tensor of size nnz, the nonzero values of the sparse matrix.
+    num_out: a number or 0-D tf.Tensor, the number of rows of the result.
+
+  Returns:
+    tf.Tensor of size num_out x tt_matrix.get_shape()[1 - sum_axis]
+  """
+  ndims = tt_matrix.ndims()
+  raw_shape = shapes.lazy_raw_shape(tt_matrix)
+  tt_ranks = shapes.lazy_tt_ranks(tt_matrix)
+  free_size = shapes.lazy_shape(tt_matrix)[1 - sum_axis]
+  sum_shape = tf.cast(raw_shape[sum_axis], tf.int64)
+  sum_size = tf.reduce_prod(sum_shape)
+  # The key of an element encodes the output index and the not yet processed
+  # modes of sum_idx.
+  keys = out_idx * sum_size + sum_idx
+  # Partial results are of size
+  #   num_unique_keys x (the size of the processed free modes) x TT-rank.
+  # 16-bit TT-cores are accumulated in float32, see utils.accumulation_dtype.
+  dtype = utils.accumulation_dtype(tt_matrix.dtype)
+  partial = tf.reshape(tf.cast(values, dtype), (-1, 1, 1))
+  # Bring the summation mode of the TT-cores to the front for tf.gather.
+  if sum_axis == 0:
+    transpose_order = (1, 0, 2, 3)
+  else:
+    transpose_order = (2, 0, 1, 3)
+  for core_idx in range(ndims - 1, -1, -1):
+    keys, segment_idx = tf.unique(keys)
+    partial = tf.unsorted_segment_sum(partial, segment_idx, tf.size(keys))
+    curr_mode_idx = keys % sum_shape[core_idx]
+    keys = keys // sum_shape[core_idx]
+    curr_core = tf.transpose(tt_matrix.tt_cores[core_idx], transpose_order)
+    core_slices = utils.upcast(tf.gather(curr_core, curr_mode_idx))
+    partial = tf.einsum('eaib,erb->eira', core_slices, partial)
+    partial = tf.reshape(partial, (tf.size(keys), -1, tt_ranks[core_idx]))
+  # Now the keys are just the output indices.
+  keys, segment_idx = tf.unique(keys)
+  partial = tf.unsorted_segment_sum(partial, segment_idx, tf.size(keys))
+  partial = tf.reshape(partial, (-1, free_size))
+  res_shape = tf.stack((tf.cast(num_out, tf.int64),
+                       tf.cast(free_size, tf.int64)))
+  res = tf.scatter_nd(tf.expand_dims(keys, 1), partial, res_shape)
+  return tf.cast(res, tt_matrix.dtype)
 
 
 def sparse_tt_matmul(sparse_matrix_a, tt_matrix_b):
@@ -256,8 +657,29 @@ def sparse_tt_matmul(sparse_matrix_a, tt_matrix_b):
 
   Returns
     tf.Tensor of size M x P
+
+  Complexity:
+    O(nnz r^2 P + M P)
+    where
+      nnz is the number of nonzero elements of sparse_matrix_a;
+      r is the largest TT-rank of tt_matrix_b.
+    The TT-cores are processed from right to left and the partial result of
+    each element grows with the column modes processed so far, so the step of
+    the k-th TT-core costs O(nnz_k r^2 n_k ... n_d), where n_k ... n_d are
+    the sizes of these modes and nnz_k <= nnz is the number of distinct pairs
+    of the row index and the leading k modes of the column index (the
+    work for the elements sharing them is shared). The first TT-core
+    dominates.
   """
-  raise NotImplementedError
+  if not isinstance(tt_matrix_b, TensorTrain) or not tt_matrix_b.is_tt_matrix():
+    raise ValueError('The second argument should be a TT-matrix')
+  num_rows = sparse_matrix_a.get_shape()[0].value
+  if num_rows is None:
+    num_rows = sparse_matrix_a.dense_shape[0]
+  row_idx = tf.cast(sparse_matrix_a.indices[:, 0], tf.int64)
+  col_idx = tf.cast(sparse_matrix_a.indices[:, 1], tf.int64)
+  return _sparse_tt_matmul_rows(tt_matrix_b, 0, col_idx, row_idx,
+                                sparse_matrix_a.values, num_rows)
 
 
 # TODO: add flag `return_type = (TT | dense)`?
@@ -270,15 +692,37 @@ def tt_sparse_matmul(tt_matrix_a, sparse_matrix_b):
 
   Returns
     tf.Tensor of size M x P
+
+  Complexity:
+    O(nnz r^2 M + M P)
+    where
+      nnz is the number of nonzero elements of sparse_matrix_b;
+      r is the largest TT-rank of tt_matrix_a.
+    The TT-cores are processed from right to left and the partial result of
+    each element grows with the row modes processed so far, so the step of
+    the k-th TT-core costs O(nnz_k r^2 n_k ... n_d), where n_k ... n_d are
+    the sizes of these modes and nnz_k <= nnz is the number of distinct pairs
+    of the column index and the leading k modes of the row index (the
+    work for the elements sharing them is shared). The first TT-core
+    dominates.
   """
-  raise NotImplementedError
+  if not isinstance(tt_matrix_a, TensorTrain) or not tt_matrix_a.is_tt_matrix():
+    raise ValueError('The first argument should be a TT-matrix')
+  num_columns = sparse_matrix_b.get_shape()[1].value
+  if num_columns is None:
+    num_columns = sparse_matrix_b.dense_shape[1]
+  row_idx = tf.cast(sparse_matrix_b.indices[:, 0], tf.int64)
+  col_idx = tf.cast(sparse_matrix_b.indices[:, 1], tf.int64)
+  res_t = _sparse_tt_matmul_rows(tt_matrix_a, 1, row_idx, col_idx,
+                                 sparse_matrix_b.values, num_columns)
+  return tf.transpose(res_t)
 
 
-def matmul(a, b, name='t3f_matmul'):
+def matmul(a, b, max_tt_rank=None, epsilon=None, name='t3f_matmul'):
   """Multiplies two matrices that can be TT-, dense, or sparse.
 
   Note that multiplication of two TT-matrices returns a TT-matrix with much
-  larger ranks.
+  larger ranks, unless max_tt_rank or epsilon is provided.
   Also works for multiplying two batches of TT-matrices or a product between a
   TT-matrix and a batch of TT-matrices (with broadcasting).
 
@@ -287,6 +731,14 @@ def matmul(a, b, name='t3f_matmul'):
       size M x N
     b: `TensorTrain`, `TensorTrainBatch`, tf.Tensor, or tf.SparseTensor of
       size N x P
+    max_tt_rank: None, a number or a list of numbers, only for the product of
+      two TT-matrices. If provided, the product is rounded to this TT-rank
+      in the same sweep that computes it, which is faster and uses less
+      memory than t3f.round(t3f.matmul(a, b), max_tt_rank).
+      See t3f.round for the format.
+    epsilon: None or a floating point number, only for the product of
+      two TT-matrices. If provided, the product is rounded to this relative
+      accuracy in the same sweep that computes it, see t3f.round.
     name: string, name of the Op.
 
   Returns
@@ -296,11 +748,27 @@ def matmul(a, b, name='t3f_matmul'):
       a `TensorTrainBatch` object containing a batch of TT-matrices of size
       M x P.
     Otherwise, returns tf.Tensor of size M x P.
+
+  Raises:
+    ValueError if max_tt_rank or epsilon is provided and not both arguments
+      are TT-matrices.
+
+  Complexity:
+    For two TT-matrices with max_tt_rank (or epsilon) provided
+      O(d r_a^2 r_b^2 n^3 R + d n^3 r_a r_b R^2 min(r_a r_b, n^2 R))
+    where
+      d is the number of TT-cores;
+      r_a and r_b are the largest TT-ranks of a and b;
+      R is the largest TT-rank of the result;
+      n is the largest mode size of a and b.
   """
 #   TODO: is it safe to check types? What if a class is derived from TT?
   if isinstance(a, TensorTrainBase) and isinstance(b, TensorTrainBase):
     with tf.name_scope(name, values=a.tt_cores+b.tt_cores):
-      return tt_tt_matmul(a, b)
+      return tt_tt_matmul(a, b, max_tt_rank, epsilon)
+  if max_tt_rank is not None or epsilon is not None:
+    raise ValueError('max_tt_rank and epsilon are only supported for the '
+                     'product of two TT-matrices.')
   elif isinstance(a, TensorTrain) and isinstance(b, tf.Tensor):
     with tf.name_scope(name, values=a.tt_cores+(b,)):
       return tt_dense_matmul(a, b)
@@ -368,6 +836,7 @@ def tt_tt_flat_inner(tt_a, tt_b):
                      'got %d and %d instead.' % (ndims, tt_b.ndims()))
 
   axes_str = 'ij' if are_both_matrices else 'i'
+  dtype = tt_a.dtype
   # Convert BatchSize 1 batch into TT object to simplify broadcasting.
   tt_a = shapes.squeeze_batch_dim(tt_a)
   tt_b = shapes.squeeze_batch_dim(tt_b)
@@ -380,8 +849,9 @@ def tt_tt_flat_inner(tt_a, tt_b):
   init_einsum_str = '{1}a{0}b,{2}c{0}d->{3}bd'.format(axes_str, a_batch_str,
                                                       b_batch_str,
                                                       res_batch_str)
-  a_core = tt_a.tt_cores[0]
-  b_core = tt_b.tt_cores[0]
+  # 16-bit TT-cores are accumulated in float32, see utils.accumulation_dtype.
+  a_core = utils.upcast(tt_a.tt_cores[0])
+  b_core = utils.upcast(tt_b.tt_cores[0])
   # Simplest example of this operation:
   # if both arguments are TT-tensors, then it is
   # res = tf.einsum('aib,cid->bd', a_core, b_core)
@@ -391,29 +861,102 @@ def tt_tt_flat_inner(tt_a, tt_b):
                                                        b_batch_str,
                                                        res_batch_str)
   for core_idx in range(1, ndims):
-    a_core = tt_a.tt_cores[core_idx]
-    b_core = tt_b.tt_cores[core_idx]
+    a_core = utils.upcast(tt_a.tt_cores[core_idx])
+    b_core = utils.upcast(tt_b.tt_cores[core_idx])
     # Simplest example of this operation:
     # if both arguments are TT-tensors, then it is
     # res = tf.einsum('ac,aib,cid->bd', res, a_core, b_core)
-    res = tf.einsum(einsum_str, res, a_core, b_core)
-  return tf.squeeze(res)
+    res = utils.einsum(einsum_str, res, a_core, b_core)
+  return tf.cast(tf.squeeze(res), dtype)
 
 
 def tt_dense_flat_inner(tt_a, dense_b):
   """Inner product between a TT-tensor (or TT-matrix) and tf.Tensor along all axis.
 
   The shapes of tt_a and dense_b should coincide.
+  Contracts dense_b with the TT-cores of tt_a one by one from left to right,
+  so the full version of tt_a is never materialized.
 
   Args:
-    tt_a: `TensorTrain` object
-    dense_b: tf.Tensor
+    tt_a: `TensorTrain` or `TensorTrainBatch` object
+    dense_b: tf.Tensor of the same shape as tt_a (or as one element of the
+      batch tt_a), i.e. a matrix if tt_a is a TT-matrix.
 
   Returns
-    a number
+    a number or a Tensor with numbers for each element in the batch.
     sum of products of all the elements of tt_a and dense_b
+
+  Raises:
+    ValueError if the shapes of the arguments do not coincide.
+
+  Complexity:
+    O(N r)
+    where
+      N is the number of elements of dense_b;
+      r is the largest TT-rank of tt_a.
+    The largest intermediate result is of size N r_1 / n_1 (times batch_size
+    for a `TensorTrainBatch`), where r_1 is the first TT-rank and n_1 is the
+    size of the first mode of tt_a.
   """
-  raise NotImplementedError
+  if not isinstance(tt_a, TensorTrainBase):
+    raise ValueError('The first argument should be a TensorTrain')
+  dense_b = tf.convert_to_tensor(dense_b, dtype=tt_a.dtype)
+  is_batch = isinstance(tt_a, TensorTrainBatch)
+  tt_shape = tt_a.get_shape()
+  if is_batch:
+    tt_shape = tt_shape[1:]
+  if not tt_shape.is_compatible_with(dense_b.get_shape()):
+    raise ValueError('The arguments should have the same shape, got %s and %s '
+                     'instead.' % (tt_shape, dense_b.get_shape()))
+
+  ndims = tt_a.ndims()
+  raw_shape = shapes.lazy_raw_shape(tt_a)
+  ranks = shapes.lazy_tt_ranks(tt_a)
+  prod = np.prod if isinstance(raw_shape, np.ndarray) else tf.reduce_prod
+  if is_batch:
+    batch_size = shapes.lazy_batch_size(tt_a)
+    batch_shape = (batch_size,)
+  else:
+    batch_shape = ()
+  # 16-bit TT-cores are accumulated in float32, see utils.accumulation_dtype.
+  dense_b = utils.upcast(dense_b)
+  if tt_a.is_tt_matrix():
+    batch_str = 'o' if is_batch else ''
+    # On the k = core_idx iteration the data is of size
+    #   r_k x i_k x (i_k+1 ... i_d-1) x j_k x (j_k+1 ... j_d-1)
+    data = tf.reshape(dense_b, (1, raw_shape[0][0], -1, raw_shape[1][0],
+                                prod(raw_shape[1][1:])))
+    for core_idx in range(ndims):
+      curr_core = utils.upcast(tt_a.tt_cores[core_idx])
+      data_batch_str = batch_str if core_idx > 0 else ''
+      einsum_str = '{0}aijb,{1}aixjy->{0}bxy'.format(batch_str,
+                                                     data_batch_str)
+      data = tf.einsum(einsum_str, curr_core, data)
+      if core_idx < ndims - 1:
+        new_data_shape = batch_shape + (ranks[core_idx + 1],
+                                        raw_shape[0][core_idx + 1], -1,
+                                        raw_shape[1][core_idx + 1],
+                                        prod(raw_shape[1][core_idx + 2:]))
+        data = tf.reshape(data, new_data_shape)
+  else:
+    # On the k = core_idx iteration the data is of size
+    #   (r_k i_k) x (i_k+1 ... i_d-1)
+    data = tf.reshape(dense_b, (raw_shape[0][0], -1))
+    first_core = utils.upcast(tt_a.tt_cores[0])
+    if is_batch:
+      # Merge the batch dimension into the rank to use one matmul.
+      first_core = tf.transpose(first_core, (2, 0, 1, 3))
+      first_core = tf.reshape(first_core, (raw_shape[0][0], -1))
+    else:
+      first_core = tf.reshape(first_core, (raw_shape[0][0], ranks[1]))
+    data = tf.matmul(first_core, data, transpose_a=True)
+    for core_idx in range(1, ndims):
+      data_shape = batch_shape + (ranks[core_idx] * raw_shape[0][core_idx], -1)
+      data = tf.reshape(data, data_shape)
+      curr_core = tf.reshape(utils.upcast(tt_a.tt_cores[core_idx]),
+                             batch_shape + (-1, ranks[core_idx + 1]))
+      data = tf.matmul(curr_core, data, transpose_a=True)
+  return tf.cast(tf.reshape(data, batch_shape), tt_a.dtype)
 
 
 def tt_sparse_flat_inner(tt_a, sparse_b):
@@ -435,8 +978,10 @@ def tt_sparse_flat_inner(tt_a, sparse_b):
     num_elements = tf.shape(sparse_b.indices)[0]
   a_shape = shapes.lazy_raw_shape(tt_a)
   a_ranks = shapes.lazy_tt_ranks(tt_a)
+  # 16-bit TT-cores are accumulated in float32, see utils.accumulation_dtype.
+  dtype = utils.accumulation_dtype(tt_a.dtype)
   if tt_a.is_tt_matrix():
-    tt_a_elements = tf.ones((num_elements, 1, 1), dtype=tt_a.dtype)
+    tt_a_elements = tf.ones((num_elements, 1, 1), dtype=dtype)
     # TODO: use t3f.shape is safer??
     tensor_shape = tt_a.get_raw_shape()
     row_idx_linear = tf.cast(sparse_b.indices[:, 0], tf.int64)
@@ -457,16 +1002,16 @@ def tt_sparse_flat_inner(tt_a, sparse_b):
       # TODO: use gather_nd instead.
       curr_elements_idx = row_idx[:, core_idx] * tensor_shape[1][core_idx]
       curr_elements_idx += col_idx[:, core_idx]
-      core_slices = tf.gather(curr_core, curr_elements_idx)
+      core_slices = utils.upcast(tf.gather(curr_core, curr_elements_idx))
       tt_a_elements = tf.matmul(tt_a_elements, core_slices)
   else:
-    tt_a_elements = gather_nd(tt_a, sparse_b.indices)
+    tt_a_elements = tf.cast(gather_nd(tt_a, sparse_b.indices), dtype)
   tt_a_elements = tf.reshape(tt_a_elements, (1, -1))
-  sparse_b_elements = tf.reshape(sparse_b.values, (-1, 1))
+  sparse_b_elements = tf.reshape(tf.cast(sparse_b.values, dtype), (-1, 1))
   result = tf.matmul(tt_a_elements, sparse_b_elements)
   # Convert a 1x1 matrix into a number.
   result = result[0, 0]
-  return result
+  return tf.cast(result, tt_a.dtype)
 
 
 def dense_tt_flat_inner(dense_a, tt_b):
@@ -476,13 +1021,19 @@ def dense_tt_flat_inner(dense_a, tt_b):
 
   Args:
     dense_a: tf.Tensor
-    tt_b: `TensorTrain` object
+    tt_b: `TensorTrain` or `TensorTrainBatch` object
 
   Returns
-    a number
+    a number or a Tensor with numbers for each element in the batch.
     sum of products of all the elements of dense_a and tt_b
+
+  Raises:
+    ValueError if the shapes of the arguments do not coincide.
+
+  Complexity:
+    O(N r), see tt_dense_flat_inner.
   """
-  raise NotImplementedError
+  return tt_dense_flat_inner(tt_b, dense_a)
 
 
 def sparse_tt_flat_inner(sparse_a, tt_b):
@@ -522,10 +1073,10 @@ def flat_inner(a, b, name='t3f_flat_inner'):
   if isinstance(a, TensorTrainBase) and isinstance(b, TensorTrainBase):
     with tf.name_scope(name, values=a.tt_cores+b.tt_cores):
       return tt_tt_flat_inner(a, b)
-  elif isinstance(a, TensorTrain) and isinstance(b, tf.Tensor):
+  elif isinstance(a, TensorTrainBase) and isinstance(b, tf.Tensor):
     with tf.name_scope(name, values=a.tt_cores+(b,)):
       return tt_dense_flat_inner(a, b)
-  elif isinstance(a, tf.Tensor) and isinstance(b, TensorTrain):
+  elif isinstance(a, tf.Tensor) and isinstance(b, TensorTrainBase):
     with tf.name_scope(name, values=(a,)+b.tt_cores):
       return dense_tt_flat_inner(a, b)
   elif isinstance(a, TensorTrain) and isinstance(b, tf.SparseTensor):
@@ -683,7 +1234,106 @@ def _add_batch_matrix_cores(tt_a, tt_b):
   return tt_cores, batch_size
 
 
-def add(tt_a, tt_b, name='t3f_add'):
+def _add_and_round(tt_a, tt_b, max_tt_rank, epsilon):
+  """Internal function to be called from add to add two TTs with rounding.
+
+  Orthogonalizes the TT-cores of the sum from left to right without
+  assembling them: the TT-cores of the sum are block-diagonal, so
+    [R_a, R_b] [[A_k, 0], [0, B_k]] = [R_a A_k, R_b B_k]
+  where [R_a, R_b] is the triangular factor carried from the previous QR.
+  Then truncates the result as in t3f.round.
+  """
+  ndims = tt_a.ndims()
+  max_tt_rank = decompositions._normalize_max_tt_rank(max_tt_rank, ndims)
+  if epsilon is not None and epsilon < 0:
+    raise ValueError('Epsilon should be non-negative.')
+  is_batch_case = (isinstance(tt_a, TensorTrainBatch) or
+                   isinstance(tt_b, TensorTrainBatch))
+  # Convert BatchSize 1 batch into TT object to simplify broadcasting.
+  tt_a = shapes.squeeze_batch_dim(tt_a)
+  tt_b = shapes.squeeze_batch_dim(tt_b)
+  is_a_batch = isinstance(tt_a, TensorTrainBatch)
+  is_b_batch = isinstance(tt_b, TensorTrainBatch)
+  is_res_batch = is_a_batch or is_b_batch
+  a_batch_str = 'o' if is_a_batch else ''
+  b_batch_str = 'o' if is_b_batch else ''
+  res_batch_str = 'o' if is_res_batch else ''
+  a_einsum_str = '{0}sa,{1}aib->{0}sib'.format(res_batch_str, a_batch_str)
+  b_einsum_str = '{0}sa,{1}aib->{0}sib'.format(res_batch_str, b_batch_str)
+  raw_shape = shapes.lazy_raw_shape(tt_a)
+  a_ranks = shapes.lazy_tt_ranks(tt_a)
+  b_ranks = shapes.lazy_tt_ranks(tt_b)
+  batch_size = None
+  if is_res_batch:
+    if is_a_batch:
+      batch_size = shapes.lazy_batch_size(tt_a)
+    else:
+      batch_size = shapes.lazy_batch_size(tt_b)
+    res_batch_shape = (batch_size,)
+  else:
+    res_batch_shape = ()
+  a_batch_shape = res_batch_shape if is_a_batch else ()
+  b_batch_shape = res_batch_shape if is_b_batch else ()
+
+  tt_cores = []
+  ranks = [1] * (ndims + 1)
+  are_tt_ranks_defined = True
+  # The triangular factor from the previous QR, split into the parts that
+  # multiply the TT-cores of tt_a and tt_b.
+  # 16-bit TT-cores are accumulated (and the QRs and SVDs are computed) in
+  # float32, see utils.accumulation_dtype.
+  dtype = utils.accumulation_dtype(tt_a.dtype)
+  r_a = tf.ones(res_batch_shape + (1, 1), dtype=dtype)
+  r_b = tf.ones(res_batch_shape + (1, 1), dtype=dtype)
+  for core_idx in range(ndims):
+    if tt_a.is_tt_matrix():
+      mode_shape = (raw_shape[0][core_idx], raw_shape[1][core_idx])
+    else:
+      mode_shape = (raw_shape[0][core_idx],)
+    a_core = tf.reshape(utils.upcast(tt_a.tt_cores[core_idx]),
+                        a_batch_shape + (a_ranks[core_idx], -1,
+                                         a_ranks[core_idx + 1]))
+    b_core = tf.reshape(utils.upcast(tt_b.tt_cores[core_idx]),
+                        b_batch_shape + (b_ranks[core_idx], -1,
+                                         b_ranks[core_idx + 1]))
+    a_part = tf.einsum(a_einsum_str, r_a, a_core)
+    b_part = tf.einsum(b_einsum_str, r_b, b_core)
+    if core_idx == ndims - 1:
+      curr_core = a_part + b_part
+      core_shape = res_batch_shape + (ranks[core_idx],) + mode_shape + (1,)
+      tt_cores.append(tf.reshape(curr_core, core_shape))
+      break
+    curr_core = tf.concat((a_part, b_part), axis=-1)
+    sum_rank = a_ranks[core_idx + 1] + b_ranks[core_idx + 1]
+    curr_core = tf.reshape(curr_core, res_batch_shape + (-1, sum_rank))
+    q, r = tf.qr(curr_core)
+    next_rank = q.get_shape()[-1].value
+    if next_rank is None:
+      next_rank = tf.shape(q)[-1]
+      are_tt_ranks_defined = False
+    ranks[core_idx + 1] = next_rank
+    core_shape = res_batch_shape + (ranks[core_idx],) + mode_shape
+    core_shape += (next_rank,)
+    tt_cores.append(tf.reshape(q, core_shape))
+    r_a = r[..., :a_ranks[core_idx + 1]]
+    r_b = r[..., a_ranks[core_idx + 1]:]
+
+  if not are_tt_ranks_defined:
+    ranks = None
+  if is_res_batch:
+    res = TensorTrainBatch(tt_cores, tt_a.get_raw_shape(), ranks, batch_size)
+    res = decompositions._round_left_orthogonal_batch_tt(res, max_tt_rank,
+                                                         epsilon)
+  else:
+    res = TensorTrain(tt_cores, tt_a.get_raw_shape(), ranks)
+    res = decompositions._round_left_orthogonal_tt(res, max_tt_rank, epsilon)
+  res = cast(res, tt_a.dtype)
+  if is_batch_case:
+    res = shapes.expand_batch_dim(res)
+  return res
+
+
+def add(tt_a, tt_b, max_tt_rank=None, epsilon=None, name='t3f_add'):
   """Returns a TensorTrain corresponding to elementwise sum tt_a + tt_b.
 
   The shapes of tt_a and tt_b should coincide.
@@ -694,6 +1344,12 @@ def add(tt_a, tt_b, name='t3f_add'):
   Args:
     tt_a: `TensorTrain`, `TensorTrainBatch`, TT-tensor, or TT-matrix
     tt_b: `TensorTrain`, `TensorTrainBatch`, TT-tensor, or TT-matrix
+    max_tt_rank: None, a number or a list of numbers. If provided, the sum is
+      rounded to this TT-rank (see t3f.round for the format) directly from the
+      TT-cores of the arguments, without assembling the TT-cores of the sum
+      with zero blocks.
+    epsilon: None or a floating point number. If provided, the sum is rounded
+      to this relative accuracy, see t3f.round.
     name: string, name of the Op.
 
   Returns
@@ -704,6 +1360,18 @@ def add(tt_a, tt_b, name='t3f_add'):
 
   Raises
     ValueError if the arguments shapes do not coincide
+
+  Complexity:
+    Without rounding
+      O(d r n)
+    With rounding (max_tt_rank or epsilon is provided)
+      O(d r^3 n)
+    where
+      d is the number of TT-cores;
+      r is the largest TT-rank of the sum, i.e. of tt_a plus of tt_b;
+      n is the size of the axis dimension, e.g.
+        for a tensor of size 4 x 4 x 4, n is 4;
+        for a 9 x 64 matrix of raw shape (3, 3, 3) x (4, 4, 4) n is 12
   """
   ndims = tt_a.ndims()
   if tt_a.is_tt_matrix() != tt_b.is_tt_matrix():
@@ -718,6 +1386,8 @@ def add(tt_a, tt_b, name='t3f_add'):
                      'not available.')
 
   with tf.name_scope(name, values=tt_a.tt_cores+tt_b.tt_cores):
+    if max_tt_rank is not None or epsilon is not None:
+      return _add_and_round(tt_a, tt_b, max_tt_rank, epsilon)
     is_a_batch = isinstance(tt_a, TensorTrainBatch)
     is_b_batch = isinstance(tt_b, TensorTrainBatch)
     is_batch_case = is_a_batch or is_b_batch
@@ -746,7 +1416,53 @@ def add(tt_a, tt_b, name='t3f_add'):
       return TensorTrain(tt_cores, tt_a.get_raw_shape(), out_ranks)
 
 
-def multiply(tt_left, right, name='t3f_multiply'):
+def _multiply_and_round(tt_left, right, max_tt_rank, epsilon):
+  """Internal function to be called from multiply to round the product on the fly.
+
+  The TT-cores of the element-wise product are the Kronecker products of the
+  TT-cores of the arguments (of TT-rank r_a * r_b), they are never assembled,
+  see _zip_up_product.
+
+  Args:
+    tt_left: `TensorTrain` or `TensorTrainBatch`.
+    right: `TensorTrain` or `TensorTrainBatch` of the same shape.
+    max_tt_rank: None, a number or a list of numbers, see t3f.round.
+    epsilon: None or a floating point number, see t3f.round.
+
+  Returns
+    `TensorTrain` if both arguments are `TensorTrain`s, `TensorTrainBatch`
+    otherwise.
+
+  Raises:
+    ValueError if max_tt_rank is less than 1 or is not a number and not
+      a vector of length d + 1, if epsilon is less than 0.
+  """
+  raw_shape = shapes.lazy_raw_shape(tt_left)
+  if tt_left.is_tt_matrix():
+    mode_shapes = [(raw_shape[0][i], raw_shape[1][i])
+                   for i in range(tt_left.ndims())]
+    core_str = 'aijb,cijd,bde->acije'
+  else:
+    mode_shapes = [(raw_shape[0][i],) for i in range(tt_left.ndims())]
+    core_str = 'aib,cid,bde->acie'
+
+  def contract(a_core, b_core, right_part, prefixes):
+    operands = core_str.replace('->', ',').split(',')
+    einsum_str = '{},{},{}->{}'.format(*[p + o for p, o in zip(prefixes,
+                                                               operands)])
+    return tf.einsum(einsum_str, a_core, b_core, right_part)
+
+  result_cores, ranks, batch_size = _zip_up_product(
+      tt_left, right, contract, mode_shapes, max_tt_rank, epsilon)
+  if batch_size is not None:
+    return TensorTrainBatch(result_cores, tt_left.get_raw_shape(), ranks,
+                            batch_size)
+  else:
+    return TensorTrain(result_cores, tt_left.get_raw_shape(), ranks)
+
+
+def multiply(tt_left, right, max_tt_rank=None, epsilon=None,
+             name='t3f_multiply'):
   """Returns a TensorTrain corresponding to element-wise product tt_left * right.
 
   Supports broadcasting:
@@ -761,6 +1477,11 @@ def multiply(tt_left, right, name='t3f_multiply'):
   Args:
     tt_left: `TensorTrain` OR `TensorTrainBatch`
     right: `TensorTrain` OR `TensorTrainBatch` OR a number.
+    max_tt_rank: None, a number or a list of numbers. If provided, the product
+      is rounded to this TT-rank (see t3f.round for the format) on the fly,
+      without materializing the TT-cores of the product of TT-rank r_a * r_b.
+    epsilon: None or a floating point number. If provided, the product is
+      rounded to this relative accuracy, see t3f.round.
     name: string, name of the Op.
 
   Returns
@@ -770,6 +1491,19 @@ def multiply(tt_left, right, name='t3f_multiply'):
   Raises
     ValueError if the arguments shapes do not coincide or broadcasting is not
     possible.
+
+  Complexity:
+    Without rounding
+      O(d r_a r_b n (r_a r_b))
+    With rounding (max_tt_rank or epsilon is provided)
+      O(d r_a r_b n R (r_a r_b + R))
+    where
+      d is the number of TT-cores;
+      r_a and r_b are the largest TT-ranks of the arguments;
+      R is the largest TT-rank of the result;
+      n is the size of the axis dimension, e.g.
+        for a tensor of size 4 x 4 x 4, n is 4;
+        for a 9 x 64 matrix of raw shape (3, 3, 3) x (4, 4, 4) n is 12
   """
   is_left_batch = isinstance(tt_left, TensorTrainBatch)
   is_right_batch = isinstance(right, TensorTrainBatch)
@@ -792,6 +1526,14 @@ def multiply(tt_left, right, name='t3f_multiply'):
       out_ranks = tt_left.get_tt_ranks()
       if is_left_batch:
           out_batch_size = tt_left.batch_size
+      if max_tt_rank is not None or epsilon is not None:
+        # Multiplication by a number does not change the TT-ranks.
+        if is_left_batch:
+          res = TensorTrainBatch(tt_cores, tt_left.get_raw_shape(), out_ranks,
+                                 batch_size=out_batch_size)
+        else:
+          res = TensorTrain(tt_cores, tt_left.get_raw_shape(), out_ranks)
+        return decompositions.round(res, max_tt_rank, epsilon)
   else:
     with tf.name_scope(name, values=tt_left.tt_cores+right.tt_cores):
 
@@ -841,6 +1583,15 @@ def multiply(tt_left, right, name='t3f_multiply'):
         raise ValueError('The batch sizes are different and not 1, broadcasting '
                          'is not available.')
 
+      if max_tt_rank is not None or epsilon is not None:
+        with tf.control_dependencies(dependencies):
+          res = _multiply_and_round(shapes.squeeze_batch_dim(tt_left),
+                                    shapes.squeeze_batch_dim(right),
+                                    max_tt_rank, epsilon)
+        if is_batch_case:
+          res = shapes.expand_batch_dim(res)
+        return res
+
       a_ranks = shapes.lazy_tt_ranks(tt_left)
       b_ranks = shapes.lazy_tt_ranks(right)
       shape = shapes.lazy_raw_shape(tt_left)
@@ -938,39 +1689,47 @@ def frobenius_norm_squared(tt, differentiable=False,
     each TensorTrain in `tt`, if it is `TensorTrainBatch`
   """
   with tf.name_scope(name, values=tt.tt_cores):
+    dtype = tt.dtype
     if differentiable:
       if hasattr(tt, 'batch_size'):
           bs_str = 'n'
       else:
           bs_str = ''
+      # 16-bit TT-cores are accumulated in float32, see
+      # utils.accumulation_dtype.
+      curr_core = utils.upcast(tt.tt_cores[0])
       if tt.is_tt_matrix():
         running_prod = tf.einsum('{0}aijb,{0}cijd->{0}bd'.format(bs_str),
-                                 tt.tt_cores[0], tt.tt_cores[0])
+                                 curr_core, curr_core)
       else:
         running_prod = tf.einsum('{0}aib,{0}cid->{0}bd'.format(bs_str),
-                                 tt.tt_cores[0], tt.tt_cores[0])
+                                 curr_core, curr_core)
 
       for core_idx in range(1, tt.ndims()):
-        curr_core = tt.tt_cores[core_idx]
+        curr_core = utils.upcast(tt.tt_cores[core_idx])
         if tt.is_tt_matrix():
-          running_prod = tf.einsum('{0}ac,{0}aijb,{0}cijd->{0}bd'.format(bs_str),
-                                   running_prod, curr_core, curr_core)
+          running_prod = utils.einsum('{0}ac,{0}aijb,{0}cijd->{0}bd'.format(
+                                      bs_str), running_prod, curr_core, curr_core)
         else:
-          running_prod = tf.einsum('{0}ac,{0}aib,{0}cid->{0}bd'.format(bs_str),
-                                   running_prod, curr_core, curr_core)
+          running_prod = utils.einsum('{0}ac,{0}aib,{0}cid->{0}bd'.format(
+                                      bs_str), running_prod, curr_core, curr_core)
 
-      return tf.squeeze(running_prod, [-1, -2])
+      return tf.cast(tf.squeeze(running_prod, [-1, -2]), dtype)
 
     else:
-      orth_tt = decompositions.orthogonalize_tt_cores(tt, left_to_right=True)
+      # 16-bit TT-cores are orthogonalized in float32, see
+      # utils.accumulation_dtype.
+      orth_tt = decompositions.orthogonalize_tt_cores(
+          cast(tt, utils.accumulation_dtype(dtype)), left_to_right=True)
       # All the cores of orth_tt except the last one are orthogonal, hence
       # the Frobenius norm of orth_tt equals to the norm of the last core.
+      last_core = orth_tt.tt_cores[-1]
       if hasattr(tt, 'batch_size'):
         batch_size = shapes.lazy_batch_size(tt)
-        last_core = tf.reshape(orth_tt.tt_cores[-1], (batch_size, -1))
-        return tf.norm(last_core, axis=1) ** 2
+        last_core = tf.reshape(last_core, (batch_size, -1))
+        return tf.cast(tf.norm(last_core, axis=1) ** 2, dtype)
       else:
-        return tf.norm(orth_tt.tt_cores[-1]) ** 2
+        return tf.cast(tf.norm(last_core) ** 2, dtype)
 
 
 def frobenius_norm(tt, epsilon=1e-5, differentiable=False,
@@ -1090,24 +1849,25 @@ def bilinear_form(A, b, c, name='t3f_bilinear_form'):
 
   with tf.name_scope(name, values=A.tt_cores+b.tt_cores+c.tt_cores):
     ndims = A.ndims()
-    curr_core_1 = b.tt_cores[0]
-    curr_core_2 = c.tt_cores[0]
-    curr_matrix_core = A.tt_cores[0]
+    # 16-bit TT-cores are accumulated in float32, see
+    # utils.accumulation_dtype.
+    curr_core_1 = utils.upcast(b.tt_cores[0])
+    curr_core_2 = utils.upcast(c.tt_cores[0])
+    curr_matrix_core = utils.upcast(A.tt_cores[0])
     # We enumerate the dummy dimension (that takes 1 value) with `k`.
-    # You may think that using two different k would be faster, but in my
-    # experience it's even a little bit slower (but neglectable in general).
+    # The order of contractions is chosen by utils.einsum based on the ranks.
     einsum_str = '{0}aikb,cijd,{1}ejkf->{2}bdf'.format(b_bs_str, c_bs_str,
                                                        out_bs_str)
-    res = tf.einsum(einsum_str, curr_core_1, curr_matrix_core, curr_core_2)
+    res = utils.einsum(einsum_str, curr_core_1, curr_matrix_core, curr_core_2)
     for core_idx in range(1, ndims):
-      curr_core_1 = b.tt_cores[core_idx]
-      curr_core_2 = c.tt_cores[core_idx]
-      curr_matrix_core = A.tt_cores[core_idx]
+      curr_core_1 = utils.upcast(b.tt_cores[core_idx])
+      curr_core_2 = utils.upcast(c.tt_cores[core_idx])
+      curr_matrix_core = utils.upcast(A.tt_cores[core_idx])
       einsum_str = '{2}ace,{0}aikb,cijd,{1}ejkf->{2}bdf'.format(b_bs_str,
                                                                 c_bs_str,
                                                                 out_bs_str)
-      res = tf.einsum(einsum_str, res, curr_core_1,
-                      curr_matrix_core, curr_core_2)
+      res = utils.einsum(einsum_str, res, curr_core_1,
+                         curr_matrix_core, curr_core_2)
 
     # Squeeze to make the result a number instead of 1 x 1 for NON batch case
     # and to make the result a tensor of size
@@ -1115,7 +1875,7 @@ def bilinear_form(A, b, c, name='t3f_bilinear_form'):
     # instead of
     #   batch_size x 1 x 1
     # in the batch case.
-    return tf.squeeze(res)
+    return tf.cast(tf.squeeze(res), A.dtype)
 
 
 def cast(tt, dtype, name='t3f_cast'):
@@ -1146,7 +1906,7 @@ def cast(tt, dtype, name='t3f_cast'):
                        'or TensorTrainBatch.' % tt)
 
 
-def gather_nd(tt, indices, name='t3f_gather_nd'):
+def gather_nd(tt, indices, share_prefixes=False, name='t3f_gather_nd'):
   """out[i] = tt[indices[i, 0], indices[i, 1], ...]
 
   Equivalent to
@@ -1155,6 +1915,13 @@ def gather_nd(tt, indices, name='t3f_gather_nd'):
 
   For batches of TT works indices should include the batch dimension as well.
 
+  With share_prefixes=True the indices are organized into a trie level by
+  level: the partial product of the first k TT-cores slices is computed once
+  for each unique prefix indices[i, :k] and reused by all the indices that
+  share it. This is much faster when many indices share leading multi-index
+  prefixes (e.g. sorted or repeated indices) and can be slower when they share
+  almost none, since it has to find the unique prefixes on each level.
+
   Args:
     tt: `TensorTrain` or `TensorTrainBatch` object representing a tensor
       (TT-matrices are not implemented yet)
@@ -1163,6 +1930,8 @@ def gather_nd(tt, indices, name='t3f_gather_nd'):
       dimensions in TT:
         indices.shape[-1] = tt.ndims for `TensorTrain`
         indices.shape[-1] = tt.ndims + 1 for `TensorTrainBatch`
+    share_prefixes: bool, whether to reuse the computations for the indices
+      with the same leading elements.
     name: string, name of the Op.
 
   Returns:
@@ -1171,6 +1940,17 @@ def gather_nd(tt, indices, name='t3f_gather_nd'):
   Raises:
     ValueError if `indices` have wrong shape.
     NotImplementedError if `tt` is a TT-matrix.
+
+  Complexity:
+    share_prefixes=False:
+      O(N d r^2)
+    share_prefixes=True:
+      O(N d + (U_1 + ... + U_d) r^2)
+    where
+      N is the number of indices;
+      d is the number of TT-cores;
+      r is the largest TT-rank of tt;
+      U_k is the number of unique prefixes of length k in indices.
   """
   with tf.name_scope(name, values=tt.tt_cores+(indices,)):
     if tt.is_tt_matrix():
@@ -1188,7 +1968,11 @@ def gather_nd(tt, indices, name='t3f_gather_nd'):
         raise ValueError('The last dimension of indices (%d) should have '
                          'the same size as the number of dimensions in the tt '
                          'object (%d).' % (indices.get_shape()[-1], tt.ndims()))
-    tt_elements = tf.ones(tf.shape(indices)[:-1], dtype=tt.dtype)
+    if share_prefixes:
+      return _gather_nd_shared_prefixes(tt, indices)
+    # 16-bit TT-cores are accumulated in float32, see utils.accumulation_dtype.
+    tt_elements = tf.ones(tf.shape(indices)[:-1],
+                          dtype=utils.accumulation_dtype(tt.dtype))
     tt_elements = tf.reshape(tt_elements, (-1, 1, 1))
     for core_idx in range(tt.ndims()):
       curr_core = tt.tt_cores[core_idx]
@@ -1199,9 +1983,52 @@ def gather_nd(tt, indices, name='t3f_gather_nd'):
       else:
         curr_core = tf.transpose(curr_core, (1, 0, 2))
         core_slices = tf.gather(curr_core, indices[:, core_idx])
-      tt_elements = tf.matmul(tt_elements, core_slices)
+      tt_elements = tf.matmul(tt_elements, utils.upcast(core_slices))
     tt_elements = tf.reshape(tt_elements, tf.shape(indices)[:-1])
-    return tt_elements
+    return tf.cast(tt_elements, tt.dtype)
+
+
+def _gather_nd_shared_prefixes(tt, indices):
+  """Internal function to be called from gather_nd with share_prefixes=True.
+
+  On the k-th level every index is represented by the id of its unique prefix
+  of length k; the ids of the prefixes of length k + 1 are found by tf.unique
+  of the keys (id of the parent prefix, k-th element of the index). The partial
+  products are computed only for the unique prefixes.
+  """
+  is_batch = isinstance(tt, TensorTrainBatch)
+  raw_shape = shapes.lazy_raw_shape(tt)
+  indices_shape = tf.shape(indices)[:-1]
+  indices = tf.reshape(indices, (-1, indices.get_shape()[-1].value))
+  indices = tf.cast(indices, tf.int64)
+  if is_batch:
+    # The batch index is the zeroth level of the trie.
+    prefix_batch_idx, prefix_ids = tf.unique(indices[:, 0])
+    indices = indices[:, 1:]
+    partial = tf.ones((tf.size(prefix_batch_idx), 1, 1),
+                      dtype=utils.accumulation_dtype(tt.dtype))
+  else:
+    prefix_ids = tf.zeros(tf.shape(indices)[:1], dtype=tf.int32)
+    partial = tf.ones((1, 1, 1), dtype=utils.accumulation_dtype(tt.dtype))
+  for core_idx in range(tt.ndims()):
+    curr_mode = tf.cast(raw_shape[0][core_idx], tf.int64)
+    keys = tf.cast(prefix_ids, tf.int64) * curr_mode + indices[:, core_idx]
+    unique_keys, prefix_ids = tf.unique(keys)
+    parent_ids = unique_keys // curr_mode
+    curr_idx = unique_keys % curr_mode
+    curr_core = tt.tt_cores[core_idx]
+    if is_batch:
+      prefix_batch_idx = tf.gather(prefix_batch_idx, parent_ids)
+      curr_core = tf.transpose(curr_core, (0, 2, 1, 3))
+      curr_idx = tf.stack((prefix_batch_idx, curr_idx), axis=1)
+      core_slices = tf.gather_nd(curr_core, curr_idx)
+    else:
+      curr_core = tf.transpose(curr_core, (1, 0, 2))
+      core_slices = tf.gather(curr_core, curr_idx)
+    partial = tf.matmul(tf.gather(partial, parent_ids),
+                        utils.upcast(core_slices))
+  tt_elements = tf.gather(partial, prefix_ids)
+  return tf.cast(tf.reshape(tt_elements, indices_shape), tt.dtype)
 
 
 def renormalize_tt_cores(tt, epsilon=1e-8, name='t3f_renormalize_tt_cores'):
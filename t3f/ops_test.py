@@ -5,6 +5,7 @@ from t3f.tensor_train import TensorTrain
 from t3f.tensor_train_batch import TensorTrainBatch
 from t3f import ops
 from t3f import shapes
+from t3f import decompositions
 from t3f import initializers
 
 
@@ -85,6 +86,27 @@ class _TTTensorTest():
             res_desired_val = tt_1_val.flatten()[sparse_flat_indices].dot(values)
             self.assertAllClose(res_actual_val, res_desired_val)
 
+  def testFlatInnerTTTensbyDenseTens(self):
+    # Inner product between a TT-tensor and a dense tensor.
+    shape_list = ((2, 2),
+                  (2, 3, 4),
+                  (4, 2, 5, 2))
+    rank_list = (1, 2)
+    np.random.seed(1)
+    with self.test_session() as sess:
+      for shape in shape_list:
+        for rank in rank_list:
+          tt_1 = initializers.random_tensor(shape, tt_rank=rank,
+                                            dtype=self.dtype)
+          dense_2 = np.random.randn(*shape).astype(self.dtype.as_numpy_dtype)
+          res_actual = ops.flat_inner(tt_1, tf.constant(dense_2))
+          res_actual2 = ops.flat_inner(tf.constant(dense_2), tt_1)
+          res_actual_val, res_actual2_val, tt_1_val = sess.run(
+              [res_actual, res_actual2, ops.full(tt_1)])
+          res_desired_val = np.sum(tt_1_val * dense_2)
+          self.assertAllClose(res_actual_val, res_desired_val)
+          self.assertAllClose(res_actual2_val, res_desired_val)
+
   def testAdd(self):
     # Sum two TT-tensors.
     tt_a = initializers.random_tensor((2, 1, 3, 4), tt_rank=2,
@@ -100,6 +122,26 @@ class _TTTensorTest():
       self.assertAllClose(res_actual_val, res_desired_val)
       self.assertAllClose(res_actual2_val, res_desired_val)
 
+  def testAddRounded(self):
+    # Sum two TT-tensors and round the result.
+    tt_a = initializers.random_tensor((2, 1, 3, 4), tt_rank=2,
+                                      dtype=self.dtype)
+    tt_b = initializers.random_tensor((2, 1, 3, 4), tt_rank=[1, 2, 4, 3, 1],
+                                      dtype=self.dtype)
+    with self.test_session() as sess:
+      res_exact = ops.add(tt_a, tt_b, max_tt_rank=6)
+      res_eps = ops.add(tt_a, tt_b, epsilon=1e-6)
+      res_rounded = ops.add(tt_a, tt_b, max_tt_rank=2)
+      res_svd = decompositions.round(tt_a + tt_b, max_tt_rank=2)
+      res_desired = ops.full(tt_a) + ops.full(tt_b)
+      self.assertEqual([1, 2, 2, 2, 1], res_rounded.get_tt_ranks().as_list())
+      to_run = [ops.full(res_exact), ops.full(res_eps), ops.full(res_rounded),
+                ops.full(res_svd), res_desired]
+      exact_val, eps_val, rounded_val, svd_val, desired_val = sess.run(to_run)
+      self.assertAllClose(exact_val, desired_val)
+      self.assertAllClose(eps_val, desired_val)
+      self.assertAllClose(rounded_val, svd_val, atol=1e-4, rtol=1e-4)
+
   def testMultiply(self):
     # Multiply two TT-tensors.
     tt_a = initializers.random_tensor((1, 2, 3, 4), tt_rank=2,
@@ -115,6 +157,62 @@ class _TTTensorTest():
       self.assertAllClose(res_actual_val, res_desired_val)
       self.assertAllClose(res_actual2_val, res_desired_val)
 
+  def testFullBlocks(self):
+    # Convert a TT-tensor into dense blocks.
+    np.random.seed(1)
+    tt_cores = [np.random.rand(1, 3, 3), np.random.rand(3, 4, 3),
+                np.random.rand(3, 5, 3), np.random.rand(3, 2, 1)]
+    tt_cores = [c.astype(self.dtype.as_numpy_dtype) for c in tt_cores]
+    tt = TensorTrain(tt_cores)
+    with self.test_session() as sess:
+      for block_shape in [(3,), (2, 3), (1, 4, 2, 2)]:
+        dataset = ops.full_blocks(tt, block_shape)
+        iterator = tf.data.make_initializable_iterator(dataset)
+        next_block = iterator.get_next()
+        sess.run(iterator.initializer)
+        desired = sess.run(ops.full(tt))
+        actual = np.zeros_like(desired)
+        num_blocks = 0
+        while True:
+          try:
+            begin, slab = sess.run(next_block)
+          except tf.errors.OutOfRangeError:
+            break
+          idx = tuple(slice(b, b + s) for b, s in zip(begin, slab.shape))
+          actual[idx] += slab
+          num_blocks += 1
+        num_blocks_desired = np.ceil(np.array(desired.shape[:len(block_shape)]) /
+                                     np.array(block_shape))
+        self.assertEqual(np.prod(num_blocks_desired), num_blocks)
+        self.assertAllClose(desired, actual)
+
+  def testMultiplyRounded(self):
+    # Multiply two TT-tensors and round the result on the fly.
+    tt_a = initializers.random_tensor((2, 2, 3, 4), tt_rank=3,
+                                      dtype=self.dtype)
+    tt_b = initializers.random_tensor((2, 2, 3, 4), tt_rank=[1, 2, 4, 3, 1],
+                                      dtype=self.dtype)
+    with self.test_session() as sess:
+      res_exact = ops.multiply(tt_a, tt_b, max_tt_rank=12)
+      res_eps = ops.multiply(tt_a, tt_b, epsilon=1e-6)
+      res_rounded = ops.multiply(tt_a, tt_b, max_tt_rank=3)
+      res_svd = decompositions.round(tt_a * tt_b, max_tt_rank=3)
+      res_number = ops.multiply(tt_a, 4, max_tt_rank=2)
+      res_desired = ops.full(tt_a) * ops.full(tt_b)
+      self.assertEqual([1, 3, 3, 3, 1], res_rounded.get_tt_ranks().as_list())
+      self.assertEqual([1, 2, 2, 2, 1], res_number.get_tt_ranks().as_list())
+      to_run = [ops.full(res_exact), ops.full(res_eps), ops.full(res_rounded),
+                ops.full(res_svd), res_desired]
+      exact_val, eps_val, rounded_val, svd_val, desired_val = sess.run(to_run)
+      self.assertAllClose(exact_val, desired_val, atol=1e-4, rtol=1e-4)
+      self.assertAllClose(eps_val, desired_val, atol=1e-4, rtol=1e-4)
+      # The on the fly truncation is quasi-optimal: not better than the
+      # optimal one, but still a meaningful approximation.
+      rounded_err = np.linalg.norm(rounded_val - desired_val)
+      svd_err = np.linalg.norm(svd_val - desired_val)
+      self.assertLessEqual(svd_err, rounded_err * (1 + 1e-4))
+      self.assertLess(rounded_err, np.linalg.norm(desired_val))
+
   def testMultiplyByNumber(self):
     # Multiply a tensor by a number.
     tt = initializers.random_tensor((1, 2, 3), tt_rank=(1, 2, 3, 1),
@@ -227,6 +325,35 @@ class _TTMatrixTest():
         actual = ops.full(tf_mat)
         self.assertAllClose(desired, actual.eval())
 
+  def testFullBlocks(self):
+    # Convert a TT-matrix into dense blocks of rows.
+    np.random.seed(1)
+    row_shape = (3, 4, 2)
+    tt_cores = [np.random.rand(1, 3, 2, 3), np.random.rand(3, 4, 3, 3),
+                np.random.rand(3, 2, 2, 1)]
+    tt_cores = [c.astype(self.dtype.as_numpy_dtype) for c in tt_cores]
+    tt = TensorTrain(tt_cores)
+    with self.test_session() as sess:
+      desired = sess.run(ops.full(tt))
+      desired = desired.reshape(row_shape + (-1,))
+      for block_shape in [(2,), (2, 3)]:
+        dataset = ops.full_blocks(tt, block_shape)
+        iterator = tf.data.make_initializable_iterator(dataset)
+        next_block = iterator.get_next()
+        sess.run(iterator.initializer)
+        actual = np.zeros_like(desired)
+        while True:
+          try:
+            begin, slab = sess.run(next_block)
+          except tf.errors.OutOfRangeError:
+            break
+          sizes = [min(b, n - i) for b, n, i in zip(block_shape, row_shape,
+                                                    begin)]
+          slab = slab.reshape(sizes + list(row_shape[len(block_shape):]) +
+                              [desired.shape[-1]])
+          actual[tuple(slice(i, i + s) for i, s in zip(begin, sizes))] += slab
+        self.assertAllClose(desired, actual)
+
   def testTTMatTimesTTMat(self):
     # Multiply a TT-matrix by another TT-matrix.
     left_shape = (2, 3, 4)
@@ -244,6 +371,35 @@ class _TTMatrixTest():
       # TODO: why so bad accuracy?
       self.assertAllClose(res_actual_val, res_desired_val, atol=1e-4, rtol=1e-4)
 
+  def testTTMatTimesTTMatRounded(self):
+    # Multiply a TT-matrix by another TT-matrix and round the result on the
+    # fly.
+    left_shape = (2, 3, 4)
+    sum_shape = (4, 3, 5)
+    right_shape = (4, 4, 4)
+    with self.test_session() as sess:
+      tt_mat_1 = initializers.random_matrix((left_shape, sum_shape), tt_rank=3,
+                                            dtype=self.dtype)
+      tt_mat_2 = initializers.random_matrix((sum_shape, right_shape),
+                                            tt_rank=2, dtype=self.dtype)
+      # The TT-rank of the product is at most 6, so there is no truncation.
+      res_exact = ops.matmul(tt_mat_1, tt_mat_2, max_tt_rank=6)
+      res_eps = ops.matmul(tt_mat_1, tt_mat_2, epsilon=1e-6)
+      res_rounded = ops.matmul(tt_mat_1, tt_mat_2, max_tt_rank=2)
+      res_svd = decompositions.round(ops.matmul(tt_mat_1, tt_mat_2),
+                                     max_tt_rank=2)
+      res_desired = tf.matmul(ops.full(tt_mat_1), ops.full(tt_mat_2))
+      to_run = [ops.full(res_exact), ops.full(res_eps), ops.full(res_rounded),
+                ops.full(res_svd), res_desired]
+      exact_val, eps_val, rounded_val, svd_val, desired_val = sess.run(to_run)
+      self.assertAllClose(exact_val, desired_val, atol=1e-4, rtol=1e-4)
+      self.assertAllClose(eps_val, desired_val, atol=1e-4, rtol=1e-4)
+      self.assertEqual([1, 2, 2, 1], res_rounded.get_tt_ranks().as_list())
+      rounded_err = np.linalg.norm(rounded_val - desired_val)
+      svd_err = np.linalg.norm(svd_val - desired_val)
+      # The on the fly rounding is quasi-optimal.
+      self.assertLess(rounded_err, 2 * svd_err + 1e-4)
+
   def testTTMatTimesDenseVec(self):
     # Multiply a TT-matrix by a dense vector.
     inp_shape = (2, 3, 4)
@@ -277,6 +433,25 @@ class _TTMatrixTest():
       res_actual_val, res_desired_val = sess.run([res_actual, res_desired])
       self.assertAllClose(res_actual_val, res_desired_val, atol=1e-4, rtol=1e-4)
 
+  def testDenseMatTimesTTMat(self):
+    # Multiply a dense matrix with unknown number of rows by a TT-matrix.
+    inp_shape = (2, 3, 4)
+    out_shape = (3, 4, 3)
+    np.random.seed(1)
+    mat = np.random.rand(5, np.prod(inp_shape))
+    mat = mat.astype(self.dtype.as_numpy_dtype)
+    with self.test_session() as sess:
+      tf_mat = tf.placeholder(self.dtype, (None, np.prod(inp_shape)))
+      tt_mat = initializers.random_matrix((inp_shape, out_shape), tt_rank=3,
+                                          dtype=self.dtype)
+      res_actual = ops.matmul(tf_mat, tt_mat)
+      self.assertEqual([None, np.prod(out_shape)],
+                       res_actual.get_shape().as_list())
+      res_desired = tf.matmul(tf_mat, ops.full(tt_mat))
+      res_actual_val, res_desired_val = sess.run([res_actual, res_desired],
+                                                 {tf_mat: mat})
+      self.assertAllClose(res_actual_val, res_desired_val)
+
   def testFlatInnerTTMatbyTTMat(self):
     # Inner product between two TT-Matrices.
     shape_list = (((2, 2), (3, 4)),
@@ -322,6 +497,59 @@ class _TTMatrixTest():
             res_desired_val = tt_1_val.flatten()[sparse_flat_indices].dot(values)
             self.assertAllClose(res_actual_val, res_desired_val)
 
+  def testFlatInnerTTMatbyDenseMat(self):
+    # Inner product between a TT-matrix and a dense matrix.
+    shape_list = (((2, 2), (3, 4)),
+                  ((2, 3, 4), (2, 2, 2)))
+    rank_list = (1, 2)
+    np.random.seed(1)
+    with self.test_session() as sess:
+      for tensor_shape in shape_list:
+        for rank in rank_list:
+          tt_1 = initializers.random_matrix(tensor_shape, tt_rank=rank,
+                                            dtype=self.dtype)
+          matrix_shape = np.prod(tensor_shape[0]), np.prod(tensor_shape[1])
+          dense_2 = np.random.randn(*matrix_shape)
+          dense_2 = dense_2.astype(self.dtype.as_numpy_dtype)
+          res_actual = ops.flat_inner(tt_1, tf.constant(dense_2))
+          res_actual_val, tt_1_val = sess.run([res_actual, ops.full(tt_1)])
+          res_desired_val = np.sum(tt_1_val * dense_2)
+          self.assertAllClose(res_actual_val, res_desired_val)
+
+  def testTTMatTimesSparseMat(self):
+    # Multiply a TT-matrix by a sparse matrix and vice versa.
+    shape_list = (((2, 2), (3, 4)),
+                  ((2, 3, 4), (2, 2, 2)))
+    rank_list = (1, 2)
+    np.random.seed(1)
+    with self.test_session() as sess:
+      for tensor_shape in shape_list:
+        for rank in rank_list:
+          for num_elements in [1, 9]:
+            tt_1 = initializers.random_matrix(tensor_shape, tt_rank=rank,
+                                              dtype=self.dtype)
+            tt_1_t = ops.transpose(tt_1)
+            sparse_shape = np.prod(tensor_shape[1]), 5
+            sparse_flat_indices = np.random.choice(np.prod(sparse_shape),
+                                                   num_elements, replace=False)
+            sparse_flat_indices = np.sort(sparse_flat_indices)
+            sparse_indices = np.unravel_index(sparse_flat_indices,
+                                              sparse_shape)
+            sparse_indices = np.vstack(sparse_indices).transpose()
+            values = np.random.randn(num_elements)
+            values = values.astype(self.dtype.as_numpy_dtype)
+            sparse = tf.SparseTensor(indices=sparse_indices, values=values,
+                                     dense_shape=sparse_shape)
+            sparse_t = tf.sparse_transpose(sparse)
+            res_actual = ops.matmul(tt_1, sparse)
+            res_actual_t = ops.matmul(sparse_t, tt_1_t)
+            dense = tf.sparse_tensor_to_dense(sparse, validate_indices=False)
+            res_desired = tf.matmul(ops.full(tt_1), dense)
+            to_run = [res_actual, res_actual_t, res_desired]
+            res_actual_val, res_actual_t_val, res_desired_val = sess.run(to_run)
+            self.assertAllClose(res_actual_val, res_desired_val)
+            self.assertAllClose(res_actual_t_val, res_desired_val.T)
+
   def testFrobeniusNormMatrix(self):
     # Frobenius norm of a TT-matrix.
     shape_list = (((2, 2), (3, 4)),
@@ -462,6 +690,21 @@ class _TTMatrixTest():
       res_desired_val = sess.run(res_desired, {K_1: K_1_val, K_2: K_2_val})
       self.assertAllClose(res_desired_val, res_actual_val)
 
+  def testUnknownRanksTTMatmulRounded(self):
+    # Tests the rounded tt_tt_matmul for matrices with unknown ranks.
+    K_1 = tf.placeholder(self.dtype, (1, 2, 2, None))
+    K_2 = tf.placeholder(self.dtype, (None, 3, 3, 1))
+    tt_mat = TensorTrain([K_1, K_2])
+    res_actual = ops.full(ops.matmul(tt_mat, tt_mat, max_tt_rank=4))
+    res_desired = tf.matmul(ops.full(tt_mat), ops.full(tt_mat))
+    np.random.seed(1)
+    K_1_val = np.random.rand(1, 2, 2, 2)
+    K_2_val = np.random.rand(2, 3, 3, 1)
+    with self.test_session() as sess:
+      res_actual_val = sess.run(res_actual, {K_1: K_1_val, K_2: K_2_val})
+      res_desired_val = sess.run(res_desired, {K_1: K_1_val, K_2: K_2_val})
+      self.assertAllClose(res_desired_val, res_actual_val)
+
 
 class _TTTensorBatchTest():
 
@@ -512,6 +755,25 @@ class _TTTensorBatchTest():
           res_actual_val, res_desired_val = sess.run([res_actual, res_desired])
           self.assertAllClose(res_actual_val, np.squeeze(res_desired_val))
 
+  def testFlatInnerTTTensbyDenseTens(self):
+    # Inner product between a batch of TT-tensors and a dense tensor.
+    shape_list = ((2, 2),
+                  (2, 3, 4))
+    rank_list = (1, 2)
+    np.random.seed(1)
+    with self.test_session() as sess:
+      for shape in shape_list:
+        for rank in rank_list:
+          tt_1 = initializers.random_tensor_batch(shape, tt_rank=rank,
+                                                  batch_size=3,
+                                                  dtype=self.dtype)
+          dense_2 = np.random.randn(*shape).astype(self.dtype.as_numpy_dtype)
+          res_actual = ops.flat_inner(tt_1, tf.constant(dense_2))
+          res_actual_val, tt_1_val = sess.run([res_actual, ops.full(tt_1)])
+          axis = tuple(range(1, len(shape) + 1))
+          res_desired_val = np.sum(tt_1_val * dense_2[None], axis=axis)
+          self.assertAllClose(res_actual_val, res_desired_val)
+
   def testFlatInnerTTTensbyTTTensBroadcasting(self):
     # Inner product between two batch TT-tensors with broadcasting.
     tt_1 = initializers.random_tensor_batch((2, 3, 4), batch_size=1,
@@ -563,6 +825,27 @@ class _TTTensorBatchTest():
       self.assertAllClose(res_actual_val, res_desired_val)
       self.assertAllClose(res_actual2_val, res_desired_val)
 
+  def testAddRoundedBroadcasting(self):
+    # Sum two TT-tensors with broadcasting and round the result.
+    tt_a = initializers.random_tensor_batch((2, 1, 4), tt_rank=2, batch_size=1,
+                                            dtype=self.dtype)
+    tt_b = initializers.random_tensor_batch((2, 1, 4), tt_rank=[1, 2, 4, 1],
+                                            batch_size=3, dtype=self.dtype)
+    tt_c = initializers.random_tensor((2, 1, 4), tt_rank=2, dtype=self.dtype)
+    with self.test_session() as sess:
+      res_actual = ops.add(tt_a, tt_b, max_tt_rank=6)
+      res_actual2 = ops.add(tt_b, tt_c, epsilon=1e-6)
+      self.assertEqual(3, res_actual.batch_size)
+      self.assertEqual(3, res_actual2.batch_size)
+      res_desired = ops.full(tt_a) + ops.full(tt_b)
+      res_desired2 = ops.full(tt_b) + ops.full(tt_c)
+      to_run = [ops.full(res_actual), ops.full(res_actual2), res_desired,
+                res_desired2]
+      res_actual_val, res_actual2_val, res_desired_val, res_desired2_val = \
+          sess.run(to_run)
+      self.assertAllClose(res_actual_val, res_desired_val)
+      self.assertAllClose(res_actual2_val, res_desired2_val)
+
   def testMultiplyByNumber(self):
     # Multiply batch of tensors by a number.
     tt = initializers.random_tensor_batch((1, 2, 3), tt_rank=(1, 2, 3, 1),
@@ -633,6 +916,29 @@ class _TTTensorBatchTest():
       self.assertAllClose(res_actual_val, res_desired_val)
       self.assertAllClose(res_actual2_val, res_desired_val)
 
+  def testMultiplyRounded(self):
+    # Multiply batches of TT-tensors with broadcasting and round the result.
+    tt_a = initializers.random_tensor_batch((2, 1, 4), tt_rank=2, batch_size=1,
+                                            dtype=self.dtype)
+    tt_b = initializers.random_tensor_batch((2, 1, 4), tt_rank=[1, 2, 4, 1],
+                                            batch_size=3, dtype=self.dtype)
+    tt_c = initializers.random_tensor((2, 1, 4), tt_rank=2, dtype=self.dtype)
+    with self.test_session() as sess:
+      res_actual = ops.multiply(tt_a, tt_b, max_tt_rank=8)
+      res_actual2 = ops.multiply(tt_c, tt_b, epsilon=1e-6)
+      res_actual3 = ops.multiply(tt_b, tt_b, max_tt_rank=16)
+      self.assertEqual(3, res_actual.batch_size)
+      self.assertEqual(3, res_actual2.batch_size)
+      res_desired = ops.full(tt_a) * ops.full(tt_b)
+      res_desired2 = ops.full(tt_c) * ops.full(tt_b)
+      res_desired3 = ops.full(tt_b) * ops.full(tt_b)
+      to_run = [ops.full(res_actual), ops.full(res_actual2),
+                ops.full(res_actual3), res_desired, res_desired2, res_desired3]
+      res = sess.run(to_run)
+      self.assertAllClose(res[0], res[3], atol=1e-4, rtol=1e-4)
+      self.assertAllClose(res[1], res[4], atol=1e-4, rtol=1e-4)
+      self.assertAllClose(res[2], res[5], atol=1e-4, rtol=1e-4)
+
   def testMultiplyBroadcasting(self):
     tt_a = initializers.random_tensor_batch((3, 3, 3), tt_rank=2, batch_size=1,
                                             dtype=self.dtype)
@@ -735,6 +1041,19 @@ class _TTTensorBatchTest():
       self.assertAllClose(res_np_v, des_v)
       self.assertAllClose(res_pl_v, res_pl_v)
 
+  def testGatherNDSharePrefixes(self):
+    idx = [[0, 0, 0], [0, 1, 2], [0, 1, 0], [2, 3, 4], [0, 1, 2], [0, 0, 3]]
+    pl_idx = tf.placeholder(tf.int32, [None, 3])
+    tt = initializers.random_tensor((3, 4, 5), tt_rank=2, dtype=self.dtype)
+    res_np = ops.gather_nd(tt, idx, share_prefixes=True)
+    res_pl = ops.gather_nd(tt, pl_idx, share_prefixes=True)
+    res_desired = tf.gather_nd(ops.full(tt), idx)
+    to_run = [res_np, res_pl, res_desired]
+    with self.test_session() as sess:
+      res_np_v, res_pl_v, des_v = sess.run(to_run, feed_dict={pl_idx: idx})
+      self.assertAllClose(res_np_v, des_v)
+      self.assertAllClose(res_pl_v, des_v)
+
   def testGatherNDBatch(self):
     idx = [[0, 0, 0, 0], [1, 0, 1, 2], [0, 0, 1, 0]]
     pl_idx = tf.placeholder(tf.int32, [None, 4])
@@ -749,6 +1068,21 @@ class _TTTensorBatchTest():
       self.assertAllClose(res_np_v, des_v)
       self.assertAllClose(res_pl_v, res_pl_v)
 
+  def testGatherNDBatchSharePrefixes(self):
+    idx = [[0, 0, 0, 0], [1, 0, 1, 2], [0, 0, 1, 0], [1, 0, 1, 0],
+           [1, 2, 3, 4], [0, 0, 0, 0]]
+    pl_idx = tf.placeholder(tf.int32, [None, 4])
+    tt = initializers.random_tensor_batch((3, 4, 5), tt_rank=2, batch_size=2,
+                                          dtype=self.dtype)
+    res_np = ops.gather_nd(tt, idx, share_prefixes=True)
+    res_pl = ops.gather_nd(tt, pl_idx, share_prefixes=True)
+    res_desired = tf.gather_nd(ops.full(tt), idx)
+    to_run = [res_np, res_pl, res_desired]
+    with self.test_session() as sess:
+      res_np_v, res_pl_v, des_v = sess.run(to_run, feed_dict={pl_idx: idx})
+      self.assertAllClose(res_np_v, des_v)
+      self.assertAllClose(res_pl_v, des_v)
+
   def testCoreRenormBatch(self):
       a = initializers.random_tensor_batch(3 * (10,), tt_rank=7, batch_size=5,
                                            dtype=self.dtype)
@@ -847,6 +1181,77 @@ class _TTMatrixTestBatch():
       self.assertAllClose(res_actual2_val, res_desired_val, atol=1e-5,
                           rtol=1e-5)
 
+  def testFlatInnerTTMatbyDenseMat(self):
+    # Inner product between a batch of TT-matrices and a dense matrix.
+    tt_1 = initializers.random_matrix_batch(((2, 3, 4), (2, 2, 2)), tt_rank=2,
+                                            batch_size=3, dtype=self.dtype)
+    np.random.seed(1)
+    dense_2 = np.random.randn(24, 8).astype(self.dtype.as_numpy_dtype)
+    with self.test_session() as sess:
+      res_actual = ops.flat_inner(tf.constant(dense_2), tt_1)
+      res_actual_val, tt_1_val = sess.run([res_actual, ops.full(tt_1)])
+      res_desired_val = np.sum(tt_1_val * dense_2[None], axis=(1, 2))
+      self.assertAllClose(res_actual_val, res_desired_val)
+
+  def testAddRounded(self):
+    # Sum two batches of TT-matrices and round the result.
+    tt_a = initializers.random_matrix_batch(((2, 1, 4), None), tt_rank=2,
+                                            batch_size=3, dtype=self.dtype)
+    tt_b = initializers.random_matrix_batch(((2, 1, 4), None),
+                                            tt_rank=[1, 2, 4, 1], batch_size=3,
+                                            dtype=self.dtype)
+    with self.test_session() as sess:
+      res_actual = ops.add(tt_a, tt_b, max_tt_rank=2)
+      res_desired = decompositions.round(tt_a + tt_b, max_tt_rank=2)
+      res_actual_val, res_desired_val = sess.run([ops.full(res_actual),
+                                                  ops.full(res_desired)])
+      self.assertAllClose(res_actual_val, res_desired_val, atol=1e-4,
+                          rtol=1e-4)
+
+  def testMultiplyRounded(self):
+    # Multiply two batches of TT-matrices and round the result on the fly.
+    tt_a = initializers.random_matrix_batch(((2, 1, 4), (3, 2, 2)), tt_rank=2,
+                                            batch_size=3, dtype=self.dtype)
+    tt_b = initializers.random_matrix_batch(((2, 1, 4), (3, 2, 2)),
+                                            tt_rank=[1, 3, 4, 1], batch_size=3,
+                                            dtype=self.dtype)
+    with self.test_session() as sess:
+      res_actual = ops.multiply(tt_a, tt_b, max_tt_rank=8)
+      res_desired = ops.full(tt_a) * ops.full(tt_b)
+      res_actual_val, res_desired_val = sess.run([ops.full(res_actual),
+                                                  res_desired])
+      self.assertAllClose(res_actual_val, res_desired_val, atol=1e-4,
+                          rtol=1e-4)
+
+  def testTTMatTimesTTMatRounded(self):
+    # Multiply batches of TT-matrices and round the result on the fly.
+    left_shape = (2, 3)
+    sum_shape = (4, 3)
+    right_shape = (4, 4)
+    with self.test_session() as sess:
+      tt_mat_1 = initializers.random_matrix_batch((left_shape, sum_shape),
+                                                  tt_rank=3, batch_size=3,
+                                                  dtype=self.dtype)
+      tt_mat_2 = initializers.random_matrix_batch((sum_shape, right_shape),
+                                                  tt_rank=2, batch_size=3,
+                                                  dtype=self.dtype)
+      tt_mat_3 = initializers.random_matrix((sum_shape, right_shape),
+                                            tt_rank=2, dtype=self.dtype)
+      res_actual = ops.matmul(tt_mat_1, tt_mat_2, max_tt_rank=6)
+      res_actual2 = ops.matmul(tt_mat_1, tt_mat_3, epsilon=1e-6)
+      res_desired = tf.matmul(ops.full(tt_mat_1), ops.full(tt_mat_2))
+      res_desired2 = tf.einsum('oij,jk->oik', ops.full(tt_mat_1),
+                               ops.full(tt_mat_3))
+      self.assertEqual(3, res_actual.batch_size)
+      to_run = [ops.full(res_actual), ops.full(res_actual2), res_desired,
+                res_desired2]
+      res_actual_val, res_actual2_val, res_desired_val, res_desired2_val = \
+          sess.run(to_run)
+      self.assertAllClose(res_actual_val, res_desired_val, atol=1e-5,
+                          rtol=1e-5)
+      self.assertAllClose(res_actual2_val, res_desired2_val, atol=1e-5,
+                          rtol=1e-5)
+
   def testTranspose(self):
     # Transpose a batch of TT-matrices.
     with self.test_session() as sess:
@@ -925,6 +1330,105 @@ def _random_sparse(shape, non_zeros):
   return sparse
 
 
+class _MixedPrecisionTest():
+  # TT-cores are stored in self.dtype (16 bits) and the results are compared
+  # with float64 computations on the same values.
+
+  def testFlatInner(self):
+    shape = (3, 4) * 5
+    tt_a = initializers.random_tensor(shape, tt_rank=4, dtype=self.dtype)
+    tt_b = initializers.random_tensor(shape, tt_rank=3, dtype=self.dtype)
+    res = ops.flat_inner(tt_a, tt_b)
+    self.assertEqual(self.dtype, res.dtype)
+    desired = ops.flat_inner(ops.cast(tt_a, tf.float64),
+                             ops.cast(tt_b, tf.float64))
+    with self.test_session() as sess:
+      res_val, desired_val = sess.run([tf.cast(res, tf.float64), desired])
+      self.assertAllClose(desired_val, res_val, rtol=1e-2)
+
+  def testFrobeniusNorm(self):
+    shape = (3, 4) * 3
+    tt = initializers.random_tensor_batch(shape, tt_rank=4, batch_size=3,
+                                          dtype=self.dtype)
+    res = [ops.frobenius_norm_squared(tt, differentiable=differentiable)
+           for differentiable in [True, False]]
+    for r in res:
+      self.assertEqual(self.dtype, r.dtype)
+    desired = ops.frobenius_norm_squared(ops.cast(tt, tf.float64))
+    with self.test_session() as sess:
+      res_val, desired_val = sess.run(
+          ([tf.cast(r, tf.float64) for r in res], desired))
+      for r in res_val:
+        self.assertAllClose(desired_val, r, rtol=1e-2)
+
+  def testGatherNd(self):
+    np.random.seed(1)
+    shape = (3, 4) * 4
+    indices = np.stack([np.random.randint(0, n, size=20) for n in shape],
+                       axis=1)
+    tt = initializers.random_tensor(shape, tt_rank=4, dtype=self.dtype)
+    res = [ops.gather_nd(tt, indices, share_prefixes=share_prefixes)
+           for share_prefixes in [False, True]]
+    for r in res:
+      self.assertEqual(self.dtype, r.dtype)
+    desired = ops.gather_nd(ops.cast(tt, tf.float64), indices)
+    with self.test_session() as sess:
+      res_val, desired_val = sess.run(
+          ([tf.cast(r, tf.float64) for r in res], desired))
+      for r in res_val:
+        self.assertAllClose(desired_val, r, rtol=1e-2, atol=1e-2)
+
+  def testTTDenseMatmul(self):
+    np.random.seed(1)
+    shape = ((2, 3, 2, 3), (3, 2, 3, 2))
+    mat = tf.cast(np.random.randn(36, 5), self.dtype)
+    tt_mat = initializers.random_matrix(shape, tt_rank=4, dtype=self.dtype)
+    res = ops.matmul(tt_mat, mat)
+    self.assertEqual(self.dtype, res.dtype)
+    desired = ops.matmul(ops.cast(tt_mat, tf.float64), tf.cast(mat, tf.float64))
+    with self.test_session() as sess:
+      res_val, desired_val = sess.run([tf.cast(res, tf.float64), desired])
+      self.assertAllClose(desired_val, res_val, rtol=1e-2, atol=1e-2)
+
+  def testDenseTTMatmul(self):
+    np.random.seed(1)
+    shape = ((2, 3, 2, 3), (3, 2, 3, 2))
+    mat = tf.cast(np.random.randn(5, 36), self.dtype)
+    tt_mat = initializers.random_matrix(shape, tt_rank=4, dtype=self.dtype)
+    res = ops.matmul(mat, tt_mat)
+    self.assertEqual(self.dtype, res.dtype)
+    desired = ops.matmul(tf.cast(mat, tf.float64), ops.cast(tt_mat, tf.float64))
+    with self.test_session() as sess:
+      res_val, desired_val = sess.run([tf.cast(res, tf.float64), desired])
+      self.assertAllClose(desired_val, res_val, rtol=1e-2, atol=1e-2)
+
+  def testFullAndBilinearForm(self):
+    shape = ((2, 3, 2, 3), (3, 2, 3, 2))
+    A = initializers.random_matrix(shape, tt_rank=3, dtype=self.dtype)
+    b = initializers.random_matrix((shape[0], None), tt_rank=4,
+                                   dtype=self.dtype)
+    c = initializers.random_matrix((shape[1], None), tt_rank=4,
+                                   dtype=self.dtype)
+    full = ops.full(A)
+    form = ops.bilinear_form(A, b, c)
+    self.assertEqual(self.dtype, full.dtype)
+    self.assertEqual(self.dtype, form.dtype)
+    A_64, b_64, c_64 = [ops.cast(t, tf.float64) for t in (A, b, c)]
+    with self.test_session() as sess:
+      res_val = sess.run([tf.cast(full, tf.float64), tf.cast(form, tf.float64),
+                          ops.full(A_64), ops.bilinear_form(A_64, b_64, c_64)])
+      self.assertAllClose(res_val[2], res_val[0], rtol=1e-2, atol=1e-2)
+      self.assertAllClose(res_val[3], res_val[1], rtol=1e-2)
+
+
+class MixedPrecisionTestFloat16(tf.test.TestCase, _MixedPrecisionTest):
+  dtype = tf.float16
+
+
+class MixedPrecisionTestBfloat16(tf.test.TestCase, _MixedPrecisionTest):
+  dtype = tf.bfloat16
+
+
 class TTTensorTestFloat32(tf.test.TestCase, _TTTensorTest):
   dtype = tf.float32
 
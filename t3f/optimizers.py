@@ -0,0 +1,238 @@
+"""Riemannian optimizers on the manifold of TT-objects of fixed TT-rank.
+
+The optimizers update `TensorTrain` variables (created by t3f.get_variable)
+in place while keeping their TT-ranks. Each step orthogonalizes the current
+point once and shares the orthogonalization between the Riemannian gradient,
+the vector transport of the optimizer state and the retraction.
+
+Example:
+  x = t3f.get_variable('x', initializer=t3f.random_tensor(shape, tt_rank=5))
+  loss = lambda x: 0.5 * t3f.frobenius_norm_squared(x - target)
+  optimizer = t3f.optimizers.MomentumOptimizer(learning_rate=0.1,
+                                               momentum=0.9)
+  step = optimizer.minimize(loss, x)
+  sess.run(tf.global_variables_initializer())
+  for _ in range(100):
+    sess.run(step)
+"""
+
+import tensorflow.compat.v1 as tf
+
+from t3f.tensor_train import TensorTrain
+from t3f.tangent_space import TangentSpace
+from t3f.tangent_space import TangentVector
+from t3f import autodiff
+from t3f import riemannian
+
+
+class RiemannianOptimizer(object):
+  """Base class of the Riemannian optimizers.
+
+  Subclasses implement `_update_direction` which takes the Riemannian
+  gradient and returns the direction and the size of the step and the new
+  values of the state of the optimizer.
+  """
+
+  def __init__(self, learning_rate, name):
+    """Creates a new optimizer.
+
+    Args:
+      learning_rate: a number or a 0-D tf.Tensor, the step size.
+      name: string, the name of the variables created by the optimizer.
+    """
+    self._learning_rate = learning_rate
+    self._name = name
+
+  def minimize(self, func, x, runtime_check=True, name=None):
+    """Returns an op that makes a step minimizing func(x).
+
+    Args:
+      func: function that takes TensorTrain object as input and outputs a
+        number (see t3f.gradients).
+      x: `TensorTrain` with tf.Variable TT-cores (e.g. created by
+        t3f.get_variable), the variable to update.
+      runtime_check: True, False or 'auto', whether to check that func is
+        invariant to the TT representation of its argument, see
+        t3f.gradients.
+      name: string, name of the Op (defaults to the name of the optimizer).
+
+    Returns:
+      tf.Operation that updates the TT-cores of x and the optimizer state.
+
+    Raises:
+      ValueError if x is not a `TensorTrain`, if its TT-ranks are unknown on
+        the graph construction stage or if they are larger than necessary
+        (i.e. the orthogonalization reduces them, use t3f.round first).
+    """
+    if not isinstance(x, TensorTrain):
+      raise ValueError('The variable should be a TensorTrain object, got '
+                       '"%s".' % x)
+    if name is None:
+      name = self._name
+    with tf.name_scope(name, values=x.tt_cores):
+      tangent_space = TangentSpace(x)
+      x_ranks = x.get_tt_ranks()
+      for ranks in [x_ranks, tangent_space.left.get_tt_ranks(),
+                    tangent_space.right.get_tt_ranks()]:
+        if not ranks.is_fully_defined():
+          raise ValueError('The TT-ranks of the variable should be known on '
+                           'the graph construction stage.')
+        if ranks != x_ranks:
+          raise ValueError('The TT-ranks %s of the variable are larger than '
+                           'necessary, use t3f.round to reduce them to %s.' %
+                           (x_ranks, ranks))
+      deltas = autodiff._gradient_deltas(func, x, tangent_space.left,
+                                         tangent_space.right, runtime_check)
+      grad = TangentVector(deltas, tangent_space)
+      direction, step_size, state_updates = self._update_direction(
+          grad, tangent_space)
+      new_x = riemannian.retract(x, direction, -step_size,
+                                 max_tt_rank=x_ranks.as_list())
+      assignments = list(zip(x.tt_cores, new_x.tt_cores)) + state_updates
+      # Compute all the new values before overwriting any of the variables.
+      with tf.control_dependencies([value for _, value in assignments]):
+        updates = [tf.assign(var, value) for var, value in assignments]
+      return tf.group(*updates)
+
+  def _update_direction(self, grad, tangent_space):
+    """Returns the step direction, the step size and the new state values.
+
+    Args:
+      grad: `TangentVector`, the Riemannian gradient.
+      tangent_space: `TangentSpace` at the current point.
+
+    Returns:
+      direction: `TangentVector`, the direction of the step.
+      step_size: a number or a 0-D tf.Tensor, the step is -step_size *
+        direction.
+      state_updates: a list of (tf.Variable, tf.Tensor) pairs, the new values
+        of the state variables.
+    """
+    raise NotImplementedError()
+
+  def _tangent_slot(self, tangent_space, name):
+    """Creates a `TensorTrain` variable for a vector of the tangent space.
+
+    The vector is stored in the TT-format (of TT-rank 2r), so that it can be
+    transported to the tangent space at the next point by the projection.
+    """
+    zeros = tangent_space.from_deltas(
+        [tf.zeros_like(core) for core in tangent_space.right.tt_cores])
+    cores = [tf.Variable(tf.zeros(core.get_shape(), dtype=core.dtype),
+                         trainable=False, name='%s_core_%d' % (name, i))
+             for i, core in enumerate(zeros.tt_cores)]
+    return TensorTrain(cores, zeros.get_raw_shape(), zeros.get_tt_ranks(),
+                       convert_to_tensors=False)
+
+  def _scalar_slot(self, initial_value, dtype, name):
+    return tf.Variable(tf.constant(initial_value, dtype=dtype),
+                       trainable=False, name=name)
+
+  def _transport(self, slot, tangent_space):
+    """Moves the vector stored in slot to the tangent space by projection."""
+    return tangent_space.project_to_vector(slot)
+
+
+class GradientDescentOptimizer(RiemannianOptimizer):
+  """Riemannian gradient descent.
+
+  x_{k+1} = R(x_k, -learning_rate * grad f(x_k)),
+  where grad f is the Riemannian gradient and R is the retraction
+  (t3f.retract).
+  """
+
+  def __init__(self, learning_rate, name='RiemannianGradientDescent'):
+    """Creates a new Riemannian gradient descent optimizer.
+
+    Args:
+      learning_rate: a number or a 0-D tf.Tensor, the step size.
+      name: string, the name of the optimizer.
+    """
+    super(GradientDescentOptimizer, self).__init__(learning_rate, name)
+
+  def _update_direction(self, grad, tangent_space):
+    return grad, self._learning_rate, []
+
+
+class MomentumOptimizer(RiemannianOptimizer):
+  """Riemannian gradient descent with momentum.
+
+  m_k = momentum * P_{x_k}(m_{k-1}) + grad f(x_k),
+  x_{k+1} = R(x_k, -learning_rate * m_k),
+  where P_{x_k} is the projection on the tangent space at x_k (the vector
+  transport of the momentum from the previous point).
+  """
+
+  def __init__(self, learning_rate, momentum,
+               name='RiemannianMomentum'):
+    """Creates a new Riemannian momentum optimizer.
+
+    Args:
+      learning_rate: a number or a 0-D tf.Tensor, the step size.
+      momentum: a number or a 0-D tf.Tensor, the momentum decay.
+      name: string, the name of the optimizer.
+    """
+    super(MomentumOptimizer, self).__init__(learning_rate, name)
+    self._momentum = momentum
+
+  def _update_direction(self, grad, tangent_space):
+    slot = self._tangent_slot(tangent_space, 'momentum')
+    velocity = self._transport(slot, tangent_space) * self._momentum + grad
+    new_slot = velocity.to_tt()
+    state_updates = list(zip(slot.tt_cores, new_slot.tt_cores))
+    return velocity, self._learning_rate, state_updates
+
+
+class AdamOptimizer(RiemannianOptimizer):
+  """Riemannian Adam.
+
+  The first moment is kept in the tangent space and transported between the
+  steps by the projection as in `MomentumOptimizer`. The coordinate-wise
+  second moment is not defined on a manifold, so (as in the Riemannian
+  Adam of Becigneul and Ganea, 2019) a single second moment of the norm of
+  the Riemannian gradient is used:
+    m_k = beta1 * P_{x_k}(m_{k-1}) + (1 - beta1) * grad f(x_k),
+    v_k = beta2 * v_{k-1} + (1 - beta2) * ||grad f(x_k)||^2,
+    x_{k+1} = R(x_k, -lr_k * m_k / (sqrt(v_k) + epsilon)),
+  where lr_k = learning_rate * sqrt(1 - beta2^k) / (1 - beta1^k).
+  """
+
+  def __init__(self, learning_rate=0.001, beta1=0.9, beta2=0.999,
+               epsilon=1e-8, name='RiemannianAdam'):
+    """Creates a new Riemannian Adam optimizer.
+
+    Args:
+      learning_rate: a number or a 0-D tf.Tensor, the step size.
+      beta1: a number, the decay of the first moment.
+      beta2: a number, the decay of the second moment.
+      epsilon: a small number for numerical stability.
+      name: string, the name of the optimizer.
+    """
+    super(AdamOptimizer, self).__init__(learning_rate, name)
+    self._beta1 = beta1
+    self._beta2 = beta2
+    self._epsilon = epsilon
+
+  def _update_direction(self, grad, tangent_space):
+    dtype = grad.dtype
+    slot = self._tangent_slot(tangent_space, 'first_moment')
+    second_moment = self._scalar_slot(0.0, dtype, 'second_moment')
+    beta1_power = self._scalar_slot(1.0, dtype, 'beta1_power')
+    beta2_power = self._scalar_slot(1.0, dtype, 'beta2_power')
+
+    first = (self._transport(slot, tangent_space) * self._beta1 +
+             grad * (1 - self._beta1))
+    second = (self._beta2 * second_moment +
+              (1 - self._beta2) * grad.frobenius_norm_squared())
+    new_beta1_power = beta1_power * self._beta1
+    new_beta2_power = beta2_power * self._beta2
+    learning_rate = tf.cast(self._learning_rate, dtype)
+    learning_rate *= tf.sqrt(1 - new_beta2_power) / (1 - new_beta1_power)
+    step_size = learning_rate / (tf.sqrt(second) + self._epsilon)
+
+    new_slot = first.to_tt()
+    state_updates = list(zip(slot.tt_cores, new_slot.tt_cores))
+    state_updates += [(second_moment, second),
+                      (beta1_power, new_beta1_power),
+                      (beta2_power, new_beta2_power)]
+    return first, step_size, state_updates
@@ -0,0 +1,90 @@
+import numpy as np
+import tensorflow.compat.v1 as tf
+
+from t3f.tensor_train import TensorTrain
+from t3f import ops
+from t3f import initializers
+from t3f import variables
+from t3f import autodiff
+from t3f import riemannian
+from t3f import optimizers
+
+
+class _OptimizersTest():
+
+  def _problem(self, sess, name):
+    shape = (3, 4, 3, 2)
+    target = initializers.random_tensor(shape, tt_rank=2, dtype=self.dtype)
+    # The target is a variable to keep the same value in all the runs.
+    target = variables.get_variable(name + '_target', initializer=target,
+                                    trainable=False)
+    init = initializers.random_tensor(shape, tt_rank=2, dtype=self.dtype)
+    x = variables.get_variable(name, initializer=init)
+
+    def loss(x):
+      return 0.5 * ops.frobenius_norm_squared(x - target, differentiable=True)
+    return x, loss
+
+  def testGradientDescentStep(self):
+    with self.test_session() as sess:
+      x, loss = self._problem(sess, 'x_sgd_step')
+      sess.run(tf.global_variables_initializer())
+      x_val = TensorTrain(sess.run(x.tt_cores), x.get_raw_shape())
+      grad = autodiff.gradients(loss, x_val, runtime_check=False)
+      desired = ops.full(riemannian.retract(x_val, grad, -0.3))
+      step = optimizers.GradientDescentOptimizer(0.3).minimize(loss, x)
+      desired_val = sess.run(desired)
+      sess.run(step)
+      self.assertAllClose(desired_val, sess.run(ops.full(x)))
+
+  def testOneOrthogonalizationPerStep(self):
+    with self.test_session() as sess:
+      x, loss = self._problem(sess, 'x_num_qr')
+      graph = tf.get_default_graph()
+      num_qr = lambda: len([op for op in graph.get_operations()
+                            if op.type == 'Qr'])
+      num_qr_before = num_qr()
+      optimizers.MomentumOptimizer(0.1, 0.9).minimize(loss, x)
+      # d - 1 QRs for each of the two orthogonalizations of x and for the
+      # retraction, the transport of the momentum reuses them.
+      self.assertEqual(3 * (x.ndims() - 1), num_qr() - num_qr_before)
+
+  def testConvergence(self):
+    with self.test_session() as sess:
+      for idx, optimizer in enumerate([
+          optimizers.GradientDescentOptimizer(0.5),
+          optimizers.MomentumOptimizer(0.3, 0.5),
+          optimizers.AdamOptimizer(0.5)]):
+        x, loss = self._problem(sess, 'x_convergence_%d' % idx)
+        step = optimizer.minimize(loss, x, runtime_check=False)
+        loss_value = loss(x)
+        sess.run(tf.global_variables_initializer())
+        initial_loss = sess.run(loss_value)
+        for _ in range(100):
+          sess.run(step)
+        self.assertLess(sess.run(loss_value), 1e-2 * initial_loss)
+        self.assertEqual([1, 2, 2, 2, 1], x.get_tt_ranks().as_list())
+
+  def testErrors(self):
+    with self.test_session() as sess:
+      # The orthogonalization reduces the first TT-rank to 2.
+      init = initializers.random_tensor((2, 3, 4), tt_rank=3,
+                                        dtype=self.dtype)
+      x = variables.get_variable('x_errors', initializer=init)
+      loss = lambda x: ops.frobenius_norm_squared(x, differentiable=True)
+      with self.assertRaises(ValueError):
+        optimizers.GradientDescentOptimizer(0.1).minimize(loss, x)
+      with self.assertRaises(ValueError):
+        optimizers.GradientDescentOptimizer(0.1).minimize(loss, np.ones(3))
+
+
+class OptimizersTestFloat32(tf.test.TestCase, _OptimizersTest):
+  dtype = tf.float32
+
+
+class OptimizersTestFloat64(tf.test.TestCase, _OptimizersTest):
+  dtype = tf.float64
+
+
+if __name__ == "__main__":
+  tf.test.main()
@@ -4,9 +4,10 @@ from t3f.tensor_train import TensorTrain
 from t3f.tensor_train_batch import TensorTrainBatch
 from t3f import shapes
 from t3f import decompositions
+from t3f import utils
 
 
-def project_sum(what, where, weights=None):
+def project_sum(what, where, weights=None, left=None, right=None):
   """Project sum of `what` TTs on the tangent space of `where` TT.
 
   project_sum(what, x) = P_x(what)
@@ -23,6 +24,10 @@ def project_sum(what, where, weights=None):
       projection of the sum of elements in the batch.
     where: TensorTrain, TT-tensor or TT-matrix on which tangent space to project
     weights: python list or tf.Tensor of numbers or None, weights of the sum
+    left: t3f.orthogonalize_tt_cores(where). If you have it already computed,
+      you may pass it as argument to avoid recomputing.
+    right: t3f.orthogonalize_tt_cores(left, left_to_right=False). If you have
+      it already computed, you may pass it as argument to avoid recomputing.
 
   Returns:
      a TensorTrain with the TT-ranks equal 2 * tangent_space_tens.get_tt_ranks()
@@ -61,13 +66,17 @@ def project_sum(what, where, weights=None):
                      (where.dtype,
                       what.dtype))
 
-  left_tangent_space_tens = decompositions.orthogonalize_tt_cores(
-    where)
-  right_tangent_space_tens = decompositions.orthogonalize_tt_cores(
-    left_tangent_space_tens, left_to_right=False)
+  if left is None:
+    left = decompositions.orthogonalize_tt_cores(where)
+  if right is None:
+    right = decompositions.orthogonalize_tt_cores(left, left_to_right=False)
+  left_tangent_space_tens = left
+  right_tangent_space_tens = right
 
   ndims = where.ndims()
   dtype = where.dtype
+  # 16-bit TT-cores are accumulated in float32, see utils.accumulation_dtype.
+  acc_dtype = utils.accumulation_dtype(dtype)
   raw_shape = shapes.lazy_raw_shape(where)
   batch_size = shapes.lazy_batch_size(what)
   right_tangent_tt_ranks = shapes.lazy_tt_ranks(right_tangent_space_tens)
@@ -92,30 +101,31 @@ def project_sum(what, where, weights=None):
   # rhs[core_idx] is of size
   #   batch_size x tensor_tt_ranks[core_idx] x tangent_tt_ranks[core_idx]
   rhs = [None] * (ndims + 1)
-  rhs[ndims] = tf.ones((batch_size, 1, 1), dtype=dtype)
+  rhs[ndims] = tf.ones((batch_size, 1, 1), dtype=acc_dtype)
   for core_idx in range(ndims - 1, 0, -1):
-    tens_core = what.tt_cores[core_idx]
-    right_tang_core = right_tangent_space_tens.tt_cores[core_idx]
+    tens_core = utils.upcast(what.tt_cores[core_idx])
+    right_tang_core = utils.upcast(
+        right_tangent_space_tens.tt_cores[core_idx])
     einsum_str = 'sa{0}b,sbd,c{0}d->sac'.format(mode_str)
-    rhs[core_idx] = tf.einsum(einsum_str, tens_core, rhs[core_idx + 1],
-                              right_tang_core)
+    rhs[core_idx] = utils.einsum(einsum_str, tens_core, rhs[core_idx + 1],
+                                 right_tang_core)
 
   # Prepare lhs vectors.
   # lhs[core_idx] is of size
   #   batch_size x tangent_tt_ranks[core_idx] x tensor_tt_ranks[core_idx]
   lhs = [None] * (ndims + 1)
-  lhs[0] = tf.ones((batch_size, 1, 1), dtype=dtype)
+  lhs[0] = tf.ones((batch_size, 1, 1), dtype=acc_dtype)
   for core_idx in range(ndims - 1):
-    tens_core = what.tt_cores[core_idx]
-    left_tang_core = left_tangent_space_tens.tt_cores[core_idx]
+    tens_core = utils.upcast(what.tt_cores[core_idx])
+    left_tang_core = utils.upcast(left_tangent_space_tens.tt_cores[core_idx])
     einsum_str = 'sab,a{0}c,sb{0}d->scd'.format(mode_str)
-    lhs[core_idx + 1] = tf.einsum(einsum_str, lhs[core_idx], left_tang_core,
-                                  tens_core)
+    lhs[core_idx + 1] = utils.einsum(einsum_str, lhs[core_idx],
+                                     left_tang_core, tens_core)
 
   # Left to right sweep.
   res_cores_list = []
   for core_idx in range(ndims):
-    tens_core = what.tt_cores[core_idx]
+    tens_core = utils.upcast(what.tt_cores[core_idx])
     left_tang_core = left_tangent_space_tens.tt_cores[core_idx]
     right_tang_core = right_tangent_space_tens.tt_cores[core_idx]
 
@@ -123,7 +133,8 @@ def project_sum(what, where, weights=None):
       einsum_str = 'sab,sb{0}c->sa{0}c'.format(mode_str)
       proj_core = tf.einsum(einsum_str, lhs[core_idx], tens_core)
       einsum_str = 'a{0}b,sbc->sa{0}c'.format(mode_str)
-      proj_core -= tf.einsum(einsum_str, left_tang_core, lhs[core_idx + 1])
+      proj_core -= tf.einsum(einsum_str, utils.upcast(left_tang_core),
+                             lhs[core_idx + 1])
       if weights is None:
         einsum_str = 'sa{0}b,sbc->a{0}c'.format(mode_str)
         proj_core = tf.einsum(einsum_str, proj_core, rhs[core_idx + 1])
@@ -131,7 +142,8 @@ def project_sum(what, where, weights=None):
         einsum_str = 'sa{0}b,sbc->sa{0}c'.format(mode_str, output_batch_str)
         proj_core_s = tf.einsum(einsum_str, proj_core, rhs[core_idx + 1])
         einsum_str = 's{1},sa{0}c->{1}a{0}c'.format(mode_str, output_batch_str)
-        proj_core = tf.einsum(einsum_str, weights, proj_core_s)
+        proj_core = tf.einsum(einsum_str, utils.upcast(weights),
+                              proj_core_s)
 
     if core_idx == ndims - 1:
       if weights is None:
@@ -141,8 +153,10 @@ def project_sum(what, where, weights=None):
         einsum_str = 'sab,sb{0}c->sa{0}c'.format(mode_str, output_batch_str)
         proj_core_s = tf.einsum(einsum_str, lhs[core_idx], tens_core)
         einsum_str = 's{1},sa{0}c->{1}a{0}c'.format(mode_str, output_batch_str)
-        proj_core = tf.einsum(einsum_str, weights, proj_core_s)
+        proj_core = tf.einsum(einsum_str, utils.upcast(weights),
+                              proj_core_s)
 
+    proj_core = tf.cast(proj_core, dtype)
     if output_is_batch:
       # Add batch dimension of size output_batch_size to left_tang_core and
       # right_tang_core
@@ -196,7 +210,7 @@ def project_sum(what, where, weights=None):
   return res
 
 
-def project(what, where):
+def project(what, where, left=None, right=None):
   """Project `what` TTs on the tangent space of `where` TT.
 
   project(what, x) = P_x(what)
@@ -211,6 +225,10 @@ def project(what, where):
     what: TensorTrain or TensorTrainBatch. In the case of batch returns
       batch with projection of each individual tensor.
     where: TensorTrain, TT-tensor or TT-matrix on which tangent space to project
+    left: t3f.orthogonalize_tt_cores(where). If you have it already computed,
+      you may pass it as argument to avoid recomputing.
+    right: t3f.orthogonalize_tt_cores(left, left_to_right=False). If you have
+      it already computed, you may pass it as argument to avoid recomputing.
 
   Returns:
      a TensorTrain with the TT-ranks equal 2 * tangent_space_tens.get_tt_ranks()
@@ -243,10 +261,12 @@ def project(what, where):
                      (where.dtype,
                       what.dtype))
 
-  left_tangent_space_tens = decompositions.orthogonalize_tt_cores(
-    where)
-  right_tangent_space_tens = decompositions.orthogonalize_tt_cores(
-    left_tangent_space_tens, left_to_right=False)
+  if left is None:
+    left = decompositions.orthogonalize_tt_cores(where)
+  if right is None:
+    right = decompositions.orthogonalize_tt_cores(left, left_to_right=False)
+  left_tangent_space_tens = left
+  right_tangent_space_tens = right
 
   ndims = where.ndims()
   dtype = where.dtype
@@ -254,66 +274,21 @@ def project(what, where):
   right_tangent_tt_ranks = shapes.lazy_tt_ranks(right_tangent_space_tens)
   left_tangent_tt_ranks = shapes.lazy_tt_ranks(left_tangent_space_tens)
 
-  # For einsum notation.
-  mode_str = 'ij' if where.is_tt_matrix() else 'i'
   right_rank_dim = what.right_tt_rank_dim
   left_rank_dim = what.left_tt_rank_dim
   output_is_batch = isinstance(what, TensorTrainBatch)
   if output_is_batch:
     output_batch_size = what.batch_size
 
-  # Always work with batch of TT objects for simplicity.
-  what = shapes.expand_batch_dim(what)
-  batch_size = shapes.lazy_batch_size(what)
-
-  # Prepare rhs vectors.
-  # rhs[core_idx] is of size
-  #   batch_size x tensor_tt_ranks[core_idx] x tangent_tt_ranks[core_idx]
-  rhs = [None] * (ndims + 1)
-  rhs[ndims] = tf.ones((batch_size, 1, 1), dtype=dtype)
-  for core_idx in range(ndims - 1, 0, -1):
-    tens_core = what.tt_cores[core_idx]
-    right_tang_core = right_tangent_space_tens.tt_cores[core_idx]
-    einsum_str = 'sa{0}b,sbd,c{0}d->sac'.format(mode_str)
-    rhs[core_idx] = tf.einsum(einsum_str, tens_core, rhs[core_idx + 1],
-                              right_tang_core)
-
-  # Prepare lhs vectors.
-  # lhs[core_idx] is of size
-  #   batch_size x tangent_tt_ranks[core_idx] x tensor_tt_ranks[core_idx]
-  lhs = [None] * (ndims + 1)
-  lhs[0] = tf.ones((batch_size, 1, 1), dtype=dtype)
-  for core_idx in range(ndims - 1):
-    tens_core = what.tt_cores[core_idx]
-    left_tang_core = left_tangent_space_tens.tt_cores[core_idx]
-    einsum_str = 'sab,a{0}c,sb{0}d->scd'.format(mode_str)
-    lhs[core_idx + 1] = tf.einsum(einsum_str, lhs[core_idx], left_tang_core,
-                                  tens_core)
+  deltas = _project_deltas(what, left_tangent_space_tens,
+                           right_tangent_space_tens)
 
   # Left to right sweep.
   res_cores_list = []
   for core_idx in range(ndims):
-    tens_core = what.tt_cores[core_idx]
     left_tang_core = left_tangent_space_tens.tt_cores[core_idx]
     right_tang_core = right_tangent_space_tens.tt_cores[core_idx]
-
-    if core_idx < ndims - 1:
-      einsum_str = 'sab,sb{0}c->sa{0}c'.format(mode_str)
-      proj_core = tf.einsum(einsum_str, lhs[core_idx], tens_core)
-      einsum_str = 'a{0}b,sbc->sa{0}c'.format(mode_str)
-      proj_core -= tf.einsum(einsum_str, left_tang_core, lhs[core_idx + 1])
-      if output_is_batch:
-        einsum_str = 'sa{0}b,sbc->sa{0}c'.format(mode_str)
-      else:
-        einsum_str = 'sa{0}b,sbc->a{0}c'.format(mode_str)
-      proj_core = tf.einsum(einsum_str, proj_core, rhs[core_idx + 1])
-
-    if core_idx == ndims - 1:
-      if output_is_batch:
-        einsum_str = 'sab,sb{0}c->sa{0}c'.format(mode_str)
-      else:
-        einsum_str = 'sab,sb{0}c->a{0}c'.format(mode_str)
-      proj_core = tf.einsum(einsum_str, lhs[core_idx], tens_core)
+    proj_core = deltas[core_idx]
 
     if output_is_batch:
       # Add batch dimension of size output_batch_size to left_tang_core and
@@ -368,7 +343,86 @@ def project(what, where):
   return res
 
 
-def project_matmul(what, where, matrix):
+def _project_deltas(what, left, right):
+  """Computes the deltas of the projection of `what` on a tangent space.
+
+  The projection equals
+    dP1 V2 ... Vd + U1 dP2 V3 ... Vd + ... + U1 ... Ud-1 dPd,
+  and the deltas [dP1, ..., dPd] obey the gauge conditions.
+
+  Args:
+    what: TensorTrain or TensorTrainBatch to project.
+    left: t3f.orthogonalize_tt_cores(where), the TT-cores U1, ..., Ud-1.
+    right: t3f.orthogonalize_tt_cores(left, left_to_right=False), the TT-cores
+      V2, ..., Vd.
+
+  Returns:
+    A list of d delta-cores (tf.Tensors), with a leading batch dimension if
+    `what` is a TensorTrainBatch.
+  """
+  ndims = left.ndims()
+  dtype = left.dtype
+  # 16-bit TT-cores are accumulated in float32, see utils.accumulation_dtype.
+  acc_dtype = utils.accumulation_dtype(dtype)
+
+  # For einsum notation.
+  mode_str = 'ij' if left.is_tt_matrix() else 'i'
+  output_is_batch = isinstance(what, TensorTrainBatch)
+
+  # Always work with batch of TT objects for simplicity.
+  what = shapes.expand_batch_dim(what)
+  batch_size = shapes.lazy_batch_size(what)
+
+  # Prepare rhs vectors.
+  # rhs[core_idx] is of size
+  #   batch_size x tensor_tt_ranks[core_idx] x tangent_tt_ranks[core_idx]
+  rhs = [None] * (ndims + 1)
+  rhs[ndims] = tf.ones((batch_size, 1, 1), dtype=acc_dtype)
+  for core_idx in range(ndims - 1, 0, -1):
+    tens_core = utils.upcast(what.tt_cores[core_idx])
+    right_tang_core = utils.upcast(right.tt_cores[core_idx])
+    einsum_str = 'sa{0}b,sbd,c{0}d->sac'.format(mode_str)
+    rhs[core_idx] = utils.einsum(einsum_str, tens_core, rhs[core_idx + 1],
+                                 right_tang_core)
+
+  # Prepare lhs vectors.
+  # lhs[core_idx] is of size
+  #   batch_size x tangent_tt_ranks[core_idx] x tensor_tt_ranks[core_idx]
+  lhs = [None] * (ndims + 1)
+  lhs[0] = tf.ones((batch_size, 1, 1), dtype=acc_dtype)
+  for core_idx in range(ndims - 1):
+    tens_core = utils.upcast(what.tt_cores[core_idx])
+    left_tang_core = utils.upcast(left.tt_cores[core_idx])
+    einsum_str = 'sab,a{0}c,sb{0}d->scd'.format(mode_str)
+    lhs[core_idx + 1] = utils.einsum(einsum_str, lhs[core_idx],
+                                     left_tang_core, tens_core)
+
+  deltas = []
+  for core_idx in range(ndims):
+    tens_core = utils.upcast(what.tt_cores[core_idx])
+    left_tang_core = utils.upcast(left.tt_cores[core_idx])
+
+    if core_idx < ndims - 1:
+      einsum_str = 'sab,sb{0}c->sa{0}c'.format(mode_str)
+      proj_core = tf.einsum(einsum_str, lhs[core_idx], tens_core)
+      einsum_str = 'a{0}b,sbc->sa{0}c'.format(mode_str)
+      proj_core -= tf.einsum(einsum_str, left_tang_core, lhs[core_idx + 1])
+      if output_is_batch:
+        einsum_str = 'sa{0}b,sbc->sa{0}c'.format(mode_str)
+      else:
+        einsum_str = 'sa{0}b,sbc->a{0}c'.format(mode_str)
+      proj_core = tf.einsum(einsum_str, proj_core, rhs[core_idx + 1])
+    else:
+      if output_is_batch:
+        einsum_str = 'sab,sb{0}c->sa{0}c'.format(mode_str)
+      else:
+        einsum_str = 'sab,sb{0}c->a{0}c'.format(mode_str)
+      proj_core = tf.einsum(einsum_str, lhs[core_idx], tens_core)
+    deltas.append(tf.cast(proj_core, dtype))
+  return deltas
+
+
+def project_matmul(what, where, matrix, left=None, right=None):
   """Project `matrix` * `what` TTs on the tangent space of `where` TT.
 
   project(what, x) = P_x(what)
@@ -384,6 +438,10 @@ def project_matmul(what, where, matrix):
       batch with projection of each individual tensor.
     where: TensorTrain, TT-tensor or TT-matrix on which tangent space to project
     matrix: TensorTrain, TT-matrix to multiply by what
+    left: t3f.orthogonalize_tt_cores(where). If you have it already computed,
+      you may pass it as argument to avoid recomputing.
+    right: t3f.orthogonalize_tt_cores(left, left_to_right=False). If you have
+      it already computed, you may pass it as argument to avoid recomputing.
 
   Returns:
      a TensorTrain with the TT-ranks equal 2 * tangent_space_tens.get_tt_ranks()
@@ -415,13 +473,17 @@ def project_matmul(what, where, matrix):
                      (where.dtype,
                       what.dtype))
 
-  left_tangent_space_tens = decompositions.orthogonalize_tt_cores(
-    where)
-  right_tangent_space_tens = decompositions.orthogonalize_tt_cores(
-    left_tangent_space_tens, left_to_right=False)
+  if left is None:
+    left = decompositions.orthogonalize_tt_cores(where)
+  if right is None:
+    right = decompositions.orthogonalize_tt_cores(left, left_to_right=False)
+  left_tangent_space_tens = left
+  right_tangent_space_tens = right
 
   ndims = where.ndims()
   dtype = where.dtype
+  # 16-bit TT-cores are accumulated in float32, see utils.accumulation_dtype.
+  acc_dtype = utils.accumulation_dtype(dtype)
   raw_shape = shapes.lazy_raw_shape(where)
   batch_size = shapes.lazy_batch_size(what)
   right_tangent_tt_ranks = shapes.lazy_tt_ranks(right_tangent_space_tens)
@@ -441,38 +503,39 @@ def project_matmul(what, where, matrix):
   # rhs[core_idx] is of size
   #   batch_size x tensor_tt_ranks[core_idx] x matrix_tt_ranks[core_idx] x tangent_tt_ranks[core_idx]
   rhs = [None] * (ndims + 1)
-  rhs[ndims] = tf.ones((batch_size, 1, 1, 1), dtype=dtype)
+  rhs[ndims] = tf.ones((batch_size, 1, 1, 1), dtype=acc_dtype)
   for core_idx in range(ndims - 1, 0, -1):
-    tens_core = what.tt_cores[core_idx]
-    right_tang_core = right_tangent_space_tens.tt_cores[core_idx]
-    matrix_core = matrix.tt_cores[core_idx]
-    rhs[core_idx] = tf.einsum('bije,cikf,sdef,sajkd->sabc', matrix_core,
-                              right_tang_core, rhs[core_idx + 1], tens_core)
+    tens_core = utils.upcast(what.tt_cores[core_idx])
+    right_tang_core = utils.upcast(
+        right_tangent_space_tens.tt_cores[core_idx])
+    matrix_core = utils.upcast(matrix.tt_cores[core_idx])
+    rhs[core_idx] = utils.einsum('bije,cikf,sdef,sajkd->sabc', matrix_core,
+                                 right_tang_core, rhs[core_idx + 1], tens_core)
   # Prepare lhs vectors.
   # lhs[core_idx] is of size
   #   batch_size x tangent_tt_ranks[core_idx] x matrix_tt_ranks[core_idx] x tensor_tt_ranks[core_idx]
   lhs = [None] * (ndims + 1)
-  lhs[0] = tf.ones((batch_size, 1, 1, 1), dtype=dtype)
+  lhs[0] = tf.ones((batch_size, 1, 1, 1), dtype=acc_dtype)
   for core_idx in range(ndims - 1):
-    tens_core = what.tt_cores[core_idx]
-    left_tang_core = left_tangent_space_tens.tt_cores[core_idx]
-    matrix_core = matrix.tt_cores[core_idx]
-    # TODO: brutforce order of indices in lhs??
-    lhs[core_idx + 1] = tf.einsum('bije,aikd,sabc,scjkf->sdef', matrix_core,
-                                  left_tang_core, lhs[core_idx], tens_core)
+    tens_core = utils.upcast(what.tt_cores[core_idx])
+    left_tang_core = utils.upcast(left_tangent_space_tens.tt_cores[core_idx])
+    matrix_core = utils.upcast(matrix.tt_cores[core_idx])
+    lhs[core_idx + 1] = utils.einsum('bije,aikd,sabc,scjkf->sdef',
+                                     matrix_core, left_tang_core, lhs[core_idx],
+                                     tens_core)
 
   # Left to right sweep.
   res_cores_list = []
   for core_idx in range(ndims):
-    tens_core = what.tt_cores[core_idx]
-    matrix_core = matrix.tt_cores[core_idx]
+    tens_core = utils.upcast(what.tt_cores[core_idx])
+    matrix_core = utils.upcast(matrix.tt_cores[core_idx])
     left_tang_core = left_tangent_space_tens.tt_cores[core_idx]
     right_tang_core = right_tangent_space_tens.tt_cores[core_idx]
 
     if core_idx < ndims - 1:
-      proj_core = tf.einsum('scjke,sabc,bijd->saikde', tens_core,
-                            lhs[core_idx], matrix_core)
-      proj_core -= tf.einsum('aikb,sbcd->saikcd', left_tang_core,
+      proj_core = utils.einsum('scjke,sabc,bijd->saikde', tens_core,
+                               lhs[core_idx], matrix_core)
+      proj_core -= tf.einsum('aikb,sbcd->saikcd', utils.upcast(left_tang_core),
                              lhs[core_idx + 1])
       proj_core = tf.einsum('saikcb,sbcd->saikd', proj_core, rhs[core_idx + 1])
 
@@ -480,9 +543,10 @@ def project_matmul(what, where, matrix):
       # d and e dimensions take 1 value, since its the last rank.
       # To make the result shape (?, ?, ?, 1), we are summing d and leaving e,
       # but we could have done the opposite -- sum e and leave d.
-      proj_core = tf.einsum('sabc,bijd,scjke->saike', lhs[core_idx], matrix_core,
-                            tens_core)
+      proj_core = utils.einsum('sabc,bijd,scjke->saike', lhs[core_idx],
+                               matrix_core, tens_core)
 
+    proj_core = tf.cast(proj_core, dtype)
     if output_is_batch:
       # Add batch dimension of size output_batch_size to left_tang_core and
       # right_tang_core
@@ -579,53 +643,54 @@ def pairwise_flat_inner_projected(projected_tt_vectors_1,
 
   ndims = projected_tt_vectors_1.ndims()
   tt_ranks = shapes.lazy_tt_ranks(projected_tt_vectors_1)
+  # 16-bit TT-cores are accumulated in float32, see utils.accumulation_dtype.
 
   if projected_tt_vectors_1.is_tt_matrix():
     right_size = tt_ranks[1] // 2
-    curr_core_1 = projected_tt_vectors_1.tt_cores[0]
-    curr_core_2 = projected_tt_vectors_2.tt_cores[0]
+    curr_core_1 = utils.upcast(projected_tt_vectors_1.tt_cores[0])
+    curr_core_2 = utils.upcast(projected_tt_vectors_2.tt_cores[0])
     curr_du_1 = curr_core_1[:, :, :, :, :right_size]
     curr_du_2 = curr_core_2[:, :, :, :, :right_size]
     res = tf.einsum('paijb,qaijb->pq', curr_du_1, curr_du_2)
     for core_idx in range(1, ndims):
       left_size = tt_ranks[core_idx] // 2
       right_size = tt_ranks[core_idx + 1] // 2
-      curr_core_1 = projected_tt_vectors_1.tt_cores[core_idx]
-      curr_core_2 = projected_tt_vectors_2.tt_cores[core_idx]
+      curr_core_1 = utils.upcast(projected_tt_vectors_1.tt_cores[core_idx])
+      curr_core_2 = utils.upcast(projected_tt_vectors_2.tt_cores[core_idx])
       curr_du_1 = curr_core_1[:, left_size:, :, :, :right_size]
       curr_du_2 = curr_core_2[:, left_size:, :, :, :right_size]
       res += tf.einsum('paijb,qaijb->pq', curr_du_1, curr_du_2)
 
     left_size = tt_ranks[-2] // 2
-    curr_core_1 = projected_tt_vectors_1.tt_cores[-1]
-    curr_core_2 = projected_tt_vectors_2.tt_cores[-1]
+    curr_core_1 = utils.upcast(projected_tt_vectors_1.tt_cores[-1])
+    curr_core_2 = utils.upcast(projected_tt_vectors_2.tt_cores[-1])
     curr_du_1 = curr_core_1[:, left_size:, :, :, :]
     curr_du_2 = curr_core_2[:, left_size:, :, :, :]
     res += tf.einsum('paijb,qaijb->pq', curr_du_1, curr_du_2)
   else:
     # Working with TT-tensor, not TT-matrix.
     right_size = tt_ranks[1] // 2
-    curr_core_1 = projected_tt_vectors_1.tt_cores[0]
-    curr_core_2 = projected_tt_vectors_2.tt_cores[0]
+    curr_core_1 = utils.upcast(projected_tt_vectors_1.tt_cores[0])
+    curr_core_2 = utils.upcast(projected_tt_vectors_2.tt_cores[0])
     curr_du_1 = curr_core_1[:, :, :, :right_size]
     curr_du_2 = curr_core_2[:, :, :, :right_size]
     res = tf.einsum('paib,qaib->pq', curr_du_1, curr_du_2)
     for core_idx in range(1, ndims):
       left_size = tt_ranks[core_idx] // 2
       right_size = tt_ranks[core_idx + 1] // 2
-      curr_core_1 = projected_tt_vectors_1.tt_cores[core_idx]
-      curr_core_2 = projected_tt_vectors_2.tt_cores[core_idx]
+      curr_core_1 = utils.upcast(projected_tt_vectors_1.tt_cores[core_idx])
+      curr_core_2 = utils.upcast(projected_tt_vectors_2.tt_cores[core_idx])
       curr_du_1 = curr_core_1[:, left_size:, :, :right_size]
       curr_du_2 = curr_core_2[:, left_size:, :, :right_size]
       res += tf.einsum('paib,qaib->pq', curr_du_1, curr_du_2)
 
     left_size = tt_ranks[-2] // 2
-    curr_core_1 = projected_tt_vectors_1.tt_cores[-1]
-    curr_core_2 = projected_tt_vectors_2.tt_cores[-1]
+    curr_core_1 = utils.upcast(projected_tt_vectors_1.tt_cores[-1])
+    curr_core_2 = utils.upcast(projected_tt_vectors_2.tt_cores[-1])
     curr_du_1 = curr_core_1[:, left_size:, :, :]
     curr_du_2 = curr_core_2[:, left_size:, :, :]
     res += tf.einsum('paib,qaib->pq', curr_du_1, curr_du_2)
-  return res
+  return tf.cast(res, projected_tt_vectors_1.dtype)
 
 
 def add_n_projected(tt_objects, coef=None):
@@ -751,7 +816,8 @@ def add_n_projected(tt_objects, coef=None):
   return res
 
 
-def tangent_space_to_deltas(tt, name='t3f_tangent_space_to_deltas'):
+def tangent_space_to_deltas(tt, left=None, right=None,
+                            name='t3f_tangent_space_to_deltas'):
   """Convert an element of the tangent space to deltas representation.
 
   Tangent space elements (outputs of t3f.project) look like:
@@ -763,6 +829,10 @@ def tangent_space_to_deltas(tt, name='t3f_tangent_space_to_deltas'):
   Args:
       tt: `TensorTrain` or `TensorTrainBatch` that is a result of t3f.project,
         t3f.project_matmul, or other similar functions.
+      left: t3f.orthogonalize_tt_cores(tt.projection_on). If you have it
+        already computed, you may pass it as argument to avoid recomputing.
+      right: t3f.orthogonalize_tt_cores(left, left_to_right=False). If you have
+        it already computed, you may pass it as argument to avoid recomputing.
       name: string, name of the Op.
 
   Returns:
@@ -775,24 +845,37 @@ def tangent_space_to_deltas(tt, name='t3f_tangent_space_to_deltas'):
   left_tt_rank_dim = tt.left_tt_rank_dim
   right_tt_rank_dim = tt.right_tt_rank_dim
   deltas = [None] * num_dims
+  # The TT-cores of tt are [[V_k, 0], [dP_k, U_k]], so the sizes of the
+  # blocks are given by the TT-ranks of the orthogonalized point (which are
+  # not necessarily equal if the orthogonalization reduced some TT-ranks).
+  if left is None:
+    left = decompositions.orthogonalize_tt_cores(tt.projection_on)
+  if right is None:
+    right = decompositions.orthogonalize_tt_cores(left, left_to_right=False)
+  left_tt_ranks = shapes.lazy_tt_ranks(left)
+  right_tt_ranks = shapes.lazy_tt_ranks(right)
   tt_ranks = shapes.lazy_tt_ranks(tt)
-  for i in range(1, num_dims - 1):
-    if int(tt_ranks[i] / 2) != tt_ranks[i] / 2:
-      raise ValueError('tt argument is supposed to be a projection, but its '
-                       'ranks are not even.')
+  for i in range(1, num_dims):
+    try:
+      if tt_ranks[i] != left_tt_ranks[i] + right_tt_ranks[i]:
+        raise ValueError('tt argument is supposed to be a projection, but its '
+                         'TT-ranks don\'t match the TT-ranks of the point it '
+                         'is projected on.')
+    except TypeError:
+      # Some of the ranks are undefined on the compilation stage.
+      pass
   with tf.name_scope(name, values=tt.tt_cores):
     for i in range(1, num_dims - 1):
-      r1, r2 = tt_ranks[i], tt_ranks[i + 1]
       curr_core = tt.tt_cores[i]
       slc = [slice(None)] * len(curr_core.shape)
-      slc[left_tt_rank_dim] = slice(int(r1 / 2), None)
-      slc[right_tt_rank_dim] = slice(0, int(r2 / 2))
+      slc[left_tt_rank_dim] = slice(right_tt_ranks[i], None)
+      slc[right_tt_rank_dim] = slice(0, right_tt_ranks[i + 1])
       deltas[i] = curr_core[slc]
     slc = [slice(None)] * len(tt.tt_cores[0].shape)
-    slc[right_tt_rank_dim] = slice(0, int(tt_ranks[1] / 2))
+    slc[right_tt_rank_dim] = slice(0, right_tt_ranks[1])
     deltas[0] = tt.tt_cores[0][slc]
     slc = [slice(None)] * len(tt.tt_cores[0].shape)
-    slc[left_tt_rank_dim] = slice(int(tt_ranks[-2] / 2), None)
+    slc[left_tt_rank_dim] = slice(right_tt_ranks[-2], None)
     deltas[num_dims - 1] = tt.tt_cores[num_dims - 1][slc]
   return deltas
 
@@ -812,7 +895,9 @@ def deltas_to_tangent_space(deltas, tt, left=None, right=None,
       deltas: a list of deltas (essentially TT-cores) obeying the gauge
         conditions.
       tt: `TensorTrain` object on which the tangent space tensor represented by
-        delta is projected.
+        delta is projected, or `TensorTrainBatch` of points (then the deltas
+        have a leading batch dimension and the i-th result belongs to the
+        tangent space at the i-th point).
       left: t3f.orthogonilize_tt_cores(tt). If you have it already compute, you
         may pass it as argument to avoid recomputing.
       right: t3f.orthogonilize_tt_cores(left, left_to_right=False). If you have
@@ -821,12 +906,12 @@ def deltas_to_tangent_space(deltas, tt, left=None, right=None,
 
   Returns:
       `TensorTrain` object constructed from deltas, that is from the tangent
-        space at point `tt`.
+        space at point `tt` (`TensorTrainBatch` for a batch of deltas or
+        points).
   """
   cores = []
-  dtype = tt.dtype
+  dtype = tt.dtype.base_dtype
   num_dims = tt.ndims()
-  # TODO: add cache instead of mannually pasisng precomputed stuff?
   input_tensors = list(tt.tt_cores) + list(deltas)
   if left is not None:
     input_tensors += list(left.tt_cores)
@@ -838,7 +923,7 @@ def deltas_to_tangent_space(deltas, tt, left=None, right=None,
     if right is None:
       right = decompositions.orthogonalize_tt_cores(left, left_to_right=False)
     left_tangent_tt_ranks = shapes.lazy_tt_ranks(left)
-    right_tangent_tt_ranks = shapes.lazy_tt_ranks(left)
+    right_tangent_tt_ranks = shapes.lazy_tt_ranks(right)
     raw_shape = shapes.lazy_raw_shape(left)
     right_rank_dim = left.right_tt_rank_dim
     left_rank_dim = left.left_tt_rank_dim
@@ -847,6 +932,9 @@ def deltas_to_tangent_space(deltas, tt, left=None, right=None,
       right_rank_dim += 1
       left_rank_dim += 1
       batch_size = deltas[0].shape.as_list()[0]
+    points_are_batch = isinstance(tt, TensorTrainBatch)
+    if points_are_batch:
+      batch_size = shapes.lazy_batch_size(tt)
     for i in range(num_dims):
       left_tt_core = left.tt_cores[i]
       right_tt_core = right.tt_cores[i]
@@ -872,7 +960,7 @@ def deltas_to_tangent_space(deltas, tt, left=None, right=None,
         else:
           mode_size_n = raw_shape[0][i]
           shape = [rank_1, mode_size_n, rank_2]
-        if is_batch_case:
+        if is_batch_case or points_are_batch:
           shape = [batch_size] + shape
         zeros = tf.zeros(shape, dtype=dtype)
         upper = tf.concat((right_tt_core, zeros), axis=right_rank_dim)
@@ -881,7 +969,182 @@ def deltas_to_tangent_space(deltas, tt, left=None, right=None,
       cores.append(tangent_core)
     if is_batch_case:
       tangent = TensorTrainBatch(cores, batch_size=batch_size)
+    elif points_are_batch:
+      tangent = TensorTrainBatch(cores, batch_size=tt.batch_size)
     else:
       tangent = TensorTrain(cores)
     tangent.projection_on = tt
     return tangent
+
+
+def retract(x, xi, t=1.0, max_tt_rank=None, epsilon=None, name='t3f_retract'):
+  """Retraction of the point x + t * xi back to the manifold of TT-rank r.
+
+  Equals t3f.round(x + t * xi, max_tt_rank, epsilon) but exploits the
+  structure of the tangent space elements: their TT-cores are
+    [[V_k, 0], [dP_k, U_k]]
+  with orthogonal U_k and V_k and the deltas dP_k obeying the gauge
+  conditions. So the left to right orthogonalization of the rounding only
+  needs QR decompositions of the r-wide [R V_k; dP_k] blocks instead of the
+  2r-wide TT-cores, and the orthogonalization of x itself is reused from
+  the tangent space if xi is a `TangentVector` (see t3f.TangentSpace).
+
+  Example:
+    # A Riemannian gradient descent step.
+    riemannian_grad = t3f.project(grad, x)
+    x = t3f.riemannian.retract(x, riemannian_grad, -learning_rate)
+
+  Args:
+    x: `TensorTrain`, the point of the manifold.
+    xi: `TensorTrain` which is a projection on the tangent space at `x`
+      (e.g. the result of t3f.project(what, x)) or `TangentVector` of
+      `TangentSpace(x)`.
+    t: a number or a 0-D tf.Tensor, the step size.
+    max_tt_rank: a number, a list of d+1 numbers or None. None means the
+      TT-ranks of `x`, i.e. the result stays on the same manifold.
+    epsilon: a floating point number or None, the desired relative accuracy,
+      see t3f.round.
+    name: string, name of the Op.
+
+  Returns:
+    `TensorTrain` object.
+
+  Raises:
+    ValueError if `xi` is not a tangent vector at `x`, if `xi` is a batch or
+      if max_tt_rank is not provided and the TT-ranks of `x` are unknown on
+      the graph construction stage.
+
+  Complexity:
+    O(d r^3 n) with a constant smaller than the one of t3f.round of the
+    rank 2r sum x + t * xi.
+  """
+  # TODO: ugly.
+  # We can't import tangent_space in the beginning since it creates cyclic
+  # dependencies.
+  from t3f import ops
+  from t3f.tangent_space import TangentVector
+  from t3f.tangent_space import TangentVectorBatch
+
+  if not isinstance(x, TensorTrain):
+    raise ValueError('The first argument should be a TensorTrain object, got '
+                     '"%s".' % x)
+  if isinstance(xi, (TangentVectorBatch, TensorTrainBatch)):
+    raise ValueError('Retraction of batches is not supported, got "%s".' % xi)
+  if isinstance(xi, TangentVector):
+    if xi.tangent_space.point is not x:
+      raise ValueError('xi should be a tangent vector at x.')
+  elif getattr(xi, 'projection_on', None) is not x:
+    raise ValueError('xi should be a projection on the tangent space at x '
+                     '(e.g. the result of t3f.project(what, x)).')
+  if max_tt_rank is None:
+    if not x.get_tt_ranks().is_fully_defined():
+      raise ValueError('max_tt_rank is required if the TT-ranks of x are '
+                       'unknown on the graph construction stage.')
+    max_tt_rank = x.get_tt_ranks().as_list()
+  ndims = x.ndims()
+  max_tt_rank = decompositions._normalize_max_tt_rank(max_tt_rank, ndims)
+  if epsilon is not None and epsilon < 0:
+    raise ValueError('Epsilon should be non-negative.')
+
+  with tf.name_scope(name, values=x.tt_cores):
+    if isinstance(xi, TangentVector):
+      deltas = xi.deltas
+      left = xi.tangent_space.left
+      right = xi.tangent_space.right
+    else:
+      left = decompositions.orthogonalize_tt_cores(x)
+      right = decompositions.orthogonalize_tt_cores(left, left_to_right=False)
+      deltas = tangent_space_to_deltas(xi, left, right)
+    # 16-bit TT-cores are rounded in float32, see utils.accumulation_dtype.
+    dtype = utils.accumulation_dtype(x.dtype.base_dtype)
+    raw_shape = shapes.lazy_raw_shape(x)
+    left_ranks = shapes.lazy_tt_ranks(left)
+    right_ranks = shapes.lazy_tt_ranks(right)
+    t = tf.cast(t, dtype)
+
+    def dim(tensor, axis):
+      # Static size if known on the graph construction stage.
+      value = tensor.get_shape()[axis].value
+      return value if value is not None else tf.shape(tensor)[axis]
+
+    def orthogonalize_block(block, u_block):
+      # Returns q with orthonormal columns orthogonal to u_block and triang
+      # such that block = q triang (the columns of block are orthogonal to
+      # u_block by the gauge conditions).
+      num_rows = block.get_shape()[0].value
+      num_cols = block.get_shape()[1].value
+      num_u_cols = u_block.get_shape()[1].value
+      if None not in (num_rows, num_cols, num_u_cols):
+        if num_rows - num_u_cols < num_cols:
+          # u_block leaves less than num_cols dimensions, use them as the
+          # basis (QR of block would give extra columns not orthogonal to
+          # u_block).
+          q, _ = tf.qr(u_block, full_matrices=True)
+          q = q[:, num_u_cols:]
+          return q, tf.matmul(q, block, transpose_a=True)
+      return tf.qr(block)
+
+    # Work with 3-D cores of size r x n x r (n x m is merged for TT-matrices).
+    modes = []
+    for core_idx in range(ndims):
+      if x.is_tt_matrix():
+        modes.append(raw_shape[0][core_idx] * raw_shape[1][core_idx])
+      else:
+        modes.append(raw_shape[0][core_idx])
+    u_cores = []
+    v_cores = []
+    d_cores = []
+    for core_idx in range(ndims):
+      curr_mode = modes[core_idx]
+      u_cores.append(tf.reshape(tf.cast(left.tt_cores[core_idx], dtype),
+                                (left_ranks[core_idx], curr_mode, -1)))
+      v_cores.append(tf.reshape(tf.cast(right.tt_cores[core_idx], dtype),
+                                (right_ranks[core_idx], curr_mode, -1)))
+      d_cores.append(t * tf.reshape(tf.cast(deltas[core_idx], dtype),
+                                    (left_ranks[core_idx], curr_mode, -1)))
+    # x = U_1 ... U_{d-1} L_d is itself an element of the tangent space with
+    # the deltas [0, ..., 0, L_d].
+    d_cores[-1] += u_cores[-1]
+
+    # Left to right orthogonalization. The second block column [0; U_k] of the
+    # TT-cores is already orthogonal and (by the gauge conditions) orthogonal
+    # to the first block column, so only the first one is decomposed.
+    tt_cores = []
+    if ndims == 1:
+      tt_cores.append(d_cores[0])
+    else:
+      block = tf.reshape(d_cores[0], (-1, right_ranks[1]))
+      u_block = tf.reshape(u_cores[0], (-1, left_ranks[1]))
+      q, triang = orthogonalize_block(block, u_block)
+      tt_cores.append(tf.reshape(tf.concat((q, u_block), axis=1),
+                                 (1, modes[0], -1)))
+      for core_idx in range(1, ndims):
+        curr_mode = modes[core_idx]
+        v_block = tf.reshape(v_cores[core_idx], (right_ranks[core_idx], -1))
+        top = tf.reshape(tf.matmul(triang, v_block),
+                         (dim(triang, 0), curr_mode, -1))
+        block = tf.concat((top, d_cores[core_idx]), axis=0)
+        if core_idx == ndims - 1:
+          tt_cores.append(block)
+          break
+        num_rows = dim(block, 0)
+        block = tf.reshape(block, (-1, right_ranks[core_idx + 1]))
+        zeros = tf.zeros((dim(top, 0), curr_mode, left_ranks[core_idx + 1]),
+                         dtype=dtype)
+        u_block = tf.concat((zeros, u_cores[core_idx]), axis=0)
+        u_block = tf.reshape(u_block, (-1, left_ranks[core_idx + 1]))
+        q, triang = orthogonalize_block(block, u_block)
+        tt_cores.append(tf.reshape(tf.concat((q, u_block), axis=1),
+                                   (num_rows, curr_mode, -1)))
+
+    if x.is_tt_matrix():
+      for core_idx in range(ndims):
+        core = tt_cores[core_idx]
+        tt_cores[core_idx] = tf.reshape(core, (dim(core, 0),
+                                               raw_shape[0][core_idx],
+                                               raw_shape[1][core_idx],
+                                               dim(core, 2)))
+    left_orthogonal = TensorTrain(tt_cores, x.get_raw_shape())
+    res = decompositions._round_left_orthogonal_tt(left_orthogonal,
+                                                   max_tt_rank, epsilon)
+    return ops.cast(res, x.dtype.base_dtype)
@@ -9,6 +9,7 @@ from t3f import riemannian
 from t3f import variables
 from t3f import shapes
 from t3f import batch_ops
+from t3f import decompositions
 
 
 class _RiemannianTest():
@@ -128,6 +129,31 @@ class _RiemannianTest():
     # Variable dtype (float32_ref).
     riemannian.project_sum(what, where, weights)
 
+  def testProjectPrecomputedOrthogonalization(self):
+    # Passing the orthogonalizations of the point avoids recomputing them.
+    what = initializers.random_tensor((2, 3, 4), tt_rank=2, dtype=self.dtype)
+    where = initializers.random_tensor((2, 3, 4), tt_rank=3, dtype=self.dtype)
+    left = decompositions.orthogonalize_tt_cores(where)
+    right = decompositions.orthogonalize_tt_cores(left, left_to_right=False)
+    graph = tf.get_default_graph()
+    num_qr = lambda: len([op for op in graph.get_operations()
+                          if op.type == 'Qr'])
+    num_qr_before = num_qr()
+    actual = riemannian.project(what, where, left, right)
+    actual_sum = riemannian.project_sum(what, where, None, left, right)
+    deltas = riemannian.tangent_space_to_deltas(actual, left, right)
+    self.assertEqual(num_qr_before, num_qr())
+    desired = riemannian.project(what, where)
+    desired_deltas = riemannian.tangent_space_to_deltas(desired)
+    with self.test_session() as sess:
+      res = sess.run((ops.full(actual), ops.full(actual_sum), ops.full(desired),
+                      deltas, desired_deltas))
+      actual_v, actual_sum_v, desired_v, deltas_v, desired_deltas_v = res
+      self.assertAllClose(desired_v, actual_v)
+      self.assertAllClose(desired_v, actual_sum_v)
+      for delta, desired_delta in zip(deltas_v, desired_deltas_v):
+        self.assertAllClose(desired_delta, delta)
+
   def testProjectMatrixOnItself(self):
     # Project a TT-matrix on itself.
     # Projection of X into the tangent space of itself is X: P_x(x) = x.
@@ -331,6 +357,45 @@ class _RiemannianTest():
       self.assertAllClose(desired_val, actual_val)
 
 
+  def testRetract(self):
+    # Retraction equals rounding the sum x + t * xi.
+    with self.test_session() as sess:
+      # The orthogonalization reduces the TT-ranks of the (2, 3, 2) tensor.
+      for shape in [(2, 3, 4, 3), (2, 3, 2), ((2, 3, 2), (3, 2, 2))]:
+        if isinstance(shape[0], tuple):
+          x = initializers.random_matrix(shape, tt_rank=3, dtype=self.dtype)
+          what = initializers.random_matrix(shape, tt_rank=2,
+                                            dtype=self.dtype)
+        else:
+          x = initializers.random_tensor(shape, tt_rank=3, dtype=self.dtype)
+          what = initializers.random_tensor(shape, tt_rank=2, dtype=self.dtype)
+        xi = riemannian.project(what, x)
+        res = riemannian.retract(x, xi, -0.3)
+        desired = decompositions.round(ops.add(x, -0.3 * xi), max_tt_rank=3)
+        exact = riemannian.retract(x, xi, -0.3, max_tt_rank=6)
+        self.assertEqual(desired.get_tt_ranks(), res.get_tt_ranks())
+        res_val, desired_val, exact_val, x_val, xi_val = sess.run(
+            (ops.full(res), ops.full(desired), ops.full(exact), ops.full(x),
+             ops.full(xi)))
+        self.assertAllClose(desired_val, res_val, atol=1e-5, rtol=1e-5)
+        self.assertAllClose(x_val - 0.3 * xi_val, exact_val, atol=1e-5,
+                            rtol=1e-5)
+
+  def testRetractErrors(self):
+    x = initializers.random_tensor((2, 3, 4), tt_rank=2, dtype=self.dtype)
+    y = initializers.random_tensor((2, 3, 4), tt_rank=2, dtype=self.dtype)
+    with self.assertRaises(ValueError):
+      # Not a tangent vector.
+      riemannian.retract(x, y)
+    with self.assertRaises(ValueError):
+      # A tangent vector at a different point.
+      riemannian.retract(x, riemannian.project(x, y))
+    batch = initializers.random_tensor_batch((2, 3, 4), batch_size=2,
+                                             dtype=self.dtype)
+    with self.assertRaises(ValueError):
+      riemannian.retract(x, riemannian.project(batch, x))
+
+
 class RiemannianTestFloat32(tf.test.TestCase, _RiemannianTest):
   dtype = tf.float32
 
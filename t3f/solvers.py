@@ -0,0 +1,312 @@
+"""Solvers of linear systems with TT-matrices.
+
+Example:
+  # A is a symmetric positive definite TT-matrix (e.g. a discretized Laplace
+  # operator) of raw shape (n_1, ..., n_d) x (n_1, ..., n_d) and b is a
+  # TT-vector of raw shape (n_1, ..., n_d) x (1, ..., 1).
+  x = t3f.solvers.amen_solve(A, b, tol=1e-6, max_tt_rank=10)
+"""
+
+import numpy as np
+import tensorflow.compat.v1 as tf
+
+from t3f.tensor_train import TensorTrain
+from t3f import decompositions
+from t3f import utils
+
+
+def amen_solve(A, b, x0=None, tol=1e-6, max_tt_rank=10, kickrank=2,
+               max_sweeps=20, name='t3f_amen_solve'):
+  """Solves A x = b with the alternating minimal energy (AMEn) method.
+
+  The solution is a TT-vector (a TT-matrix with the column raw shape of
+  ones, see t3f.matmul). Each step of AMEn fixes all the TT-cores of x but
+  one and solves the local (Galerkin) projection of the system onto the
+  TT-cores of x (of size r_{k-1} n_k r_k) exactly. The projections of A and b
+  onto the fixed TT-cores are the interface contractions, which are updated
+  by one core at a time while sweeping over the cores (as the lhs / rhs
+  contractions in t3f.project). After each step the TT-core is truncated to
+  max_tt_rank and enriched by kickrank directions of the residual b - A x,
+  which are tracked by a TT-vector z of TT-rank kickrank updated along x
+  (Dolgov and Savostyanov, 2014). The enrichment lets the method rotate the
+  TT-subspaces of x and not get stuck as the fixed rank ALS does.
+
+  During the sweeps the TT-ranks of x are fixed to max_tt_rank + kickrank (or
+  less where the TT-rank can't be that large), so that the sweeps can run
+  inside a tf.while_loop, and the result is rounded to max_tt_rank. The
+  sweeps stop when the largest relative residual of the local systems
+  (computed before solving them) is at most tol, or after max_sweeps sweeps.
+
+  The method is intended for symmetric positive definite A (e.g.
+  discretizations of elliptic operators), for which each step minimizes the
+  energy norm of the error. For other matrices the local systems can be
+  singular.
+
+  Args:
+    A: `TensorTrain` containing a TT-matrix of raw shape (n_1, ..., n_d) x
+      (n_1, ..., n_d) with statically known TT-ranks.
+    b: `TensorTrain` containing a TT-vector of raw shape (n_1, ..., n_d) x
+      (1, ..., 1) with statically known TT-ranks.
+    x0: None or `TensorTrain` of the same raw shape as b, the initial guess
+      (defaults to b). Rounded to max_tt_rank if necessary.
+    tol: a number, the desired relative residual of the local systems.
+    max_tt_rank: a number, the TT-rank of the solution.
+    kickrank: a non-negative number, the TT-rank of the residual used for the
+      enrichment (0 for the alternating least squares without enrichment).
+    max_sweeps: a number, the maximal number of sweeps, each of which is a
+      left-to-right and a right-to-left pass over the TT-cores.
+    name: string, name of the Op.
+
+  Returns:
+    `TensorTrain` containing the TT-vector x.
+
+  Raises:
+    ValueError if the shapes or the TT-ranks of the arguments are not fully
+      defined, if A is not square, if the shape of b or x0 doesn't match A,
+      or if max_tt_rank, kickrank or max_sweeps are invalid.
+
+  Complexity:
+    O(max_sweeps d (r n r)^3) for the local solves, where r is
+    max_tt_rank + kickrank and n is the largest mode size, plus
+    O(max_sweeps d n^2 R r^2 (r + R)) for the interface contractions, where R
+    is the largest TT-rank of A.
+  """
+  if x0 is None:
+    x0 = b
+  for arg_name, tt in [('A', A), ('b', b), ('x0', x0)]:
+    if not isinstance(tt, TensorTrain) or not tt.is_tt_matrix():
+      raise ValueError('%s should be a TT-matrix, got "%s".' % (arg_name, tt))
+    if not tt.get_shape().is_fully_defined():
+      raise ValueError('The shape of %s should be known on the graph '
+                       'construction stage, got %s.' % (arg_name,
+                                                        tt.get_shape()))
+    if not tt.get_tt_ranks().is_fully_defined():
+      raise ValueError('The TT-ranks of %s should be known on the graph '
+                       'construction stage, got %s.' % (arg_name,
+                                                        tt.get_tt_ranks()))
+  raw_shape = A.get_raw_shape()
+  if raw_shape[0] != raw_shape[1]:
+    raise ValueError('A should be square with the same row and column raw '
+                     'shapes, got %s.' % A)
+  vector_raw_shape = [raw_shape[0].as_list(), [1] * A.ndims()]
+  for arg_name, tt in [('b', b), ('x0', x0)]:
+    if [s.as_list() for s in tt.get_raw_shape()] != vector_raw_shape:
+      raise ValueError('The raw shape of %s should be %s, got %s.' %
+                       (arg_name, vector_raw_shape, tt))
+  if max_tt_rank < 1:
+    raise ValueError('max_tt_rank should be positive, got %s.' % max_tt_rank)
+  if kickrank < 0:
+    raise ValueError('kickrank should be non-negative, got %s.' % kickrank)
+  if max_sweeps < 1:
+    raise ValueError('max_sweeps should be positive, got %s.' % max_sweeps)
+
+  input_tensors = list(A.tt_cores) + list(b.tt_cores) + list(x0.tt_cores)
+  with tf.name_scope(name, values=input_tensors):
+    dtype = b.dtype.base_dtype
+    ndims = A.ndims()
+    mode_sizes = raw_shape[0].as_list()
+    # The largest sensible TT-ranks are min(n_1 ... n_k, n_{k+1} ... n_d)
+    # (computed in floating point to avoid integer overflow for large d).
+    float_sizes = np.array(mode_sizes, dtype=np.float64)
+    left_sizes = np.cumprod(np.concatenate(([1], float_sizes)))
+    right_sizes = np.cumprod(np.concatenate(([1], float_sizes[::-1])))[::-1]
+    rank_caps = np.minimum(left_sizes, right_sizes)
+    x_ranks = np.minimum(rank_caps, max_tt_rank + kickrank).astype(int)
+    # The TT-ranks of the truncated TT-cores before the enrichment.
+    keep_ranks = np.minimum(rank_caps, max_tt_rank).astype(int)
+    z_ranks = np.minimum(rank_caps, kickrank).astype(int)
+
+    x0_ranks = x0.get_tt_ranks().as_list()
+    if np.any(np.array(x0_ranks) > x_ranks):
+      x0 = decompositions.round(x0, max_tt_rank=x_ranks)
+      x0_ranks = x0.get_tt_ranks().as_list()
+    # Pad the TT-cores of x0 with zeros up to the TT-ranks of the solution.
+    x = []
+    for i in range(ndims):
+      core = x0.tt_cores[i][:, :, 0, :]
+      padding = [[0, x_ranks[i] - x0_ranks[i]], [0, 0],
+                 [0, x_ranks[i + 1] - x0_ranks[i + 1]]]
+      x.append(tf.pad(tf.cast(core, dtype), padding))
+    z = []
+    if kickrank > 0:
+      for i in range(ndims):
+        shape = (z_ranks[i], mode_sizes[i], z_ranks[i + 1])
+        z.append(tf.random_normal(shape, dtype=dtype))
+    a_cores = [tf.cast(core, dtype) for core in A.tt_cores]
+    b_cores = [tf.cast(core[:, :, 0, :], dtype) for core in b.tt_cores]
+    reversed_a_cores = _reverse(a_cores)
+    reversed_b_cores = _reverse(b_cores)
+
+    # Make x and z right-orthogonal by left-orthogonalizing the reversed
+    # TT-vectors and compute the interfaces to the right of each core.
+    reversed_x = _orthogonalize(_reverse(x))
+    reversed_z = _orthogonalize(_reverse(z))
+    left = [_interface_ones(dtype, kickrank > 0)]
+    for i in range(ndims - 1):
+      left.append(_update_left_interface(
+          left[-1], reversed_a_cores[i], reversed_b_cores[i], reversed_x[i],
+          reversed_z[i] if z else None))
+    x = _reverse(reversed_x)
+    z = _reverse(reversed_z)
+    right = left[::-1]
+
+    def cond(sweep, residual, x, z, right):
+      return tf.logical_and(sweep < max_sweeps, residual > tol)
+
+    def body(sweep, residual, x, z, right):
+      x, z, left, residual_1 = _sweep(a_cores, b_cores, x, z, right,
+                                      keep_ranks)
+      x, z, left, residual_2 = _sweep(reversed_a_cores, reversed_b_cores,
+                                      _reverse(x), _reverse(z), left[::-1],
+                                      keep_ranks[::-1])
+      residual = tf.maximum(residual_1, residual_2)
+      return sweep + 1, residual, _reverse(x), _reverse(z), left[::-1]
+
+    loop_vars = (tf.constant(0), tf.constant(np.inf, dtype=dtype), x, z,
+                 right)
+    _, _, x, _, _ = tf.while_loop(cond, body, loop_vars)
+    x = [tf.expand_dims(core, 2) for core in x]
+    x = TensorTrain(x, x0.get_raw_shape(), x_ranks)
+    if np.any(x_ranks > keep_ranks):
+      x = decompositions.round(x, max_tt_rank=keep_ranks)
+    return x
+
+
+def _reverse(cores):
+  """Reverses the order of the modes of a TT-object given by its TT-cores."""
+  res = []
+  for core in cores[::-1]:
+    perm = list(range(len(core.get_shape())))
+    perm[0], perm[-1] = perm[-1], perm[0]
+    res.append(tf.transpose(core, perm))
+  return res
+
+
+def _orthogonalize(cores):
+  """Left-orthogonalizes all but the last of the TT-cores of a TT-vector.
+
+  The TT-ranks are assumed to satisfy r_{k-1} n_k >= r_k, so they are kept.
+  """
+  cores = list(cores)
+  for i in range(len(cores) - 1):
+    left_rank, mode_size, right_rank = cores[i].get_shape().as_list()
+    q, r = tf.qr(tf.reshape(cores[i], (left_rank * mode_size, right_rank)))
+    cores[i] = tf.reshape(q, (left_rank, mode_size, right_rank))
+    cores[i + 1] = tf.einsum('ab,bjc->ajc', r, cores[i + 1])
+  return cores
+
+
+def _interface_ones(dtype, with_residual):
+  """The interfaces to the left of the first TT-core."""
+  phi = tf.ones((1, 1, 1), dtype=dtype)
+  psi = tf.ones((1, 1), dtype=dtype)
+  if with_residual:
+    return (phi, psi, phi, psi)
+  return (phi, psi)
+
+
+def _update_left_interface(interface, a_core, b_core, x_core, z_core):
+  """Adds the next TT-core to the interfaces to the left of the TT-core.
+
+  Args:
+    interface: a tuple of the contractions of x^T A x (of size r_x x R_A x
+      r_x) and x^T b (of size r_x x r_b) over the previous TT-cores, and of
+      z^T A x (r_z x R_A x r_x) and z^T b (r_z x r_b) if z is used.
+    a_core: the TT-core of A of size R_A x n x n x R_A'.
+    b_core: the TT-core of b of size r_b x n x r_b'.
+    x_core: the left-orthogonal TT-core of x of size r_x x n x r_x'.
+    z_core: None or the left-orthogonal TT-core of z of size r_z x n x r_z'.
+
+  Returns:
+    The tuple of the interfaces including the TT-core.
+  """
+  phi = utils.einsum('aAc,aib,AijB,cjd->bBd', interface[0], x_core, a_core,
+                     x_core)
+  psi = utils.einsum('ag,aib,gih->bh', interface[1], x_core, b_core)
+  if z_core is None:
+    return (phi, psi)
+  phi_z = utils.einsum('zAc,ziw,AijB,cjd->wBd', interface[2], z_core, a_core,
+                       x_core)
+  psi_z = utils.einsum('zg,ziw,gih->wh', interface[3], z_core, b_core)
+  return (phi, psi, phi_z, psi_z)
+
+
+def _sweep(a_cores, b_cores, x, z, right, keep_ranks):
+  """A left-to-right AMEn sweep.
+
+  Args:
+    a_cores: the TT-cores of A.
+    b_cores: the TT-cores of b with the column mode squeezed.
+    x: the TT-cores of the current solution, right-orthogonal but the first.
+    z: the TT-cores of the residual approximation (right-orthogonal but the
+      first) or an empty list if the enrichment is not used.
+    right: the list of the interfaces to the right of each TT-core (see
+      _update_left_interface).
+    keep_ranks: the TT-ranks to truncate the TT-cores to before enriching
+      them by the residual up to the TT-ranks of x.
+
+  Returns:
+    x: the new TT-cores of the solution, left-orthogonal but the last.
+    z: the new TT-cores of the residual approximation, left-orthogonal but
+      the last.
+    left: the list of the interfaces to the left of each TT-core.
+    residual: the largest relative residual of the local systems before
+      solving them.
+  """
+  ndims = len(x)
+  x = list(x)
+  z = list(z)
+  left = [_interface_ones(x[0].dtype, bool(z))]
+  residuals = []
+  for i in range(ndims):
+    left_rank, mode_size, right_rank = x[i].get_shape().as_list()
+    local_size = left_rank * mode_size * right_rank
+    phi_l, psi_l = left[i][:2]
+    phi_r, psi_r = right[i][:2]
+    rhs = utils.einsum('ag,gih,ch->aic', psi_l, b_cores[i], psi_r)
+    rhs = tf.reshape(rhs, (local_size, 1))
+    matrix = utils.einsum('aAc,AijB,bBd->aibcjd', phi_l, a_cores[i], phi_r)
+    matrix = tf.reshape(matrix, (local_size, local_size))
+    old_residual = tf.matmul(matrix, tf.reshape(x[i], (local_size, 1))) - rhs
+    residuals.append(tf.norm(old_residual) / tf.norm(rhs))
+    core = tf.reshape(tf.linalg.solve(matrix, rhs),
+                      (left_rank, mode_size, right_rank))
+
+    if z:
+      phi_zl, psi_zl = left[i][2:]
+      phi_zr, psi_zr = right[i][2:]
+      # The residual b - A x projected onto the TT-cores of z.
+      z_core = utils.einsum('zg,gih,wh->ziw', psi_zl, b_cores[i], psi_zr)
+      z_core -= utils.einsum('zAc,AijB,cjd,wBd->ziw', phi_zl, a_cores[i],
+                             core, phi_zr)
+      z_shape = z_core.get_shape().as_list()
+    if i == ndims - 1:
+      x[i] = core
+      if z:
+        z[i] = z_core
+      break
+
+    core = tf.reshape(core, (left_rank * mode_size, right_rank))
+    num_kick = right_rank - keep_ranks[i + 1]
+    if num_kick > 0:
+      # The residual projected onto the TT-cores of x on the left and of z on
+      # the right, which enriches the basis of the TT-core.
+      kick = utils.einsum('ag,gih,wh->aiw', psi_l, b_cores[i], psi_zr)
+      kick -= utils.einsum('aAc,AijB,cjd,wBd->aiw', phi_l, a_cores[i],
+                           tf.reshape(core, (left_rank, mode_size, right_rank)),
+                           phi_zr)
+      kick = tf.reshape(kick, (left_rank * mode_size, -1))[:, :num_kick]
+      _, u, _ = tf.svd(core)
+      basis = tf.concat((u[:, :right_rank - num_kick], kick), axis=1)
+    else:
+      basis = core
+    q, _ = tf.qr(basis)
+    x[i] = tf.reshape(q, (left_rank, mode_size, right_rank))
+    coef = tf.matmul(q, core, transpose_a=True)
+    x[i + 1] = tf.einsum('ab,bjc->ajc', coef, x[i + 1])
+    if z:
+      q_z, _ = tf.qr(tf.reshape(z_core, (z_shape[0] * z_shape[1], z_shape[2])))
+      z[i] = tf.reshape(q_z, z_shape)
+    left.append(_update_left_interface(left[i], a_cores[i], b_cores[i], x[i],
+                                       z[i] if z else None))
+  return x, z, left, tf.reduce_max(tf.stack(residuals))
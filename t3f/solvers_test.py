@@ -0,0 +1,87 @@
+import numpy as np
+import tensorflow.compat.v1 as tf
+
+from t3f.tensor_train import TensorTrain
+from t3f import ops
+from t3f import initializers
+from t3f import solvers
+
+
+class _SolversTest():
+
+  def _laplace(self, ndims, mode_size):
+    # The d-dimensional discrete Laplacian L x I x ... x I + ... +
+    # I x ... x I x L as a TT-matrix of TT-rank 2.
+    lap = 2 * np.eye(mode_size) - np.eye(mode_size, k=1)
+    lap -= np.eye(mode_size, k=-1)
+    eye = np.eye(mode_size)
+    first = np.stack((lap, eye), axis=-1)[np.newaxis]
+    middle = np.zeros((2, mode_size, mode_size, 2))
+    middle[0, :, :, 0] = eye
+    middle[1, :, :, 0] = lap
+    middle[1, :, :, 1] = eye
+    last = np.stack((eye, lap))[..., np.newaxis]
+    cores = [first] + [middle] * (ndims - 2) + [last]
+    return TensorTrain([tf.constant(c, dtype=self.dtype) for c in cores])
+
+  def testAmenSolveFullRank(self):
+    # With TT-ranks large enough the local system of the first TT-core is the
+    # whole system.
+    with self.test_session() as sess:
+      A = self._laplace(3, 4)
+      b = initializers.random_matrix(((4, 4, 4), None), tt_rank=2,
+                                     dtype=self.dtype)
+      for kickrank in [0, 2]:
+        x = solvers.amen_solve(A, b, max_tt_rank=16, kickrank=kickrank)
+        self.assertEqual([1, 4, 4, 1], x.get_tt_ranks().as_list())
+        x_val, A_val, b_val = sess.run((ops.full(x), ops.full(A),
+                                        ops.full(b)))
+        self.assertAllClose(np.linalg.solve(A_val, b_val), x_val, rtol=1e-4,
+                            atol=1e-4)
+
+  def testAmenSolve(self):
+    with self.test_session() as sess:
+      shape = (6, 6, 6, 6, 6)
+      A = self._laplace(len(shape), shape[0])
+      b = TensorTrain([tf.ones((1, 6, 1, 1), dtype=self.dtype)] * len(shape))
+      x0 = initializers.random_matrix((shape, None), tt_rank=8,
+                                      dtype=self.dtype)
+      tol = 1e-6 if self.dtype == tf.float64 else 1e-4
+      for kickrank in [0, 2]:
+        x = solvers.amen_solve(A, b, x0, tol=tol, max_tt_rank=5,
+                               kickrank=kickrank)
+        self.assertEqual([1, 5, 5, 5, 5, 1], x.get_tt_ranks().as_list())
+        residual = (ops.frobenius_norm(ops.matmul(A, x) - b, epsilon=0) /
+                    ops.frobenius_norm(b, epsilon=0))
+        self.assertLess(sess.run(residual), 10 * tol)
+
+  def testErrors(self):
+    A = self._laplace(3, 4)
+    b = initializers.random_matrix(((4, 4, 4), None), dtype=self.dtype)
+    with self.assertRaises(ValueError):
+      # Not square.
+      A_rect = initializers.random_matrix(((4, 4, 4), (4, 4, 2)),
+                                          dtype=self.dtype)
+      solvers.amen_solve(A_rect, b)
+    with self.assertRaises(ValueError):
+      b_wrong = initializers.random_matrix(((4, 4, 2), None), dtype=self.dtype)
+      solvers.amen_solve(A, b_wrong)
+    with self.assertRaises(ValueError):
+      solvers.amen_solve(A, initializers.random_tensor((4, 4, 4),
+                                                       dtype=self.dtype))
+    with self.assertRaises(ValueError):
+      solvers.amen_solve(A, b, kickrank=-1)
+    with self.assertRaises(ValueError):
+      solvers.amen_solve(A, b, max_tt_rank=0)
+
+
+class SolversTestFloat32(tf.test.TestCase, _SolversTest):
+  dtype = tf.float32
+
+
+class SolversTestFloat64(tf.test.TestCase, _SolversTest):
+  dtype = tf.float64
+
+
+if __name__ == "__main__":
+  tf.test.main()
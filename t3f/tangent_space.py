@@ -0,0 +1,409 @@
+import tensorflow.compat.v1 as tf
+
+from t3f.tensor_train import TensorTrain
+from t3f.tensor_train_batch import TensorTrainBatch
+from t3f import decompositions
+from t3f import riemannian
+from t3f import utils
+
+
+class TangentSpace(object):
+  """The tangent space of the manifold of fixed TT-rank objects at a point.
+
+  Orthogonalizes the point `x` once on creation, so projecting many vectors on
+  the tangent space at the same point costs only the part which depends on the
+  vectors (O(d r_what r_x n (r_what + r_x)) per vector).
+
+  Example:
+    tangent_space = t3f.TangentSpace(x)
+    projected = [tangent_space.project(v) for v in vectors]
+    grad = tangent_space.project_matmul(x, A)
+  """
+
+  def __init__(self, x, name='t3f_tangent_space'):
+    """Creates a `TangentSpace` at the point `x`.
+
+    Args:
+      x: `TensorTrain` object, TT-tensor or TT-matrix.
+      name: string, name of the Op.
+
+    Raises:
+      ValueError if `x` is not a `TensorTrain`.
+    """
+    if not isinstance(x, TensorTrain):
+      raise ValueError('The tangent space point should be a TensorTrain '
+                       'object, got "%s".' % x)
+    with tf.name_scope(name, values=x.tt_cores):
+      if tf.executing_eagerly():
+        # Fix the current value of tf.Variable TT-cores, so the point matches
+        # its orthogonalizations below.
+        x = TensorTrain(x.tt_cores, x.get_raw_shape(), x.get_tt_ranks())
+      self._point = x
+      # Passed to the riemannian functions below, so they don't recompute
+      # them.
+      self._left = decompositions.orthogonalize_tt_cores(x)
+      self._right = decompositions.orthogonalize_tt_cores(self._left,
+                                                          left_to_right=False)
+
+  @property
+  def point(self):
+    """The `TensorTrain` at which the tangent space is taken."""
+    return self._point
+
+  @property
+  def left(self):
+    """The point with left-orthogonal TT-cores U_1, ..., U_{d-1}."""
+    return self._left
+
+  @property
+  def right(self):
+    """The point with right-orthogonal TT-cores V_2, ..., V_d."""
+    return self._right
+
+  def project(self, what):
+    """Projects `what` on the tangent space, see t3f.project.
+
+    Args:
+      what: `TensorTrain` or `TensorTrainBatch` of the same shape as the point.
+        In the case of batch returns batch with the projection of each element.
+
+    Returns:
+      `TensorTrain` or `TensorTrainBatch` with TT-ranks twice the TT-ranks of
+      the point.
+    """
+    return riemannian.project(what, self._point, self._left, self._right)
+
+  def project_to_vector(self, what, name='t3f_project_to_vector'):
+    """Projects `what` on the tangent space without assembling the TT-cores.
+
+    Computes the same projection as `project`, but keeps only the deltas, so
+    the TT-cores of the point are not copied into each projection (or tiled
+    batch_size times for a batch).
+
+    Args:
+      what: `TensorTrain` or `TensorTrainBatch` of the same shape as the point.
+      name: string, name of the Op.
+
+    Returns:
+      `TangentVector` (or `TangentVectorBatch` if `what` is a batch).
+
+    Raises:
+      ValueError if the shapes or the dtypes of `what` and of the point
+        don't match.
+    """
+    if self._point.get_raw_shape() != what.get_raw_shape():
+      raise ValueError('The shapes of the tensor we want to project and of the '
+                       'tangent space point should match, got %s and %s.' %
+                       (what.get_raw_shape(), self._point.get_raw_shape()))
+    if not self._point.dtype.is_compatible_with(what.dtype):
+      raise ValueError('Dtypes of the arguments should coincide, got %s and '
+                       '%s.' % (what.dtype, self._point.dtype))
+    with tf.name_scope(name, values=what.tt_cores):
+      deltas = riemannian._project_deltas(what, self._left, self._right)
+    if isinstance(what, TensorTrainBatch):
+      return TangentVectorBatch(deltas, self)
+    return TangentVector(deltas, self)
+
+  def project_sum(self, what, weights=None):
+    """Projects the (weighted) sum of `what` on the tangent space.
+
+    See t3f.project_sum.
+
+    Args:
+      what: `TensorTrain` or `TensorTrainBatch` of the same shape as the point.
+      weights: python list or tf.Tensor of numbers or None, weights of the sum.
+
+    Returns:
+      `TensorTrain` (or `TensorTrainBatch` for 2-D weights) with TT-ranks twice
+      the TT-ranks of the point.
+    """
+    return riemannian.project_sum(what, self._point, weights, self._left,
+                                  self._right)
+
+  def project_matmul(self, what, matrix):
+    """Projects `matrix` * `what` on the tangent space, see t3f.project_matmul.
+
+    Args:
+      what: `TensorTrain` or `TensorTrainBatch`, TT-matrices of the same shape
+        as the point.
+      matrix: `TensorTrain`, TT-matrix to multiply by `what`.
+
+    Returns:
+      `TensorTrain` or `TensorTrainBatch` with TT-ranks twice the TT-ranks of
+      the point.
+    """
+    return riemannian.project_matmul(what, self._point, matrix, self._left,
+                                     self._right)
+
+  def to_deltas(self, tangent, name='t3f_tangent_space_to_deltas'):
+    """Converts an element of the tangent space into the list of deltas.
+
+    See t3f.tangent_space_to_deltas.
+
+    Args:
+      tangent: `TensorTrain` or `TensorTrainBatch`, a result of the projection
+        on this tangent space.
+      name: string, name of the Op.
+
+    Returns:
+      A list of delta-cores (tf.Tensors).
+
+    Raises:
+      ValueError if `tangent` is not a projection on this tangent space.
+    """
+    if getattr(tangent, 'projection_on', None) is not self._point:
+      raise ValueError('The argument is not a projection on this tangent '
+                       'space.')
+    return riemannian.tangent_space_to_deltas(tangent, self._left, self._right,
+                                              name=name)
+
+  def from_deltas(self, deltas, name='t3f_deltas_to_tangent_space'):
+    """Converts the list of deltas into an element of the tangent space.
+
+    The inverse of to_deltas. The deltas should obey the gauge conditions
+    (as e.g. the outputs of to_deltas), otherwise the result is silently
+    incorrect.
+
+    Args:
+      deltas: a list of d delta-cores (with a leading batch dimension for a
+        batch of tangent vectors).
+      name: string, name of the Op.
+
+    Returns:
+      `TensorTrain` or `TensorTrainBatch` with TT-ranks twice the TT-ranks of
+      the point.
+    """
+    return riemannian.deltas_to_tangent_space(deltas, self._point, self._left,
+                                              self._right, name=name)
+
+
+class TangentVector(object):
+  """An element of a tangent space stored as the deltas only.
+
+  The tangent vector
+    dP1 V2 ... Vd + U1 dP2 V3 ... Vd + ... + U1 ... Ud-1 dPd
+  is represented by the list of deltas [dP1, ..., dPd] (obeying the gauge
+  conditions) and a reference to the `TangentSpace` which holds the
+  orthogonalized TT-cores U and V of the point. Linear combinations and inner
+  products of vectors from the same tangent space never touch U and V.
+
+  Example:
+    tangent_space = t3f.TangentSpace(x)
+    v = tangent_space.project_to_vector(grad)
+    w = 2.0 * v - tangent_space.project_to_vector(other_grad)
+    norm = w.frobenius_norm()
+    w_tt = w.to_tt()
+  """
+
+  def __init__(self, deltas, tangent_space):
+    """Creates a `TangentVector` from deltas.
+
+    Args:
+      deltas: a list of d delta-cores (tf.Tensors or numpy arrays) obeying the
+        gauge conditions, e.g. the output of `TangentSpace.to_deltas`.
+      tangent_space: `TangentSpace` the vector belongs to.
+
+    Raises:
+      ValueError if the number of deltas is not the number of TT-cores of the
+        tangent space point.
+    """
+    if len(deltas) != tangent_space.point.ndims():
+      raise ValueError('Expected %d deltas (the number of TT-cores of the '
+                       'tangent space point), got %d.' %
+                       (tangent_space.point.ndims(), len(deltas)))
+    dtype = tangent_space.point.dtype.base_dtype
+    self._deltas = [tf.convert_to_tensor(d, dtype=dtype) for d in deltas]
+    self._tangent_space = tangent_space
+
+  @property
+  def deltas(self):
+    """The list of delta-cores."""
+    return self._deltas
+
+  @property
+  def tangent_space(self):
+    """The `TangentSpace` the vector belongs to."""
+    return self._tangent_space
+
+  @property
+  def dtype(self):
+    return self._tangent_space.point.dtype.base_dtype
+
+  def to_tt(self, name='t3f_tangent_vector_to_tt'):
+    """Assembles the TT-representation of the vector.
+
+    Args:
+      name: string, name of the Op.
+
+    Returns:
+      `TensorTrain` (or `TensorTrainBatch` for a `TangentVectorBatch`) with
+      TT-ranks twice the TT-ranks of the point.
+    """
+    return self._tangent_space.from_deltas(self._deltas, name=name)
+
+  def _check_compatible(self, other):
+    if type(other) is not type(self):
+      raise ValueError('Expected a %s, got "%s".' %
+                       (type(self).__name__, other))
+    if other.tangent_space is not self._tangent_space:
+      raise ValueError('The tangent vectors belong to different tangent '
+                       'spaces.')
+
+  def _new(self, deltas):
+    return type(self)(deltas, self._tangent_space)
+
+  def __add__(self, other):
+    """Returns the sum of two tangent vectors of the same tangent space."""
+    self._check_compatible(other)
+    return self._new([a + b for a, b in zip(self._deltas, other.deltas)])
+
+  def __sub__(self, other):
+    """Returns the difference of two tangent vectors."""
+    self._check_compatible(other)
+    return self._new([a - b for a, b in zip(self._deltas, other.deltas)])
+
+  def __neg__(self):
+    return self._new([-d for d in self._deltas])
+
+  def __mul__(self, alpha):
+    """Multiplies the tangent vector by a scalar."""
+    alpha = tf.cast(alpha, self.dtype)
+    return self._new([alpha * d for d in self._deltas])
+
+  def __rmul__(self, alpha):
+    return self.__mul__(alpha)
+
+  def flat_inner(self, other, name='t3f_tangent_vector_flat_inner'):
+    """Inner product with another vector of the same tangent space.
+
+    Since the components of the tangent vectors are orthogonal because of the
+    gauge conditions, the inner product is the sum of the inner products of
+    the deltas.
+
+    Args:
+      other: `TangentVector` or `TangentVectorBatch` of the same tangent
+        space. If one of the arguments is a batch, returns the inner products
+        of each vector of the batch (two batches should be of the same
+        batch size).
+      name: string, name of the Op.
+
+    Returns:
+      a 0-D tf.Tensor (a 1-D tf.Tensor of size batch_size for batches).
+
+    Complexity:
+      O(d r n r) where r is the largest TT-rank of the point.
+    """
+    if not isinstance(other, TangentVector):
+      raise ValueError('Expected a TangentVector, got "%s".' % other)
+    if other.tangent_space is not self._tangent_space:
+      raise ValueError('The tangent vectors belong to different tangent '
+                       'spaces.')
+    core_ndims = len(self._tangent_space.point.tt_cores[0].shape)
+    with tf.name_scope(name, values=self._deltas + other.deltas):
+      res = 0
+      for a, b in zip(self._deltas, other.deltas):
+        prod = utils.upcast(a) * utils.upcast(b)
+        res += tf.reduce_sum(prod, axis=list(range(-core_ndims, 0)))
+      return tf.cast(res, self.dtype)
+
+  def frobenius_norm_squared(self, name='t3f_tangent_vector_norm_squared'):
+    """Squared Frobenius norm of the vector, see `flat_inner`."""
+    return self.flat_inner(self, name=name)
+
+  def frobenius_norm(self, epsilon=1e-5, name='t3f_tangent_vector_norm'):
+    """Frobenius norm of the vector.
+
+    Args:
+      epsilon: the function actually computes sqrt(norm_squared + epsilon) for
+        numerical stability (e.g. gradient of sqrt at zero is inf).
+      name: string, name of the Op.
+
+    Returns:
+      a 0-D tf.Tensor (a 1-D tf.Tensor of size batch_size for batches).
+    """
+    with tf.name_scope(name, values=self._deltas):
+      return tf.sqrt(self.frobenius_norm_squared() + epsilon)
+
+  def __str__(self):
+    return 'A tangent vector at %s' % self._tangent_space.point
+
+
+class TangentVectorBatch(TangentVector):
+  """A batch of elements of a tangent space stored as the deltas only.
+
+  Each delta has a leading batch dimension, the orthogonalized TT-cores of
+  the point are shared by all the vectors of the batch.
+  """
+
+  def __init__(self, deltas, tangent_space):
+    """Creates a `TangentVectorBatch` from deltas.
+
+    Args:
+      deltas: a list of d delta-cores with a leading batch dimension obeying
+        the gauge conditions.
+      tangent_space: `TangentSpace` the vectors belong to.
+
+    Raises:
+      ValueError if the number of deltas is not the number of TT-cores of the
+        tangent space point.
+    """
+    super(TangentVectorBatch, self).__init__(deltas, tangent_space)
+    self._batch_size = self._deltas[0].shape.as_list()[0]
+
+  @property
+  def batch_size(self):
+    """The number of vectors in the batch (None if unknown)."""
+    return self._batch_size
+
+  def __getitem__(self, idx):
+    """Returns the idx-th `TangentVector` (or a sub-batch for a slice)."""
+    deltas = [d[idx] for d in self._deltas]
+    if isinstance(idx, slice):
+      return TangentVectorBatch(deltas, self._tangent_space)
+    return TangentVector(deltas, self._tangent_space)
+
+  def reduce_sum(self, weights=None, name='t3f_tangent_vector_reduce_sum'):
+    """Weighted sum of the vectors of the batch.
+
+    Args:
+      weights: None or a 1-D tf.Tensor (or anything convertible to it) of size
+        batch_size. None means all the weights are 1.
+      name: string, name of the Op.
+
+    Returns:
+      `TangentVector`.
+    """
+    with tf.name_scope(name, values=self._deltas):
+      if weights is None:
+        deltas = [tf.reduce_sum(d, axis=0) for d in self._deltas]
+      else:
+        weights = tf.cast(weights, self.dtype)
+        deltas = [tf.tensordot(weights, d, axes=1) for d in self._deltas]
+      return TangentVector(deltas, self._tangent_space)
+
+  def pairwise_flat_inner(self, other=None,
+                          name='t3f_tangent_vector_pairwise_flat_inner'):
+    """Matrix of the inner products between the vectors of two batches.
+
+    Args:
+      other: `TangentVectorBatch` of the same tangent space or None (the Gram
+        matrix of `self`).
+      name: string, name of the Op.
+
+    Returns:
+      a 2-D tf.Tensor of size self.batch_size x other.batch_size.
+    """
+    if other is None:
+      other = self
+    self._check_compatible(other)
+    with tf.name_scope(name, values=self._deltas + other.deltas):
+      res = 0
+      for a, b in zip(self._deltas, other.deltas):
+        a = tf.reshape(utils.upcast(a), (tf.shape(a)[0], -1))
+        b = tf.reshape(utils.upcast(b), (tf.shape(b)[0], -1))
+        res += tf.matmul(a, b, transpose_b=True)
+      return tf.cast(res, self.dtype)
+
+  def __str__(self):
+    return 'A batch of %s tangent vectors at %s' % (self._batch_size,
+                                                   self._tangent_space.point)
@@ -0,0 +1,167 @@
+import numpy as np
+import tensorflow.compat.v1 as tf
+
+from t3f import ops
+from t3f import batch_ops
+from t3f import initializers
+from t3f import riemannian
+from t3f.tangent_space import TangentSpace
+from t3f.tangent_space import TangentVector
+from t3f.tangent_space import TangentVectorBatch
+
+
+class _TangentSpaceTest():
+
+  def testProject(self):
+    with self.test_session() as sess:
+      x = initializers.random_tensor((2, 3, 4), tt_rank=3, dtype=self.dtype)
+      what = initializers.random_tensor_batch(
+          (2, 3, 4), tt_rank=2, batch_size=3, dtype=self.dtype)
+      tangent_space = TangentSpace(x)
+      proj = tangent_space.project(what)
+      self.assertIs(x, proj.projection_on)
+      desired = riemannian.project(what, x)
+      proj_sum = tangent_space.project_sum(what, [1., 2., -1.])
+      desired_sum = riemannian.project_sum(what, x, [1., 2., -1.])
+      res = sess.run((ops.full(proj), ops.full(desired),
+                      ops.full(proj_sum), ops.full(desired_sum)))
+      self.assertAllClose(res[1], res[0])
+      self.assertAllClose(res[3], res[2])
+
+  def testProjectMatmul(self):
+    with self.test_session() as sess:
+      shape = ((2, 3), (3, 2))
+      x = initializers.random_matrix(shape, tt_rank=3, dtype=self.dtype)
+      matrix = initializers.random_matrix(
+          (shape[0], shape[0]), tt_rank=2, dtype=self.dtype)
+      what = initializers.random_matrix_batch(
+          shape, tt_rank=2, batch_size=2, dtype=self.dtype)
+      tangent_space = TangentSpace(x)
+      proj = tangent_space.project_matmul(what, matrix)
+      desired = riemannian.project_matmul(what, x, matrix)
+      actual_val, desired_val = sess.run((ops.full(proj), ops.full(desired)))
+      self.assertAllClose(desired_val, actual_val)
+
+  def testOrthogonalizesOnce(self):
+    x = initializers.random_tensor((2, 3, 4, 3), tt_rank=3, dtype=self.dtype)
+    graph = tf.get_default_graph()
+    num_qr = lambda: len([op for op in graph.get_operations()
+                          if op.type == 'Qr'])
+    tangent_space = TangentSpace(x)
+    num_qr_before = num_qr()
+    for _ in range(3):
+      what = initializers.random_tensor((2, 3, 4, 3), tt_rank=2,
+                                        dtype=self.dtype)
+      tangent_space.project(what)
+      tangent_space.project_sum(what)
+    tangent_space.from_deltas(tangent_space.to_deltas(
+        tangent_space.project(what)))
+    self.assertEqual(num_qr_before, num_qr())
+
+  def testDeltasRoundTrip(self):
+    with self.test_session() as sess:
+      x = initializers.random_tensor((2, 3, 4), tt_rank=2, dtype=self.dtype)
+      what = initializers.random_tensor(
+          (2, 3, 4), tt_rank=3, dtype=self.dtype)
+      tangent_space = TangentSpace(x)
+      proj = tangent_space.project(what)
+      res = tangent_space.from_deltas(tangent_space.to_deltas(proj))
+      self.assertIs(x, res.projection_on)
+      actual_val, desired_val = sess.run((ops.full(res), ops.full(proj)))
+      self.assertAllClose(desired_val, actual_val)
+
+  def testProjectToVector(self):
+    with self.test_session() as sess:
+      x = initializers.random_matrix(((2, 3, 2), (3, 2, 2)), tt_rank=3,
+                                     dtype=self.dtype)
+      what = initializers.random_matrix_batch(
+          ((2, 3, 2), (3, 2, 2)), tt_rank=2, batch_size=3, dtype=self.dtype)
+      tangent_space = TangentSpace(x)
+      vectors = tangent_space.project_to_vector(what)
+      self.assertIsInstance(vectors, TangentVectorBatch)
+      self.assertEqual(3, vectors.batch_size)
+      vector = tangent_space.project_to_vector(what[1])
+      self.assertIsInstance(vector, TangentVector)
+      desired = riemannian.project(what, x)
+      res = sess.run((ops.full(vectors.to_tt()), ops.full(desired),
+                      ops.full(vector.to_tt()), ops.full(vectors[1].to_tt())))
+      self.assertAllClose(res[1], res[0])
+      self.assertAllClose(res[1][1], res[2])
+      self.assertAllClose(res[1][1], res[3])
+
+  def testVectorLinearAlgebra(self):
+    with self.test_session() as sess:
+      x = initializers.random_tensor((2, 3, 4, 3), tt_rank=3, dtype=self.dtype)
+      what = initializers.random_tensor_batch(
+          (2, 3, 4, 3), tt_rank=2, batch_size=4, dtype=self.dtype)
+      tangent_space = TangentSpace(x)
+      vectors = tangent_space.project_to_vector(what)
+      a, b = vectors[0], vectors[1]
+      proj = riemannian.project(what, x)
+      proj_a, proj_b = proj[0], proj[1]
+      combination = 2.0 * a - b * 0.5 + (-a)
+      desired_combination = ops.full(proj_a) - 0.5 * ops.full(proj_b)
+      weights = np.array([1., -2., 0.5, 3.])
+      reduced = vectors.reduce_sum(weights)
+      desired_reduced = riemannian.project_sum(what, x, weights)
+      res = sess.run({
+          'combination': ops.full(combination.to_tt()),
+          'desired_combination': desired_combination,
+          'reduced': ops.full(reduced.to_tt()),
+          'desired_reduced': ops.full(desired_reduced),
+          'inner': a.flat_inner(b),
+          'desired_inner': ops.flat_inner(proj_a, proj_b),
+          'norm': a.frobenius_norm(epsilon=0),
+          'desired_norm': ops.frobenius_norm(proj_a, epsilon=0),
+          'batch_inner': vectors.flat_inner(a),
+          'desired_batch_inner': ops.flat_inner(proj, proj_a),
+          'gram': vectors.pairwise_flat_inner(),
+          'desired_gram': batch_ops.gram_matrix(proj),
+      })
+      for key in ['combination', 'reduced', 'inner', 'norm', 'batch_inner',
+                  'gram']:
+        self.assertAllClose(res['desired_' + key], res[key])
+
+  def testRetractVector(self):
+    with self.test_session() as sess:
+      x = initializers.random_tensor((2, 3, 4, 3), tt_rank=3, dtype=self.dtype)
+      what = initializers.random_tensor(
+          (2, 3, 4, 3), tt_rank=2, dtype=self.dtype)
+      tangent_space = TangentSpace(x)
+      vector = tangent_space.project_to_vector(what)
+      res = riemannian.retract(x, vector, 0.5)
+      desired = riemannian.retract(x, tangent_space.project(what), 0.5)
+      actual_val, desired_val = sess.run((ops.full(res), ops.full(desired)))
+      self.assertAllClose(desired_val, actual_val)
+
+  def testVectorErrors(self):
+    x = initializers.random_tensor((2, 3, 4), tt_rank=2, dtype=self.dtype)
+    what = initializers.random_tensor((2, 3, 4), tt_rank=2, dtype=self.dtype)
+    a = TangentSpace(x).project_to_vector(what)
+    b = TangentSpace(x).project_to_vector(what)
+    with self.assertRaises(ValueError):
+      a + b
+    with self.assertRaises(ValueError):
+      a.flat_inner(b)
+    with self.assertRaises(ValueError):
+      TangentVector(a.deltas[:2], a.tangent_space)
+
+  def testErrors(self):
+    x = initializers.random_tensor((2, 3, 4), tt_rank=2, dtype=self.dtype)
+    y = initializers.random_tensor((2, 3, 4), tt_rank=2, dtype=self.dtype)
+    with self.assertRaises(ValueError):
+      TangentSpace(np.ones((2, 3, 4)))
+    with self.assertRaises(ValueError):
+      TangentSpace(x).to_deltas(riemannian.project(y, y))
+
+
+class TangentSpaceTestFloat32(tf.test.TestCase, _TangentSpaceTest):
+  dtype = tf.float32
+
+
+class TangentSpaceTestFloat64(tf.test.TestCase, _TangentSpaceTest):
+  dtype = tf.float64
+
+
+if __name__ == "__main__":
+  tf.test.main()
@@ -48,3 +48,165 @@ def in_eager_mode():
       return context.in_eager_mode()
   except ImportError:
       return False
+
+
+def accumulation_dtype(dtype):
+  """Returns the dtype in which t3f accumulates products of `dtype` tensors.
+
+  TT-cores can be stored in 16-bit floating point (tf.float16 or tf.bfloat16)
+  to halve the memory and the bandwidth, but the chains of d einsums (or
+  matmuls) in e.g. t3f.flat_inner lose accuracy if accumulated in 16 bits.
+  So such ops cast the TT-cores (or their slices) to float32 right before
+  using them and cast the result back to the dtype of the TT-cores (so e.g.
+  norms larger than 65504 overflow in tf.float16, use tf.bfloat16 for a wider
+  range). Decompositions (QR, SVD) are computed in float32 as well.
+
+  Args:
+    dtype: tf.DType or anything convertible to it.
+
+  Returns:
+    tf.float32 for 16-bit floating point dtypes and `dtype` otherwise.
+  """
+  dtype = tf.as_dtype(dtype)
+  if dtype in (tf.float16, tf.bfloat16):
+    return tf.float32
+  return dtype
+
+
+def upcast(tensor):
+  """Casts a tensor to its accumulation_dtype (float32 for 16-bit floats)."""
+  return tf.cast(tensor, accumulation_dtype(tensor.dtype))
+
+
+# Contraction order used by `einsum`, see `set_contraction_order`.
+_CONTRACTION_ORDER = 'auto'
+# Size assumed for the dimensions which are unknown on graph construction.
+_UNKNOWN_DIM_SIZE = 64
+
+
+def set_contraction_order(order):
+  """Sets how multi-operand einsums inside t3f are contracted.
+
+  Args:
+    order: string, either
+      'auto' (the default): contract the operands pairwise in the order with
+        the smallest number of flops, estimated from the static shapes;
+      'naive': pass the expression to tf.einsum as is.
+
+  Raises:
+    ValueError if order is neither 'auto' nor 'naive'.
+  """
+  global _CONTRACTION_ORDER
+  if order not in ('auto', 'naive'):
+    raise ValueError('Expected contraction order to be "auto" or "naive", got '
+                     '"%s" instead.' % order)
+  _CONTRACTION_ORDER = order
+
+
+def get_contraction_order():
+  """Returns the contraction order set by `set_contraction_order`."""
+  return _CONTRACTION_ORDER
+
+
+def _dim_sizes(input_subscripts, operands):
+  """Maps each index letter to its static size (or a guess if unknown)."""
+  sizes = {}
+  for subscripts, operand in zip(input_subscripts, operands):
+    shape = operand.get_shape()
+    if shape.ndims is None:
+      shape = [None] * len(subscripts)
+    else:
+      shape = shape.as_list()
+    for letter, size in zip(subscripts, shape):
+      if size is not None:
+        sizes[letter] = size
+      else:
+        sizes.setdefault(letter, None)
+  for letter in sizes:
+    if sizes[letter] is None:
+      sizes[letter] = _UNKNOWN_DIM_SIZE
+  return sizes
+
+
+def _contraction_path(input_subscripts, output_subscripts, sizes):
+  """Finds the cheapest order of pairwise contractions by exhaustive search.
+
+  The cost of contracting two operands is the product of the sizes of all the
+  indices involved, i.e. the number of multiply-adds of the pairwise einsum.
+
+  Args:
+    input_subscripts: list of strings, subscripts of the operands.
+    output_subscripts: string, subscripts of the result.
+    sizes: dict from index letter to its size.
+
+  Returns:
+    (cost, path) where path is a list of tuples (i, j, subscripts): contract
+    the i-th and the j-th current operands into a new operand with the given
+    subscripts, which is appended to the end of the list of operands.
+  """
+  if len(input_subscripts) == 1:
+    return 0, []
+  best_cost, best_path = None, None
+  num_operands = len(input_subscripts)
+  for i in range(num_operands):
+    for j in range(i + 1, num_operands):
+      rest = [s for k, s in enumerate(input_subscripts) if k not in (i, j)]
+      keep = set(output_subscripts).union(*rest)
+      union = input_subscripts[i] + input_subscripts[j]
+      # Order the result as (shared, left only, right only) indices, the layout
+      # in which the batched matmul behind tf.einsum produces it, so that no
+      # transpose of the intermediate result is needed.
+      new_subscripts = ''.join(
+          [l for l in input_subscripts[i]
+           if l in keep and l in input_subscripts[j]] +
+          [l for l in input_subscripts[i]
+           if l in keep and l not in input_subscripts[j]] +
+          [l for l in input_subscripts[j]
+           if l in keep and l not in input_subscripts[i]])
+      cost = np.prod([sizes[letter] for letter in set(union)], dtype=float)
+      rest_cost, rest_path = _contraction_path(rest + [new_subscripts],
+                                               output_subscripts, sizes)
+      cost += rest_cost
+      if best_cost is None or cost < best_cost:
+        best_cost = cost
+        best_path = [(i, j, new_subscripts)] + rest_path
+  return best_cost, best_path
+
+
+def einsum(subscripts, *operands):
+  """tf.einsum which contracts three or more operands in the cheapest order.
+
+  The best order of pairwise contractions depends on the TT-ranks and the
+  mode sizes, so instead of relying on the order in which the operands are
+  listed, all the orders are compared by the number of flops (computed from
+  the static shapes) and the cheapest one is executed as a sequence of
+  two-operand tf.einsum calls.
+  Use `set_contraction_order('naive')` to call tf.einsum directly instead.
+
+  Args:
+    subscripts: string, an explicit (with '->') einsum expression.
+    *operands: tf.Tensors.
+
+  Returns:
+    tf.Tensor, the same as tf.einsum(subscripts, *operands).
+  """
+  if _CONTRACTION_ORDER == 'naive' or len(operands) < 3:
+    return tf.einsum(subscripts, *operands)
+  input_subscripts, output_subscripts = subscripts.replace(' ', '').split('->')
+  input_subscripts = input_subscripts.split(',')
+  operands = [tf.convert_to_tensor(operand) for operand in operands]
+  sizes = _dim_sizes(input_subscripts, operands)
+  _, path = _contraction_path(input_subscripts, output_subscripts, sizes)
+  for i, j, new_subscripts in path:
+    pair_str = '%s,%s->%s' % (input_subscripts[i], input_subscripts[j],
+                              new_subscripts)
+    new_operand = tf.einsum(pair_str, operands[i], operands[j])
+    input_subscripts = [s for k, s in enumerate(input_subscripts)
+                        if k not in (i, j)] + [new_subscripts]
+    operands = [op for k, op in enumerate(operands) if k not in (i, j)]
+    operands.append(new_operand)
+  if input_subscripts[0] != output_subscripts:
+    # Only the order of the indices can differ at this point.
+    return tf.einsum('%s->%s' % (input_subscripts[0], output_subscripts),
+                     operands[0])
+  return operands[0]
@@ -32,5 +32,52 @@ class UtilsTest(tf.test.TestCase):
       self.assertAllClose(np.abs(np.dot(actual[2].T, desired[2])), np.eye(2))
 
 
+  def testEinsum(self):
+    np.random.seed(0)
+    a = np.random.randn(2, 3, 4).astype(np.float32)
+    b = np.random.randn(3, 5, 2).astype(np.float32)
+    c = np.random.randn(4, 5).astype(np.float32)
+    d = np.random.randn(6, 2).astype(np.float32)
+    with self.test_session() as sess:
+      for subscripts, operands in [('abc,bda,cd->', (a, b, c)),
+                                   ('abc,bde,cd->ea', (a, b, c)),
+                                   ('abc,bde,cd,fe->fa', (a, b, c, d))]:
+        desired = np.einsum(subscripts, *operands)
+        actual = utils.einsum(subscripts, *operands)
+        self.assertAllClose(desired, sess.run(actual), rtol=1e-4, atol=1e-4)
+      # Unknown shapes.
+      a_ph = tf.placeholder(tf.float32)
+      b_ph = tf.placeholder(tf.float32, (None, 5, None))
+      actual = utils.einsum('abc,bde,cd->ea', a_ph, b_ph, c)
+      desired = np.einsum('abc,bde,cd->ea', a, b, c)
+      self.assertAllClose(desired, sess.run(actual, {a_ph: a, b_ph: b}),
+                          rtol=1e-4, atol=1e-4)
+
+  def testEinsumPicksCheapestOrder(self):
+    # Contracting the small vectors with the matrix first is cheaper than
+    # forming their 1000 x 1000 outer product.
+    sizes = {'a': 1000, 'b': 1000}
+    cost, path = utils._contraction_path(['a', 'ab', 'b'], '', sizes)
+    self.assertEqual(cost, 1000 * 1000 + 1000)
+    self.assertIn(path[0][:2], [(0, 1), (1, 2)])
+
+  def testSetContractionOrder(self):
+    self.assertEqual('auto', utils.get_contraction_order())
+    try:
+      utils.set_contraction_order('naive')
+      self.assertEqual('naive', utils.get_contraction_order())
+      with self.test_session() as sess:
+        a = np.random.randn(2, 3).astype(np.float32)
+        b = np.random.randn(3, 4).astype(np.float32)
+        c = np.random.randn(4, 2).astype(np.float32)
+        actual = utils.einsum('ab,bc,ca->', a, b, c)
+        desired = np.einsum('ab,bc,ca->', a, b, c)
+        self.assertAllClose(desired, sess.run(actual), rtol=1e-4, atol=1e-4)
+    finally:
+      utils.set_contraction_order('auto')
+    with self.assertRaises(ValueError):
+      utils.set_contraction_order('greedy')
+
+
 if __name__ == "__main__":
   tf.test.main()